@@ -1,27 +1,37 @@
-import pandas as pd
-from sentence_transformers import SentenceTransformer
-import faiss
+"""
+Interactive terminal recommender (Sentence Transformer + FAISS + Gemini).
+
+The product CSV, the sentence encoder, the embeddings and the FAISS index are
+loaded by get_engine() on first use, together with the heavy imports
+(pandas, sentence_transformers, faiss), and cached for the life of the
+process, so importing this module does no I/O and loads no model. Check the
+cold-start cost with model/import_budget.py.
+"""
+
 import numpy as np
-import requests
 import os
 import pickle
 from dotenv import load_dotenv
+import sys
 import json
 import time
+import threading
+
+# Make the shared model/ utilities importable
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model.vector_store import open_or_convert, save_vector_store, store_exists
 
 # Load environment variables from .env file
 load_dotenv()
 
 # File paths for saved embeddings and index
 EMBEDDINGS_PATH = "/Recomend/product_embeddings.pkl"
+# Memory-mapped vector store that replaces the embeddings pickle
+EMBEDDINGS_STORE_PATH = "/Recomend/product_embeddings"
 FAISS_INDEX_PATH = "/Recomend/product_index.faiss"
 PRODUCT_INFO_PATH = "/Recomend/product_info.pkl"
-
 # Use absolute path for the CSV file
-df = pd.read_csv("/Recomend/products.csv")
-
-# Initialize Sentence Transformer model
-model = SentenceTransformer("all-MiniLM-L6-v2")
+PRODUCTS_CSV_PATH = "/Recomend/products.csv"
 
 
 # Function to preprocess product data and create embeddings
@@ -40,55 +50,94 @@ def create_product_embeddings(df, model):
     return product_embeddings
 
 
-# Check if embeddings and index already exist, if not create and save them
-if not os.path.exists(EMBEDDINGS_PATH) or not os.path.exists(FAISS_INDEX_PATH):
-    print("Creating embeddings and FAISS index for the first time...")
-
-    # Create product embeddings
-    product_embeddings = create_product_embeddings(df, model)
-
-    # Build a FAISS index
-    dimension = product_embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(np.array(product_embeddings, dtype=np.float32))
-
-    # Store product information for easy access
-    product_info = {
-        i: {
-            "ID": row["ID"],
-            "Product Name": row["Product Name"],
-            "Description": row["Product Description"],
-            "Price": row["Price"],
-            "Color": row["Color"],
-        }
-        for i, row in df.iterrows()
-    }
+class RecommendationEngine:
+    """The product catalogue, sentence encoder, embeddings and FAISS index."""
+
+    def __init__(self):
+        import pandas as pd
+        import faiss
+        from sentence_transformers import SentenceTransformer
+
+        self.df = pd.read_csv(PRODUCTS_CSV_PATH)
+
+        # Initialize Sentence Transformer model
+        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+
+        # Check if embeddings and index already exist, if not create and save them
+        if not (
+            store_exists(EMBEDDINGS_STORE_PATH) or os.path.exists(EMBEDDINGS_PATH)
+        ) or not os.path.exists(FAISS_INDEX_PATH):
+            print("Creating embeddings and FAISS index for the first time...")
+
+            # Create product embeddings
+            self.product_embeddings = create_product_embeddings(self.df, self.model)
+
+            # Build a FAISS index
+            dimension = self.product_embeddings.shape[1]
+            self.index = faiss.IndexFlatL2(dimension)
+            self.index.add(np.array(self.product_embeddings, dtype=np.float32))
+
+            # Store product information for easy access
+            self.product_info = {
+                i: {
+                    "ID": row["ID"],
+                    "Product Name": row["Product Name"],
+                    "Description": row["Product Description"],
+                    "Price": row["Price"],
+                    "Color": row["Color"],
+                }
+                for i, row in self.df.iterrows()
+            }
 
-    # Save embeddings, index, and product info to disk
-    with open(EMBEDDINGS_PATH, "wb") as f:
-        pickle.dump(product_embeddings, f)
+            # Save embeddings, index, and product info to disk
+            save_vector_store(EMBEDDINGS_STORE_PATH, self.product_embeddings)
 
-    faiss.write_index(index, FAISS_INDEX_PATH)
+            faiss.write_index(self.index, FAISS_INDEX_PATH)
 
-    with open(PRODUCT_INFO_PATH, "wb") as f:
-        pickle.dump(product_info, f)
+            with open(PRODUCT_INFO_PATH, "wb") as f:
+                pickle.dump(self.product_info, f)
+
+            print(f"Embeddings saved to {EMBEDDINGS_STORE_PATH}")
+            print(f"FAISS index saved to {FAISS_INDEX_PATH}")
+            print(f"Product info saved to {PRODUCT_INFO_PATH}")
+        else:
+            print("Loading pre-computed embeddings and FAISS index...")
+
+            # Load embeddings and index from disk
+            # Memory-mapped; a legacy pickle is converted to the store on first load
+            self.product_embeddings = open_or_convert(
+                EMBEDDINGS_STORE_PATH, EMBEDDINGS_PATH
+            )
+
+            self.index = faiss.read_index(FAISS_INDEX_PATH)
+
+            with open(PRODUCT_INFO_PATH, "rb") as f:
+                self.product_info = pickle.load(f)
+
+            print("Embeddings and index loaded successfully.")
 
-    print(f"Embeddings saved to {EMBEDDINGS_PATH}")
-    print(f"FAISS index saved to {FAISS_INDEX_PATH}")
-    print(f"Product info saved to {PRODUCT_INFO_PATH}")
-else:
-    print("Loading pre-computed embeddings and FAISS index...")
 
-    # Load embeddings and index from disk
-    with open(EMBEDDINGS_PATH, "rb") as f:
-        product_embeddings = pickle.load(f)
+_engine = None
+_engine_lock = threading.Lock()
 
-    index = faiss.read_index(FAISS_INDEX_PATH)
 
-    with open(PRODUCT_INFO_PATH, "rb") as f:
-        product_info = pickle.load(f)
+def get_engine():
+    """Return the process-wide RecommendationEngine, loading it on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = RecommendationEngine()
+        return _engine
 
-    print("Embeddings and index loaded successfully.")
+
+# Names that used to be loaded at import time, now read from the engine
+_ENGINE_ATTRIBUTES = ("df", "model", "product_embeddings", "index", "product_info")
+
+
+def __getattr__(name):
+    if name in _ENGINE_ATTRIBUTES:
+        return getattr(get_engine(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # Function to convert user input into a vector
@@ -96,7 +145,7 @@ def user_input_to_vector(user_input):
     # Convert the user input into a single string
     user_input_str = f"Skin Tone: {user_input['skin_tone']}, Season: {user_input['season']}, Event: {user_input['event']}, Budget: {user_input['budget']}"
     # Get the embedding of the user input
-    user_vector = model.encode([user_input_str])
+    user_vector = get_engine().model.encode([user_input_str])
     return user_vector
 
 
@@ -109,6 +158,8 @@ def find_best_matching_products(user_vector, index, top_n=3):
 
 # Function to get an explanation from Gemini API
 def get_gemini_explanation(user_input, recommended_product):
+    import requests
+
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         return "API key not found. Please set the GEMINI_API_KEY environment variable."
@@ -248,16 +299,20 @@ def recommend_products_with_explanations(user_input):
             f"\nFinding recommendations for {user_input['skin_tone']} skin tone, {user_input['season']} season, {user_input['event']} event, with budget {user_input['budget']}..."
         )
 
+        engine = get_engine()
+
         # Convert user input to embedding
         user_vector = user_input_to_vector(user_input)
 
         # Find the best matching products using FAISS
-        top_product_indices = find_best_matching_products(user_vector, index, top_n=3)
+        top_product_indices = find_best_matching_products(
+            user_vector, engine.index, top_n=3
+        )
 
         # Fetch the recommended products and explanations
         recommended_products = []
         for idx in top_product_indices:
-            product = product_info[idx]
+            product = engine.product_info[idx]
             print(f"Getting explanation for {product['Product Name']}...")
             explanation = get_gemini_explanation(user_input, product)
             recommended_products.append(
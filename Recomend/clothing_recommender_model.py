@@ -3,11 +3,28 @@ from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import json
 import pickle
 from dotenv import load_dotenv
+import sys
 import time
 import logging
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, TimeoutError
+
+# Make the shared model/ utilities importable
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model.vector_store import open_or_convert, save_vector_store, store_exists
+from model.quantized_index import load_index
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from facet_index import FacetIndex, search_filtered
+from explanation_cache import ExplanationCache
 
 # Set up logging
 logging.basicConfig(
@@ -24,6 +41,39 @@ PRICE_RANGES = {
     "premium": (10000, float("inf")),  # Above 10000
 }
 
+# FAISS index storage: "float32" (exact), or scalar-quantized "float16"/"int8"
+# codes rescored against the memory-mapped embeddings
+INDEX_STORAGE = os.getenv("RECOMMENDER_INDEX_STORAGE", "float32")
+
+# Seasons offered to the user; season only shapes the query text
+SEASONS = ["Summer", "Winter", "Spring", "Autumn"]
+
+# Maximum number of query vectors kept in the LRU cache
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+# Outbound Gemini calls in flight at once, shared by all requests (API quota)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+# (connect, read) timeout of a single Gemini call, in seconds
+GEMINI_TIMEOUT = (3, 10)
+# Time budget for all explanations of one recommend() call, in seconds
+EXPLANATION_DEADLINE = float(os.getenv("EXPLANATION_DEADLINE", "6"))
+# "batch" explains all products in one Gemini call, "per_item" in one call each
+EXPLANATION_MODE = os.getenv("EXPLANATION_MODE", "batch")
+# Batch calls per recommend(); later attempts only carry unexplained products
+EXPLANATION_BATCH_ATTEMPTS = 2
+
+# Bump whenever the explanation prompts change, to retire cached explanations
+EXPLANATION_PROMPT_VERSION = 1
+EXPLANATION_CACHE_PATH = os.getenv(
+    "EXPLANATION_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "explanation_cache.db"),
+)
+EXPLANATION_CACHE_TTL = float(os.getenv("EXPLANATION_CACHE_TTL", str(30 * 24 * 3600)))
+EXPLANATION_CACHE_MAX_ENTRIES = int(
+    os.getenv("EXPLANATION_CACHE_MAX_ENTRIES", "100000")
+)
+
 
 class ClothingRecommender:
     """A reusable recommendation system for clothing products based on user preferences."""
@@ -35,6 +85,8 @@ class ClothingRecommender:
         faiss_index_path="enhanced_product_index.faiss",
         product_info_path="enhanced_product_info.pkl",
         model_name="all-MiniLM-L6-v2",
+        warm_query_cache=False,
+        explanation_cache_path=EXPLANATION_CACHE_PATH,
     ):
         """
         Initialize the ClothingRecommender with paths and model settings.
@@ -45,12 +97,16 @@ class ClothingRecommender:
             faiss_index_path: Path to save/load FAISS index
             product_info_path: Path to save/load product information
             model_name: Name of the sentence transformer model to use
+            warm_query_cache: Pre-encode every filter combination at startup
+            explanation_cache_path: SQLite file for cached explanations (None disables)
         """
         # Load environment variables
         load_dotenv()
 
         # Store paths
         self.embeddings_path = embeddings_path
+        # Embeddings live in a memory-mapped vector store next to the legacy pickle
+        self.embeddings_store_path = os.path.splitext(embeddings_path)[0]
         self.faiss_index_path = faiss_index_path
         self.product_info_path = product_info_path
 
@@ -59,7 +115,11 @@ class ClothingRecommender:
 
         # Load or create embeddings and index
         if csv_path and (
-            not os.path.exists(embeddings_path) or not os.path.exists(faiss_index_path)
+            not (
+                store_exists(self.embeddings_store_path)
+                or os.path.exists(embeddings_path)
+            )
+            or not os.path.exists(faiss_index_path)
         ):
             self._initialize_from_csv(csv_path)
         else:
@@ -68,6 +128,32 @@ class ClothingRecommender:
         # Extract available options from the dataset
         self._extract_filter_options()
 
+        # Query string -> encoded query vector, least recently used first
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+        if warm_query_cache:
+            self.warm_query_cache()
+
+        # Keep-alive connection pool and worker threads for Gemini calls; the
+        # semaphore also bounds direct get_explanation() calls
+        self._session = self._create_gemini_session()
+        self._explanation_pool = ThreadPoolExecutor(
+            max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix="gemini"
+        )
+        self._gemini_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+
+        # Generated explanations persist across requests and restarts
+        self.explanation_cache = None
+        if explanation_cache_path:
+            self.explanation_cache = ExplanationCache(
+                explanation_cache_path,
+                prompt_version=EXPLANATION_PROMPT_VERSION,
+                ttl_seconds=EXPLANATION_CACHE_TTL,
+                max_entries=EXPLANATION_CACHE_MAX_ENTRIES,
+            )
+
     def _initialize_from_csv(self, csv_path):
         """Initialize embeddings and index from CSV file."""
         logger.info("Creating embeddings and FAISS index for the first time...")
@@ -106,10 +192,13 @@ class ClothingRecommender:
             self.product_info[i] = product_info
 
         # Save to disk
-        with open(self.embeddings_path, "wb") as f:
-            pickle.dump(self.product_embeddings, f)
+        save_vector_store(self.embeddings_store_path, self.product_embeddings)
 
         faiss.write_index(self.index, self.faiss_index_path)
+        if INDEX_STORAGE != "float32":
+            self.index = load_index(
+                self.faiss_index_path, self.product_embeddings, INDEX_STORAGE
+            )
 
         with open(self.product_info_path, "wb") as f:
             pickle.dump(self.product_info, f)
@@ -122,10 +211,14 @@ class ClothingRecommender:
         logger.info("Loading pre-computed embeddings and FAISS index...")
         print("Loading pre-computed embeddings and FAISS index...")
 
-        with open(self.embeddings_path, "rb") as f:
-            self.product_embeddings = pickle.load(f)
+        # Memory-mapped; a legacy pickle is converted to the store on first load
+        self.product_embeddings = open_or_convert(
+            self.embeddings_store_path, self.embeddings_path
+        )
 
-        self.index = faiss.read_index(self.faiss_index_path)
+        self.index = load_index(
+            self.faiss_index_path, self.product_embeddings, INDEX_STORAGE
+        )
 
         with open(self.product_info_path, "rb") as f:
             self.product_info = pickle.load(f)
@@ -173,6 +266,30 @@ class ClothingRecommender:
 
         logger.info(f"Available options extracted: {self.available_options}")
 
+        # Resolve each filter's column once and precompute its bitsets
+        self.facet_columns = {
+            "skin_tone": next(
+                (
+                    c
+                    for c in ("Skin Tone Category", "skin_tone")
+                    if c in self.product_df.columns
+                ),
+                None,
+            ),
+            "occasion": next(
+                (c for c in ("Occasion", "event") if c in self.product_df.columns),
+                None,
+            ),
+            "product_type": (
+                "Product Type" if "Product Type" in self.product_df.columns else None
+            ),
+        }
+        self.facet_index = FacetIndex(
+            self.product_df,
+            [c for c in self.facet_columns.values() if c],
+            PRICE_RANGES,
+        )
+
     def get_filter_options(self):
         """
         Get available options for each filter.
@@ -219,11 +336,11 @@ class ClothingRecommender:
         logger.info(f"Encoding {len(product_data)} products")
         return self.model.encode(product_data)
 
-    def _apply_filters(
+    def _filter_bitset(
         self, price_range=None, skin_tone=None, occasion=None, product_type=None
     ):
         """
-        Apply selected filters to the product dataset.
+        Combine the precomputed facet bitsets selected by the filters.
 
         Args:
             price_range: String key for price range ("budget", "mid_range", "premium") or numerical value
@@ -232,157 +349,201 @@ class ClothingRecommender:
             product_type: Optional product type filter
 
         Returns:
-            List of product indices that match the filters
+            Packed bitset of the product indices that match the filters
         """
         logger.info(
             f"Applying filters: price_range={price_range}, skin_tone={skin_tone}, occasion={occasion}, product_type={product_type}"
         )
 
-        # Start with all indices
-        filtered_indices = set(self.product_df.index.tolist())
-        filter_applied = False
+        # Start with all products
+        bits = self.facet_index.all()
 
         # Price filtering
         if price_range:
-            filter_applied = True
-            # Convert prices to numeric if they aren't already
-            if not pd.api.types.is_numeric_dtype(self.product_df["Price"]):
-                self.product_df["Price"] = pd.to_numeric(
-                    self.product_df["Price"], errors="coerce"
-                )
-
             # Handle string price range ("budget", "mid_range", "premium")
             if isinstance(price_range, str) and price_range in PRICE_RANGES:
-                min_price, max_price = PRICE_RANGES[price_range]
+                bits &= self.facet_index.price_bucket(price_range)
             # Handle numeric budget value
             elif isinstance(price_range, (int, float)):
                 # Determine which range it falls into
                 if price_range <= 5000:
-                    min_price, max_price = PRICE_RANGES["budget"]
+                    bits &= self.facet_index.price_bucket("budget")
                 elif price_range <= 10000:
-                    min_price, max_price = PRICE_RANGES["mid_range"]
+                    bits &= self.facet_index.price_bucket("mid_range")
                 else:
-                    min_price, max_price = PRICE_RANGES["premium"]
-            else:
-                # Default to all prices
-                min_price, max_price = 0, float("inf")
-
-            price_indices = set(
-                self.product_df[
-                    (self.product_df["Price"] >= min_price)
-                    & (self.product_df["Price"] <= max_price)
-                ].index.tolist()
-            )
-            filtered_indices = filtered_indices.intersection(price_indices)
-
-        # Skin tone filtering
-        if skin_tone:
-            filter_applied = True
-            # Check which column name is used for skin tone
-            if "Skin Tone Category" in self.product_df.columns:
-                skin_tone_col = "Skin Tone Category"
-            elif "skin_tone" in self.product_df.columns:
-                skin_tone_col = "skin_tone"
+                    bits &= self.facet_index.price_bucket("premium")
             else:
-                skin_tone_col = None
+                # Default to all priced products
+                bits &= self.facet_index.price_between(0, float("inf"))
+
+        # Skin tone, occasion and product type filtering; a filter whose
+        # column is missing from the data does not restrict the results
+        for key, value in (
+            ("skin_tone", skin_tone),
+            ("occasion", occasion),
+            ("product_type", product_type),
+        ):
+            column = self.facet_columns[key]
+            if value and column:
+                bits &= self.facet_index.facet(column, value)
 
-            if skin_tone_col:
-                skin_tone_indices = set(
-                    self.product_df[
-                        self.product_df[skin_tone_col] == skin_tone
-                    ].index.tolist()
-                )
-                filtered_indices = filtered_indices.intersection(skin_tone_indices)
-
-        # Occasion filtering
-        if occasion:
-            filter_applied = True
-            # Check which column name is used for occasion
-            if "Occasion" in self.product_df.columns:
-                occasion_col = "Occasion"
-            elif "event" in self.product_df.columns:
-                occasion_col = "event"
-            else:
-                occasion_col = None
+        logger.info(
+            f"Found {self.facet_index.count(bits)} products after applying filters"
+        )
+        return bits
 
-            if occasion_col:
-                occasion_indices = set(
-                    self.product_df[
-                        self.product_df[occasion_col] == occasion
-                    ].index.tolist()
-                )
-                filtered_indices = filtered_indices.intersection(occasion_indices)
-
-        # Product type filtering
-        if product_type and "Product Type" in self.product_df.columns:
-            filter_applied = True
-            type_indices = set(
-                self.product_df[
-                    self.product_df["Product Type"] == product_type
-                ].index.tolist()
-            )
-            filtered_indices = filtered_indices.intersection(type_indices)
+    def _apply_filters(
+        self, price_range=None, skin_tone=None, occasion=None, product_type=None
+    ):
+        """
+        Apply selected filters to the product dataset.
 
-        # If no filters were applied, return all indices
-        if not filter_applied:
-            return list(self.product_df.index)
+        Args:
+            price_range: String key for price range ("budget", "mid_range", "premium") or numerical value
+            skin_tone: Optional skin tone filter
+            occasion: Optional occasion filter
+            product_type: Optional product type filter
 
-        logger.info(f"Found {len(filtered_indices)} products after applying filters")
-        return list(filtered_indices)
+        Returns:
+            List of product indices that match the filters
+        """
+        bits = self._filter_bitset(price_range, skin_tone, occasion, product_type)
+        return self.facet_index.to_indices(bits)
 
-    def _create_user_query_vector(self, user_input):
+    def _build_query_string(self, user_input):
         """
-        Create query vector from user preferences.
+        Build the text that is encoded as the query vector.
 
         Args:
             user_input: Dictionary with user preferences
 
         Returns:
-            Embedding vector for query
+            Query string
         """
-        # Construct a query string from user preferences
+        # Construct a query string from user preferences; values are stripped
+        # so equivalent inputs share one cache entry
         query_parts = []
 
         if "skin_tone" in user_input and user_input["skin_tone"]:
-            query_parts.append(f"Skin Tone Category: {user_input['skin_tone']}")
+            query_parts.append(
+                f"Skin Tone Category: {str(user_input['skin_tone']).strip()}"
+            )
 
         if "season" in user_input and user_input["season"]:
-            query_parts.append(f"Season: {user_input['season']}")
+            query_parts.append(f"Season: {str(user_input['season']).strip()}")
 
         if "event" in user_input and user_input["event"]:
-            query_parts.append(f"Occasion: {user_input['event']}")
+            query_parts.append(f"Occasion: {str(user_input['event']).strip()}")
 
         if "product_type" in user_input and user_input["product_type"]:
-            query_parts.append(f"Product Type: {user_input['product_type']}")
+            query_parts.append(
+                f"Product Type: {str(user_input['product_type']).strip()}"
+            )
 
         # If no preferences are provided, use a default query
         if not query_parts:
-            query_string = "clothing product"
-        else:
-            query_string = ", ".join(query_parts)
+            return "clothing product"
+        return ", ".join(query_parts)
+
+    def _cache_query_vector(self, query_string, vector):
+        vector = np.array(vector, dtype=np.float32).reshape(1, -1)
+        vector.setflags(write=False)
+        with self._query_cache_lock:
+            self._query_cache[query_string] = vector
+            self._query_cache.move_to_end(query_string)
+            while len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def _create_user_query_vector(self, user_input):
+        """
+        Create query vector from user preferences.
+
+        Query strings come from a small closed set of filter values, so
+        vectors are served from an LRU cache and the sentence transformer
+        only runs on a miss.
+
+        Args:
+            user_input: Dictionary with user preferences
+
+        Returns:
+            Embedding vector for query
+        """
+        query_string = self._build_query_string(user_input)
+
+        with self._query_cache_lock:
+            vector = self._query_cache.get(query_string)
+            if vector is not None:
+                self._query_cache.move_to_end(query_string)
+                self.query_cache_hits += 1
+                logger.info(f"Query vector cache hit: {query_string}")
+                return vector
+            self.query_cache_misses += 1
 
         logger.info(f"Created query string: {query_string}")
 
         # Encode the query
-        return self.model.encode([query_string])
+        return self._cache_query_vector(
+            query_string, self.model.encode([query_string])[0]
+        )
 
-    def get_explanation(self, user_input, recommended_product):
+    def warm_query_cache(self, batch_size=64):
         """
-        Get explanation for recommendation using Gemini API.
+        Pre-encode the query for every combination of filter values.
+
+        Each of skin tone, season, occasion and product type is either unset
+        or one of its available options, so the warmed cache covers every
+        query the dropdowns can produce.
 
         Args:
-            user_input: Dictionary of user preferences
-            recommended_product: Dictionary of product information
+            batch_size: Queries encoded per forward pass
 
         Returns:
-            str: Explanation text
+            int: Number of query vectors cached
         """
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            return (
-                "API key not found. Please set the GEMINI_API_KEY environment variable."
-            )
+        choices = [
+            ("skin_tone", self.available_options.get("skin_tone", [])),
+            ("season", SEASONS),
+            ("event", self.available_options.get("occasion", [])),
+            ("product_type", self.available_options.get("product_type", [])),
+        ]
+
+        query_strings = set()
+        for values in itertools.product(*[[None] + list(opts) for _, opts in choices]):
+            user_input = {key: value for (key, _), value in zip(choices, values)}
+            query_strings.add(self._build_query_string(user_input))
+
+        # Never warm more entries than the cache can hold
+        query_strings = sorted(query_strings)[:QUERY_CACHE_SIZE]
+
+        start_time = time.time()
+        vectors = self.model.encode(query_strings, batch_size=batch_size)
+        for query_string, vector in zip(query_strings, vectors):
+            self._cache_query_vector(query_string, vector)
+
+        logger.info(
+            f"Warmed query cache with {len(query_strings)} vectors in {time.time() - start_time:.2f} seconds"
+        )
+        print(f"Warmed query cache with {len(query_strings)} query vectors")
+        return len(query_strings)
+
+    def _create_gemini_session(self):
+        """Create a pooled HTTP session that retries transient Gemini errors once."""
+        retry = Retry(
+            total=1,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"POST"}),
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=GEMINI_MAX_CONCURRENCY, max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        return session
 
+    def _build_explanation_prompt(self, user_input, recommended_product):
+        """Build the Gemini prompt for one recommended product."""
         prompt = f"""
         As a fashion adviser, explain why this product would be a good recommendation for a user with the following preferences:
         - Skin tone: {user_input.get("skin_tone", "Not specified")}
@@ -406,37 +567,375 @@ class ClothingRecommender:
             prompt += f"- Suitable for: {recommended_product['Skin Tone Category']} skin tones\n"
 
         prompt += "\nProvide a concise explanation (1-2 sentences) focusing on why this is a good match for their needs."
+        return prompt
 
-        url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+    def _post_gemini(self, prompt, api_key, max_output_tokens=150, json_output=False):
+        """
+        Send one prompt to Gemini over the pooled session and return its text.
+
+        Raises on network or HTTP errors so callers can choose a fallback.
+        """
         headers = {"Content-Type": "application/json", "x-goog-api-key": api_key}
 
         payload = {
             "contents": [{"parts": [{"text": prompt}]}],
             "generationConfig": {
                 "temperature": 0.7,
-                "maxOutputTokens": 150,
+                "maxOutputTokens": max_output_tokens,
                 "topP": 0.8,
                 "topK": 40,
             },
         }
+        if json_output:
+            payload["generationConfig"]["responseMimeType"] = "application/json"
+
+        with self._gemini_slots:
+            response = self._session.post(
+                GEMINI_URL, headers=headers, json=payload, timeout=GEMINI_TIMEOUT
+            )
+        response.raise_for_status()
+
+        response_data = response.json()
+        if "candidates" in response_data and len(response_data["candidates"]) > 0:
+            return response_data["candidates"][0]["content"]["parts"][0]["text"].strip()
+        return None
+
+    def _request_explanation(self, user_input, recommended_product, api_key):
+        """Call Gemini for one product's explanation; None if it returned no text."""
+        prompt = self._build_explanation_prompt(user_input, recommended_product)
+        return self._post_gemini(prompt, api_key)
+
+    def _build_batch_explanation_prompt(self, user_input, products):
+        """Build one Gemini prompt asking for a JSON explanation per product."""
+        prompt = f"""
+        As a fashion adviser, explain why each of these products would be a good recommendation for a user with the following preferences:
+        - Skin tone: {user_input.get("skin_tone", "Not specified")}
+        - Season: {user_input.get("season", "Not specified")}
+        - Event: {user_input.get("event", "Not specified")}
+        - Budget: {user_input.get("budget", "Not specified")}
+
+        The recommended products are:
+        """
+
+        for product in products:
+            prompt += f"\n- ID: {product['ID']}\n"
+            prompt += f"  Name: {product['Product Name']}\n"
+            prompt += f"  Description: {product['Description']}\n"
+            prompt += f"  Price: {product['Price']}\n"
+            prompt += f"  Color: {product['Color']}\n"
+            if "Product Type" in product:
+                prompt += f"  Product Type: {product['Product Type']}\n"
+            if "Occasion" in product:
+                prompt += f"  Occasion: {product['Occasion']}\n"
+            if "Skin Tone Category" in product:
+                prompt += (
+                    f"  Suitable for: {product['Skin Tone Category']} skin tones\n"
+                )
+
+        prompt += (
+            "\nFor every product, provide a concise explanation (1-2 sentences) focusing on why it is a good match for their needs. "
+            'Respond with only a JSON array of objects of the form {"id": "<product ID>", "explanation": "<text>"}, one per product.'
+        )
+        return prompt
+
+    def _parse_batch_explanations(self, text):
+        """
+        Map product ID (as a string) to explanation from a batch response.
+
+        Malformed entries are skipped so their products can be retried.
+        """
+        text = (text or "").strip()
+        # Tolerate a fenced ```json block around the array
+        if text.startswith("```"):
+            text = text.strip("`").strip()
+            if text.lower().startswith("json"):
+                text = text[4:]
 
         try:
-            response = requests.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-
-            response_data = response.json()
-            if "candidates" in response_data and len(response_data["candidates"]) > 0:
-                explanation = response_data["candidates"][0]["content"]["parts"][0][
-                    "text"
-                ].strip()
-                return explanation
-            else:
-                return "No explanation generated."
+            items = json.loads(text)
+        except ValueError:
+            logger.error("Batch explanation response was not valid JSON")
+            return {}
+
+        if isinstance(items, dict):
+            items = items.get("explanations", [])
+        if not isinstance(items, list):
+            return {}
+
+        explanations = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            explanation = item.get("explanation")
+            if "id" in item and isinstance(explanation, str) and explanation.strip():
+                explanations[str(item["id"])] = explanation.strip()
+        return explanations
+
+    def _request_batch_explanations(self, user_input, products, api_key):
+        """Call Gemini once for all products and return the parsed ID mapping."""
+        prompt = self._build_batch_explanation_prompt(user_input, products)
+        text = self._post_gemini(
+            prompt,
+            api_key,
+            max_output_tokens=100 + 150 * len(products),
+            json_output=True,
+        )
+        return self._parse_batch_explanations(text)
+
+    def get_explanation(self, user_input, recommended_product):
+        """
+        Get explanation for recommendation using Gemini API.
+
+        Args:
+            user_input: Dictionary of user preferences
+            recommended_product: Dictionary of product information
+
+        Returns:
+            str: Explanation text
+        """
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            return (
+                "API key not found. Please set the GEMINI_API_KEY environment variable."
+            )
+
+        try:
+            explanation = self._request_explanation(
+                user_input, recommended_product, api_key
+            )
+            return explanation or "No explanation generated."
         except Exception as e:
             logger.error(f"Error getting explanation: {str(e)}")
             return f"Error getting explanation: {str(e)}"
 
-    def recommend(self, user_input, top_n=3, with_explanations=True):
+    def get_rule_based_explanation(self, user_input, recommended_product):
+        """
+        Build an explanation from the matching product attributes, without Gemini.
+
+        Args:
+            user_input: Dictionary of user preferences
+            recommended_product: Dictionary of product information
+
+        Returns:
+            str: Explanation text
+        """
+        explanation_parts = []
+
+        # Check matching features
+        skin_tone = user_input.get("skin_tone")
+        if skin_tone and skin_tone == recommended_product.get("Skin Tone Category"):
+            explanation_parts.append(
+                f"This product is suitable for {skin_tone} skin tones"
+            )
+
+        event = user_input.get("event")
+        if event and event == recommended_product.get("Occasion"):
+            explanation_parts.append(f"Perfect for {event} occasions")
+
+        product_type = user_input.get("product_type")
+        if product_type and product_type == recommended_product.get("Product Type"):
+            explanation_parts.append(f"This is a {product_type} as you requested")
+
+        # Add price info
+        explanation_parts.append(f"Priced at Rs. {recommended_product['Price']}")
+
+        return " | ".join(explanation_parts)
+
+    def get_explanations(
+        self, user_input, products, deadline=EXPLANATION_DEADLINE, mode=None
+    ):
+        """
+        Get explanations for several products within one deadline.
+
+        Cached explanations are served first. The rest go to Gemini: in
+        "batch" mode all of them in a single prompt, in "per_item" mode one
+        call each on the shared worker pool. Generated explanations are
+        cached; any product whose explanation fails or is not back within
+        the deadline gets a rule-based explanation instead.
+
+        Args:
+            user_input: Dictionary of user preferences
+            products: List of product information dictionaries
+            deadline: Seconds allowed for all explanations together
+            mode: "batch" or "per_item" (defaults to EXPLANATION_MODE)
+
+        Returns:
+            list: Explanation text for each product, in order
+        """
+        explanations = [
+            self.get_rule_based_explanation(user_input, product) for product in products
+        ]
+        pending = list(range(len(products)))
+
+        if self.explanation_cache is not None:
+            cached = self.explanation_cache.get_many(
+                user_input, [product["ID"] for product in products]
+            )
+            for i in pending:
+                if str(products[i]["ID"]) in cached:
+                    explanations[i] = cached[str(products[i]["ID"])]
+            pending = [i for i in pending if str(products[i]["ID"]) not in cached]
+            logger.info(f"Explanation cache: {len(products) - len(pending)} hits")
+            if not pending:
+                return explanations
+
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            logger.warning("GEMINI_API_KEY not set, using rule-based explanations")
+            return explanations
+
+        pending_products = [products[i] for i in pending]
+        if (mode or EXPLANATION_MODE) == "batch":
+            generated = self._explain_batched(
+                user_input, pending_products, api_key, deadline
+            )
+        else:
+            generated = self._explain_per_item(
+                user_input, pending_products, api_key, deadline
+            )
+
+        for j, explanation in generated.items():
+            explanations[pending[j]] = explanation
+
+        if self.explanation_cache is not None:
+            self.explanation_cache.put_many(
+                user_input,
+                {pending_products[j]["ID"]: text for j, text in generated.items()},
+            )
+        return explanations
+
+    def _explain_per_item(self, user_input, products, api_key, deadline):
+        """
+        Explain products with one concurrent Gemini call each.
+
+        Returns:
+            Dictionary of product position to generated explanation
+        """
+        futures = {
+            self._explanation_pool.submit(
+                self._request_explanation, user_input, product, api_key
+            ): i
+            for i, product in enumerate(products)
+        }
+        done, not_done = wait(futures, timeout=deadline)
+
+        generated = {}
+        for future in done:
+            try:
+                explanation = future.result()
+            except Exception as e:
+                logger.error(f"Error getting explanation: {str(e)}")
+                continue
+            # An empty Gemini response falls back to the rule-based text
+            if explanation:
+                generated[futures[future]] = explanation
+
+        if not_done:
+            logger.warning(
+                f"{len(not_done)} explanations missed the {deadline}s deadline"
+            )
+            # Calls that have not started yet are dropped; running ones are
+            # bounded by GEMINI_TIMEOUT and their results discarded
+            for future in not_done:
+                future.cancel()
+
+        return generated
+
+    def _explain_batched(self, user_input, products, api_key, deadline):
+        """
+        Explain products with batched Gemini calls.
+
+        The first call carries every product; products missing or malformed
+        in the response are retried together while attempts and time remain.
+
+        Returns:
+            Dictionary of product position to generated explanation
+        """
+        expires_at = time.monotonic() + deadline
+        pending = list(range(len(products)))
+        generated = {}
+
+        for attempt in range(EXPLANATION_BATCH_ATTEMPTS):
+            remaining = expires_at - time.monotonic()
+            if not pending or remaining <= 0:
+                break
+
+            future = self._explanation_pool.submit(
+                self._request_batch_explanations,
+                user_input,
+                [products[i] for i in pending],
+                api_key,
+            )
+            try:
+                found = future.result(timeout=remaining)
+            except TimeoutError:
+                future.cancel()
+                logger.warning(f"Batch explanations missed the {deadline}s deadline")
+                break
+            except Exception as e:
+                logger.error(f"Error getting batch explanations: {str(e)}")
+                continue
+
+            for i in pending:
+                explanation = found.get(str(products[i]["ID"]))
+                if explanation:
+                    generated[i] = explanation
+            pending = [i for i in pending if i not in generated]
+
+        if pending:
+            logger.warning(f"Using rule-based explanations for {len(pending)} products")
+        return generated
+
+    def prewarm_explanations(self, top_n=9, limit=None, deadline=60):
+        """
+        Generate and cache explanations for likely preference/product pairs.
+
+        Every combination of skin tone, season, occasion and budget offered
+        to users is run through recommend(), and explanations for its top
+        products are fetched for whatever the cache does not hold yet.
+
+        Args:
+            top_n: Products explained per preference combination
+            limit: Optional maximum number of combinations to process
+            deadline: Seconds allowed per combination
+
+        Returns:
+            int: Number of preference combinations processed
+        """
+        if self.explanation_cache is None:
+            raise ValueError("Explanation cache is disabled")
+
+        combinations = list(
+            itertools.product(
+                self.available_options.get("skin_tone", [None]),
+                SEASONS,
+                self.available_options.get("occasion", [None]),
+                PRICE_RANGES.keys(),
+            )
+        )[:limit]
+
+        for n, (skin_tone, season, event, budget) in enumerate(combinations, 1):
+            # Same preference shape as the /recommend endpoint
+            user_input = {
+                "budget": budget,
+                "skin_tone": skin_tone,
+                "event": event,
+                "season": season,
+                "product_type": None,
+            }
+            recommendations = self.recommend(
+                user_input, top_n=top_n, with_explanations=False
+            )
+            products = [item["product"] for item in recommendations]
+            self.get_explanations(user_input, products, deadline=deadline)
+            print(f"[{n}/{len(combinations)}] {skin_tone}, {season}, {event}, {budget}")
+
+        print(
+            f"Explanation cache holds {len(self.explanation_cache)} entries after prewarming"
+        )
+        return len(combinations)
+
+    def recommend(self, user_input, top_n=3, with_explanations=True, timings=None):
         """
         Get product recommendations based on user preferences with price filtering.
 
@@ -448,12 +947,17 @@ class ClothingRecommender:
                 - 'product_type' (optional): type of product
             top_n: Number of recommendations to return
             with_explanations: Whether to include explanations
+            timings: Optional dict that receives the seconds spent in the
+                filter, query_encode, vector_search and explanation stages
 
         Returns:
             list: Recommended products with explanations if requested
         """
+        if timings is None:
+            timings = {}
         try:
             start_time = time.time()
+            stage_start = time.perf_counter()
 
             # Extract price range (mandatory filter)
             budget = user_input.get("budget")
@@ -470,50 +974,47 @@ class ClothingRecommender:
             )  # 'event' in original code maps to 'occasion'
             product_type = user_input.get("product_type")
 
-            # Apply filters to get filtered indices
-            filtered_indices = self._apply_filters(
+            # Apply filters to get the bitset of matching products
+            filter_bits = self._filter_bitset(
                 price_range=price_range,
                 skin_tone=skin_tone,
                 occasion=occasion,
                 product_type=product_type,
             )
+            timings["filter"] = time.perf_counter() - stage_start
 
-            if not filtered_indices:
+            if not filter_bits.any():
                 logger.warning(f"No products found with the selected filters")
                 return []
 
-            # Extract embeddings for filtered products
-            filtered_embeddings = np.array(
-                [self.product_embeddings[i] for i in filtered_indices]
-            )
-
-            # Create a temporary FAISS index for filtered products
-            dimension = filtered_embeddings.shape[1]
-            temp_index = faiss.IndexFlatL2(dimension)
-            temp_index.add(np.array(filtered_embeddings, dtype=np.float32))
-
             # Get user query vector
+            stage_start = time.perf_counter()
             user_vector = self._create_user_query_vector(user_input)
+            timings["query_encode"] = time.perf_counter() - stage_start
 
-            # Search in the filtered index
-            D, I = temp_index.search(
-                np.array(user_vector, dtype=np.float32),
-                min(top_n, len(filtered_indices)),
+            # Search the persistent index restricted to the filtered products
+            stage_start = time.perf_counter()
+            distances, original_indices = search_filtered(
+                self.index, self.product_embeddings, user_vector, filter_bits, top_n
             )
 
-            # Map back to original indices
-            original_indices = [filtered_indices[i] for i in I[0]]
+            products = [self.product_info[idx] for idx in original_indices]
+            timings["vector_search"] = time.perf_counter() - stage_start
+
+            # Fetch all explanations concurrently under one deadline
+            if with_explanations:
+                stage_start = time.perf_counter()
+                explanations = self.get_explanations(user_input, products)
+                timings["explanation"] = time.perf_counter() - stage_start
 
             # Get recommendations
             recommendations = []
-            for idx, distance in zip(original_indices, D[0]):
-                product = self.product_info[idx]
-
+            for i, (product, distance) in enumerate(zip(products, distances)):
                 # Compute similarity score (convert distance to similarity)
                 similarity_score = float(1 / (1 + distance))
 
                 if with_explanations:
-                    explanation = self.get_explanation(user_input, product)
+                    explanation = explanations[i]
                     recommendations.append(
                         {
                             "product": product,
@@ -556,10 +1057,7 @@ class ClothingRecommender:
         print(f"Thank you for sharing your {skin_tone} skin tone.")
 
         # Season
-        season_options = ["Summer", "Winter", "Spring", "Autumn"]
-        season = self._get_user_choice(
-            "Which season are you shopping for?", season_options
-        )
+        season = self._get_user_choice("Which season are you shopping for?", SEASONS)
         user_preferences["season"] = season
         print(f"Perfect! You're shopping for the {season} season.")
 
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Persistent cache of generated product explanations.
+
+Explanations depend only on the user's skin tone, season, event and budget,
+the recommended product and the prompt wording, all drawn from small closed
+sets. Entries are stored in SQLite keyed by (normalized preferences, product
+ID, prompt version), expire after a TTL, and the least recently used entries
+are evicted once the cache grows past its size limit.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+# Preference keys that appear in the explanation prompt
+PREFERENCE_KEYS = ("skin_tone", "season", "event", "budget")
+
+
+def preferences_key(user_input):
+    """Normalize the prompt-relevant preferences into a stable string key"""
+    normalized = {
+        key: str(user_input.get(key) or "").strip().lower() for key in PREFERENCE_KEYS
+    }
+    return json.dumps(normalized, sort_keys=True)
+
+
+class ExplanationCache:
+    """SQLite-backed explanation cache with TTL and LRU size eviction."""
+
+    def __init__(self, path, prompt_version, ttl_seconds, max_entries):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path: SQLite database file
+            prompt_version: Version of the prompt wording; bump to invalidate
+            ttl_seconds: Age after which an entry is no longer served
+            max_entries: Entry count above which the least recently used are evicted
+        """
+        self.prompt_version = str(prompt_version)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Products looked up, found or not, since startup
+        self.hits = 0
+        self.misses = 0
+
+        # One connection shared by the request threads, serialized by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS explanations (
+                preferences TEXT NOT NULL,
+                product_id TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                explanation TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (preferences, product_id, prompt_version)
+            )
+            """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS explanations_last_used ON explanations (last_used)"
+        )
+        self._conn.commit()
+
+    def get_many(self, user_input, product_ids):
+        """
+        Look up cached explanations for one set of preferences.
+
+        Args:
+            user_input: Dictionary of user preferences
+            product_ids: Product IDs to look up
+
+        Returns:
+            Dictionary of product ID (as a string) to explanation for the hits
+        """
+        product_ids = [str(product_id) for product_id in product_ids]
+        if not product_ids:
+            return {}
+
+        prefs = preferences_key(user_input)
+        now = time.time()
+        placeholders = ",".join("?" * len(product_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT product_id, explanation FROM explanations
+                WHERE preferences = ? AND prompt_version = ? AND created_at >= ?
+                AND product_id IN ({placeholders})
+                """,
+                [prefs, self.prompt_version, now - self.ttl_seconds, *product_ids],
+            ).fetchall()
+            if rows:
+                self._conn.execute(
+                    f"""
+                    UPDATE explanations SET last_used = ?
+                    WHERE preferences = ? AND prompt_version = ?
+                    AND product_id IN ({",".join("?" * len(rows))})
+                    """,
+                    [now, prefs, self.prompt_version, *[row[0] for row in rows]],
+                )
+                self._conn.commit()
+            self.hits += len(rows)
+            self.misses += len(product_ids) - len(rows)
+        return dict(rows)
+
+    def put_many(self, user_input, explanations):
+        """
+        Store generated explanations for one set of preferences.
+
+        Only real generated text belongs here; empty explanations are
+        skipped so a failed generation is retried on the next request.
+
+        Args:
+            user_input: Dictionary of user preferences
+            explanations: Dictionary of product ID to explanation
+        """
+        explanations = {
+            product_id: text
+            for product_id, text in explanations.items()
+            if text and text.strip()
+        }
+        if not explanations:
+            return
+
+        prefs = preferences_key(user_input)
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO explanations VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (prefs, str(product_id), self.prompt_version, text, now, now)
+                    for product_id, text in explanations.items()
+                ],
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        # Expired entries and entries from older prompt versions go first
+        self._conn.execute(
+            "DELETE FROM explanations WHERE created_at < ? OR prompt_version != ?",
+            (now - self.ttl_seconds, self.prompt_version),
+        )
+        # Then the least recently used entries beyond the size limit
+        self._conn.execute(
+            """
+            DELETE FROM explanations WHERE rowid IN (
+                SELECT rowid FROM explanations ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM explanations").fetchone()[0]
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Inverted facet index for product filtering.
+
+Built once when a recommender loads its data, the index holds one packed
+bitset per value of each facet column (skin tone, occasion, product type),
+one per PRICE_RANGES bucket, and a sorted price array for arbitrary price
+ranges. Filtering is then a bitwise AND over packed uint8 arrays instead of
+DataFrame scans, set building and string queries on every request.
+
+Bit i of every bitset corresponds to product index i, in little-endian bit
+order, which is the layout faiss.IDSelectorBitmap expects, so a filter result
+can be handed straight to a FAISS search (see search_filtered).
+"""
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from model.quantized_index import search_rescored
+
+
+class FacetIndex:
+    """Packed bitsets over product positions for fast facet filtering."""
+
+    def __init__(self, product_df, facet_columns, price_ranges, price_column="Price"):
+        """
+        Build the index from the product DataFrame.
+
+        Args:
+            product_df: DataFrame indexed by product index (0..N-1)
+            facet_columns: Categorical columns to index; missing ones are skipped
+            price_ranges: Dict of bucket name to inclusive (min, max) price
+            price_column: Name of the price column
+        """
+        self.size = len(product_df)
+        if not np.array_equal(product_df.index.to_numpy(), np.arange(self.size)):
+            raise ValueError("FacetIndex expects products indexed 0..N-1")
+
+        # One bitset per value of every facet column
+        self.facets = {}
+        for column in facet_columns:
+            if column not in product_df.columns:
+                continue
+            values = product_df[column].to_numpy()
+            self.facets[column] = {
+                value: self._pack(values == value)
+                for value in pd.unique(product_df[column].dropna())
+            }
+
+        # Prices are converted to numbers once, here, not at query time
+        prices = pd.to_numeric(product_df[price_column], errors="coerce").to_numpy(
+            dtype=np.float64
+        )
+        priced = np.flatnonzero(~np.isnan(prices))
+        order = np.argsort(prices[priced], kind="stable")
+        self._price_order = priced[order]
+        self._sorted_prices = prices[priced][order]
+
+        self.price_buckets = {
+            name: self.price_between(min_price, max_price)
+            for name, (min_price, max_price) in price_ranges.items()
+        }
+
+    def _pack(self, mask):
+        return np.packbits(mask, bitorder="little")
+
+    def all(self):
+        """Bitset with every product set"""
+        return self._pack(np.ones(self.size, dtype=bool))
+
+    def empty(self):
+        """Bitset with no product set"""
+        return self._pack(np.zeros(self.size, dtype=bool))
+
+    def has_facet(self, column):
+        return column in self.facets
+
+    def facet(self, column, value):
+        """Bitset of products whose column equals value (empty if unseen)"""
+        bits = self.facets[column].get(value)
+        return bits if bits is not None else self.empty()
+
+    def price_bucket(self, name):
+        """Precomputed bitset for a PRICE_RANGES bucket"""
+        return self.price_buckets[name]
+
+    def price_between(self, min_price, max_price):
+        """Bitset of products priced within [min_price, max_price]"""
+        lo = np.searchsorted(self._sorted_prices, min_price, side="left")
+        hi = np.searchsorted(self._sorted_prices, max_price, side="right")
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self._price_order[lo:hi]] = True
+        return self._pack(mask)
+
+    def count(self, bits):
+        """Number of products set in a bitset"""
+        return int(np.unpackbits(bits, count=self.size, bitorder="little").sum())
+
+    def to_indices(self, bits):
+        """Product indices set in a bitset, ascending"""
+        mask = np.unpackbits(bits, count=self.size, bitorder="little")
+        return np.flatnonzero(mask).tolist()
+
+
+def search_filtered(index, vectors, query, bits, top_n):
+    """
+    Search a persistent FAISS index restricted to the products in a bitset.
+
+    The bitset is passed to FAISS as a bitmap ID selector, so no embeddings
+    are copied and no temporary index is built per request. A
+    scalar-quantized index is rescored against the exact embeddings.
+
+    Args:
+        index: FAISS index over all products, with product index as ID
+        vectors: Full-precision product embeddings, one row per product
+        query: Query embedding, shape (1, dim)
+        bits: Packed bitset of the products allowed by the filters
+        top_n: Number of matches to return
+
+    Returns:
+        Tuple of (distances, product indices) for the best matches
+    """
+    D, I = search_rescored(
+        index,
+        query,
+        top_n,
+        vectors,
+        params=faiss.SearchParameters(sel=faiss.IDSelectorBitmap(bits)),
+    )
+
+    # Fewer matches than requested are padded with -1
+    valid = I[0] >= 0
+    return D[0][valid], I[0][valid].tolist()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Offline job that fills the explanation cache used by /recommend.
+
+Runs every skin tone / season / occasion / budget combination offered to
+users through the recommender and generates explanations for its top
+products, so hot /recommend calls are served from the cache without Gemini.
+
+Usage:
+    python prewarm_explanations.py [--top_n 9] [--limit N]
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from clothing_recommender_model import ClothingRecommender
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate cached explanations")
+    parser.add_argument(
+        "--top_n", type=int, default=9, help="Products explained per combination"
+    )
+    parser.add_argument(
+        "--limit", type=int, default=None, help="Maximum combinations to process"
+    )
+    args = parser.parse_args()
+
+    base_dir = os.path.dirname(__file__)
+    recommender = ClothingRecommender(
+        csv_path=os.path.join(base_dir, "products_with_type_and_occasion.csv"),
+        embeddings_path=os.path.join(base_dir, "enhanced_product_embeddings.pkl"),
+        faiss_index_path=os.path.join(base_dir, "enhanced_product_index.faiss"),
+        product_info_path=os.path.join(base_dir, "enhanced_product_info.pkl"),
+    )
+    recommender.prewarm_explanations(top_n=args.top_n, limit=args.limit)
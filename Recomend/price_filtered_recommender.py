@@ -12,14 +12,21 @@ This module provides a recommendation system that:
 """
 
 import os
+import sys
 import pickle
-import numpy as np
 import pandas as pd
-import faiss
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 import logging
 
+# Make the shared model/ utilities importable
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model.vector_store import open_or_convert
+from model.quantized_index import load_index
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from facet_index import FacetIndex, search_filtered
+
 # Set up logging
 logging.basicConfig(
     filename="price_filtered_recommendations.log",
@@ -35,6 +42,10 @@ PRICE_RANGES = {
     "premium": (10000, float("inf")),  # Above 10000
 }
 
+# FAISS index storage: "float32" (exact), or scalar-quantized "float16"/"int8"
+# codes rescored against the memory-mapped embeddings
+INDEX_STORAGE = os.getenv("RECOMMENDER_INDEX_STORAGE", "float32")
+
 
 class PriceFilteredRecommender:
     """A recommendation system with price filtering for clothing products."""
@@ -60,6 +71,8 @@ class PriceFilteredRecommender:
 
         # Store paths
         self.embeddings_path = embeddings_path
+        # Embeddings live in a memory-mapped vector store next to the legacy pickle
+        self.embeddings_store_path = os.path.splitext(embeddings_path)[0]
         self.faiss_index_path = faiss_index_path
         self.product_info_path = product_info_path
 
@@ -77,10 +90,18 @@ class PriceFilteredRecommender:
         logger.info("Loading pre-computed embeddings and FAISS index...")
 
         try:
-            with open(self.embeddings_path, "rb") as f:
-                self.product_embeddings = pickle.load(f)
+            # Memory-mapped; a legacy pickle is converted on first load
+            self.product_embeddings = open_or_convert(
+                self.embeddings_store_path, self.embeddings_path
+            )
+            if self.product_embeddings is None:
+                raise FileNotFoundError(
+                    f"No product embeddings at {self.embeddings_store_path}"
+                )
 
-            self.index = faiss.read_index(self.faiss_index_path)
+            self.index = load_index(
+                self.faiss_index_path, self.product_embeddings, INDEX_STORAGE
+            )
 
             with open(self.product_info_path, "rb") as f:
                 self.product_info = pickle.load(f)
@@ -109,6 +130,13 @@ class PriceFilteredRecommender:
 
         logger.info(f"Available options extracted: {self.available_options}")
 
+        # Precompute one bitset per filter value and price range
+        self.facet_index = FacetIndex(
+            self.product_df,
+            ["Skin Tone Category", "Occasion", "Product Type"],
+            PRICE_RANGES,
+        )
+
     def get_filter_options(self):
         """
         Get available options for each filter.
@@ -118,11 +146,11 @@ class PriceFilteredRecommender:
         """
         return self.available_options
 
-    def _apply_filters(
+    def _filter_bitset(
         self, price_range, skin_tone=None, occasion=None, product_type=None
     ):
         """
-        Apply selected filters to the product dataset.
+        Combine the precomputed facet bitsets selected by the filters.
 
         Args:
             price_range: String key for price range ("budget", "mid_range", "premium")
@@ -131,7 +159,7 @@ class PriceFilteredRecommender:
             product_type: Optional product type filter
 
         Returns:
-            List of product indices that match the filters
+            Packed bitset of the product indices that match the filters
         """
         logger.info(
             f"Applying filters: price_range={price_range}, skin_tone={skin_tone}, occasion={occasion}, product_type={product_type}"
@@ -143,47 +171,41 @@ class PriceFilteredRecommender:
                 f"Invalid price range: {price_range}. Available options: {list(PRICE_RANGES.keys())}"
             )
 
-        min_price, max_price = PRICE_RANGES[price_range]
-
-        # Start with price filter
-        query = f"(Price >= {min_price}) & (Price <= {max_price})"
-        filter_parts = []
+        # Start with the price filter; copy so the cached bucket is not modified
+        bits = self.facet_index.price_bucket(price_range).copy()
 
         # Apply optional filters if provided
         if skin_tone:
-            filter_parts.append(f"`Skin Tone Category` == '{skin_tone}'")
+            bits &= self.facet_index.facet("Skin Tone Category", skin_tone)
 
         if occasion:
-            filter_parts.append(f"`Occasion` == '{occasion}'")
+            bits &= self.facet_index.facet("Occasion", occasion)
 
         if product_type:
-            filter_parts.append(f"`Product Type` == '{product_type}'")
+            bits &= self.facet_index.facet("Product Type", product_type)
 
-        # Combine all filters
-        if filter_parts:
-            full_query = query + " & " + " & ".join(filter_parts)
-        else:
-            full_query = query
-
-        logger.info(f"Filter query: {full_query}")
+        logger.info(
+            f"Found {self.facet_index.count(bits)} products after applying filters"
+        )
+        return bits
 
-        # Apply the filters
-        try:
-            # Convert prices to numeric if they aren't already
-            if not pd.api.types.is_numeric_dtype(self.product_df["Price"]):
-                self.product_df["Price"] = pd.to_numeric(
-                    self.product_df["Price"], errors="coerce"
-                )
+    def _apply_filters(
+        self, price_range, skin_tone=None, occasion=None, product_type=None
+    ):
+        """
+        Apply selected filters to the product dataset.
 
-            filtered_indices = self.product_df.query(full_query).index.tolist()
-            logger.info(
-                f"Found {len(filtered_indices)} products after applying filters"
-            )
-            return filtered_indices
+        Args:
+            price_range: String key for price range ("budget", "mid_range", "premium")
+            skin_tone: Optional skin tone filter
+            occasion: Optional occasion filter
+            product_type: Optional product type filter
 
-        except Exception as e:
-            logger.error(f"Error applying filters: {e}")
-            raise
+        Returns:
+            List of product indices that match the filters
+        """
+        bits = self._filter_bitset(price_range, skin_tone, occasion, product_type)
+        return self.facet_index.to_indices(bits)
 
     def _create_user_query_vector(self, user_preferences):
         """
@@ -239,12 +261,12 @@ class PriceFilteredRecommender:
             List of dictionaries with recommended product info
         """
         try:
-            # Apply all filters to get filtered indices
-            filtered_indices = self._apply_filters(
+            # Apply all filters to get the bitset of matching products
+            filter_bits = self._filter_bitset(
                 price_range, skin_tone, occasion, product_type
             )
 
-            if not filtered_indices:
+            if not filter_bits.any():
                 logger.warning(f"No products found with the selected filters")
                 return []
 
@@ -255,31 +277,17 @@ class PriceFilteredRecommender:
                 "product_type": product_type,
             }
 
-            # Extract embeddings for filtered products
-            filtered_embeddings = np.array(
-                [self.product_embeddings[i] for i in filtered_indices]
-            )
-
-            # Create a temporary FAISS index for filtered products
-            dimension = filtered_embeddings.shape[1]
-            temp_index = faiss.IndexFlatL2(dimension)
-            temp_index.add(np.array(filtered_embeddings, dtype=np.float32))
-
             # Get user query vector
             user_vector = self._create_user_query_vector(user_preferences)
 
-            # Search in the filtered index
-            D, I = temp_index.search(
-                np.array(user_vector, dtype=np.float32),
-                min(top_n, len(filtered_indices)),
+            # Search the persistent index restricted to the filtered products
+            distances, original_indices = search_filtered(
+                self.index, self.product_embeddings, user_vector, filter_bits, top_n
             )
 
-            # Map back to original indices
-            original_indices = [filtered_indices[i] for i in I[0]]
-
             # Collect recommendations
             recommendations = []
-            for idx, distance in zip(original_indices, D[0]):
+            for idx, distance in zip(original_indices, distances):
                 product_info = self.product_info[idx]
 
                 recommendation = {
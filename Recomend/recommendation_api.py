@@ -1,7 +1,8 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import os
 import sys
+import time
 import logging
 
 # Set up logging
@@ -16,6 +17,10 @@ logger = logging.getLogger(__name__)
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 from clothing_recommender_model import ClothingRecommender, PRICE_RANGES
 
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from model.metrics import CONTENT_TYPE, Registry, RequestTrace, slow_query_logger
+from model.profiler import Profiler, is_authorized
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS to allow requests from your chatbot
 
@@ -33,8 +38,58 @@ recommender = ClothingRecommender(
     product_info_path=os.path.join(
         os.path.dirname(__file__), "enhanced_product_info.pkl"
     ),
+    # Pre-encode every dropdown combination so /recommend skips the encoder
+    warm_query_cache=os.getenv("WARM_QUERY_CACHE", "1") == "1",
+)
+
+# Prometheus metrics served on /metrics
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "recommendation_stage_seconds",
+    "Time spent in each stage of a /recommend request",
+    ["stage"],
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "recommendation_requests_in_flight", "/recommend requests being served"
+)
+REQUESTS = REGISTRY.counter(
+    "recommendation_requests_total", "/recommend requests by HTTP status", ["status"]
+)
+
+
+def _explanation_cache_counts():
+    cache = recommender.explanation_cache
+    if cache is None:
+        return {}
+    return {("hit",): cache.hits, ("miss",): cache.misses}
+
+
+REGISTRY.callback(
+    "recommendation_query_cache_lookups_total",
+    "Query vector cache lookups by result",
+    "counter",
+    lambda: {
+        ("hit",): recommender.query_cache_hits,
+        ("miss",): recommender.query_cache_misses,
+    },
+    ["result"],
+)
+REGISTRY.callback(
+    "recommendation_explanation_cache_lookups_total",
+    "Explanation cache lookups by result",
+    "counter",
+    _explanation_cache_counts,
+    ["result"],
+)
+
+# Requests slower than SLOW_QUERY_MS are logged with their stage breakdown
+SLOW_LOG = slow_query_logger(
+    os.getenv("SLOW_QUERY_LOG", "recommendation_slow_queries.log")
 )
 
+# On-demand captures started through /admin/profile
+PROFILER = Profiler()
+
 
 @app.route("/filter_options", methods=["GET"])
 def get_filter_options():
@@ -51,6 +106,18 @@ def get_filter_options():
 @app.route("/recommend", methods=["POST"])
 def recommend():
     """Get personalized recommendations with price filtering"""
+    with IN_FLIGHT.track_inprogress():
+        trace = RequestTrace(STAGE_SECONDS, SLOW_LOG, endpoint="/recommend")
+        with PROFILER.request():
+            response = _recommend(trace)
+        status = response[1] if isinstance(response, tuple) else 200
+        REQUESTS.inc(status=status)
+        trace.finish(status=status)
+        return response
+
+
+def _recommend(trace):
+    """Handle one /recommend request, recording its stage timings in trace"""
     # Get data from request
     data = request.json
     if not data:
@@ -84,6 +151,7 @@ def recommend():
         "season": season,  # optional (for explanations)
         "product_type": product_type,  # optional
     }
+    trace.context["preferences"] = user_preferences
 
     try:
         # Get recommendations - get 9 recommendations at once instead of just 3
@@ -92,9 +160,11 @@ def recommend():
         logger.info(
             f"Getting {top_n} recommendations with preferences: {user_preferences}"
         )
+        timings = {}
         recommendations = recommender.recommend(
-            user_preferences, top_n=top_n, with_explanations=True
+            user_preferences, top_n=top_n, with_explanations=True, timings=timings
         )
+        trace.record_all(timings)
 
         if not recommendations:
             logger.warning("No recommendations found")
@@ -107,6 +177,7 @@ def recommend():
             )
 
         # Format recommendations for frontend
+        serialize_start = time.perf_counter()
         formatted_recommendations = []
         for rec in recommendations:
             product = rec["product"]
@@ -133,13 +204,52 @@ def recommend():
             formatted_recommendations.append(formatted_rec)
 
         logger.info(f"Returning {len(formatted_recommendations)} recommendations")
-        return jsonify({"success": True, "recommendations": formatted_recommendations})
+        response = jsonify(
+            {"success": True, "recommendations": formatted_recommendations}
+        )
+        trace.record("serialization", time.perf_counter() - serialize_start)
+        return response
 
     except Exception as e:
         logger.error(f"Error in recommendation process: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus metrics: stage latencies, in-flight requests, cache hit rates"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+def admin_profile():
+    """
+    Start a profiler capture (POST) or report its status and last result (GET).
+
+    POST body: {"mode": "sampling" | "cprofile", "seconds": 30, "requests": 20}
+    Requires the X-Admin-Token header to match PROFILER_ADMIN_TOKEN.
+    """
+    if not is_authorized(request.headers.get("X-Admin-Token")):
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+
+    if request.method == "GET":
+        return jsonify({"success": True, **PROFILER.status()})
+
+    options = request.get_json(silent=True) or {}
+    try:
+        status = PROFILER.start(
+            mode=options.get("mode", "sampling"),
+            seconds=float(options.get("seconds", 30)),
+            requests=int(options.get("requests", 20)),
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+    logger.info(f"Profiler capture started: {status['running']}")
+    return jsonify({"success": True, **status})
+
+
 @app.route("/health", methods=["GET"])
 def health_check():
     """Simple health check endpoint"""
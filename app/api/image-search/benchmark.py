@@ -0,0 +1,540 @@
+#!/usr/bin/env python
+"""
+Benchmark suite for the DINOv2 image search.
+
+    generate  writes a synthetic catalogue of random normalized vectors plus
+              metadata in the formats load_embeddings() reads: the vector
+              store (default) or the legacy combined pickle
+    run       for each catalogue size and index type, starts a fresh worker
+              process that loads the catalogue and measures load time, peak
+              RSS, per-stage query latency percentiles and QPS at each
+              concurrency level, then writes one JSON report
+
+Synthetic products get a random number of images (images_per_product on
+average) clustered around a random centre, so product-level search sees
+realistic product groups. Queries are catalogue vectors with noise added.
+Catalogues are generated once per size under --workdir and reused, as are the
+indexes built for them.
+
+Pass --baseline with an earlier report to flag configurations whose latency,
+load time or memory grew, or whose QPS dropped, by more than --tolerance; the
+command then exits with status 1 so it can gate a deploy.
+
+Usage:
+    python benchmark.py generate --items 100000 --output bench/100000 [--format pickle]
+    python benchmark.py run [--items 10000,100000,1000000]
+        [--index_types flat,ivf_flat,hnsw,sq_int8] [--workdir bench]
+        [--queries 500] [--concurrency 1,4,16] [--top_k 12] [--embed]
+        [--output report.json] [--baseline previous.json] [--tolerance 0.2]
+"""
+
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Make sibling modules and the shared model/ utilities importable
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(
+    os.path.dirname(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    )
+)
+from model.vector_store import save_vector_store, store_exists
+from index_factory import INDEX_TYPES
+from product_index import SEARCH_LEVEL, product_index_paths
+
+DIM = 768  # DINOv2 ViT-B/14
+IMAGES_PER_PRODUCT = 4
+
+# Generated in chunks of products to bound memory on large catalogues
+_PRODUCT_CHUNK = 16384
+
+# Metrics compared against a baseline report: (path, higher is better,
+# smallest absolute change that counts, to ignore timer noise)
+BASELINE_METRICS = [
+    (("latency_ms", "total", "p50"), False, 0.1),
+    (("latency_ms", "total", "p95"), False, 0.1),
+    (("load_seconds",), False, 0.1),
+    (("peak_rss_mb",), False, 10),
+]
+
+
+def catalogue_paths(catalogue_dir, index_type="flat"):
+    """load_embeddings() keyword arguments for a catalogue directory"""
+    return {
+        "store_path": os.path.join(catalogue_dir, "dinov2_embeddings"),
+        "metadata_path": os.path.join(catalogue_dir, "dinov2_metadata.csv"),
+        "combined_path": os.path.join(catalogue_dir, "dinov2_combined_data.pkl"),
+        "embeddings_path": os.path.join(catalogue_dir, "dinov2_embeddings.pkl"),
+        "index_path": os.path.join(catalogue_dir, f"dinov2_index.{index_type}.faiss"),
+    }
+
+
+def catalogue_exists(catalogue_dir):
+    paths = catalogue_paths(catalogue_dir)
+    in_store = store_exists(paths["store_path"]) and os.path.exists(
+        paths["metadata_path"]
+    )
+    return in_store or os.path.exists(paths["combined_path"])
+
+
+def generate_catalogue(
+    catalogue_dir,
+    n_items,
+    dim=DIM,
+    images_per_product=IMAGES_PER_PRODUCT,
+    fmt="store",
+    noise=0.5,
+    seed=0,
+):
+    """
+    Write a synthetic catalogue of n_items normalized image vectors.
+
+    Args:
+        catalogue_dir: Output directory (file names as in model/)
+        n_items: Number of images
+        dim: Vector dimension
+        images_per_product: Mean images per product
+        fmt: "store" (vector store + metadata CSV) or "pickle" (combined pickle)
+        noise: Spread of a product's images around its centre
+        seed: Random seed
+    """
+    os.makedirs(catalogue_dir, exist_ok=True)
+    paths = catalogue_paths(catalogue_dir)
+    rng = np.random.default_rng(seed)
+
+    # Images sorted by product, a random number (images_per_product on
+    # average) per product
+    n_products = max(1, n_items // images_per_product)
+    product_of = np.sort(rng.integers(0, n_products, n_items))
+    first_row = np.searchsorted(product_of, product_of)
+    image_number = np.arange(n_items) - first_row
+
+    product_ids = [f"SYN{p:07d}" for p in product_of]
+    filenames = [f"image_{i}.jpg" for i in image_number]
+    relative_paths = [f"{p}\\nobg\\{f}" for p, f in zip(product_ids, filenames)]
+    metadata = pd.DataFrame(
+        {
+            "product_id": product_ids,
+            "relative_path": relative_paths,
+            "filename": filenames,
+            "faiss_id": np.arange(n_items),
+        }
+    )
+
+    # Vectors are written to a scratch .npy chunk by chunk, then stored
+    scratch_path = os.path.join(catalogue_dir, "vectors.scratch.npy")
+    vectors = np.lib.format.open_memmap(
+        scratch_path, mode="w+", dtype=np.float32, shape=(n_items, dim)
+    )
+    bounds = np.searchsorted(product_of, np.arange(0, n_products + 1, _PRODUCT_CHUNK))
+    bounds = np.append(bounds, n_items)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if start == end:
+            continue
+        chunk_products = product_of[start:end]
+        low = chunk_products[0]
+        centres = rng.standard_normal((chunk_products[-1] - low + 1, dim))
+        chunk = centres[chunk_products - low] + noise * rng.standard_normal(
+            (end - start, dim)
+        )
+        chunk /= np.linalg.norm(chunk, axis=1, keepdims=True)
+        vectors[start:end] = chunk
+    vectors.flush()
+
+    if fmt == "store":
+        save_vector_store(
+            paths["store_path"], vectors, ids=relative_paths, normalized=True
+        )
+        metadata.to_csv(paths["metadata_path"], index=False)
+    else:
+        with open(paths["combined_path"], "wb") as f:
+            pickle.dump(
+                {
+                    "embeddings": dict(zip(relative_paths, np.array(vectors))),
+                    "metadata": metadata.to_dict("records"),
+                },
+                f,
+            )
+    del vectors
+    os.remove(scratch_path)
+    print(f"Generated {n_items} images of {n_products} products in {catalogue_dir}")
+
+
+def _peak_rss_mb():
+    # Linux keeps ru_maxrss across exec, so a worker would report its
+    # parent's peak; VmHWM belongs to this process image alone
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if sys.platform == "win32":
+        # No resource module on Windows; psutil is optional
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    import resource
+
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _percentiles(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {
+        "mean": round(float(ms.mean()), 3),
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def _make_queries(vectors, n_queries, seed=1):
+    # Catalogue vectors plus noise: realistic neighbours, no exact self-match
+    rng = np.random.default_rng(seed)
+    picks = np.sort(rng.choice(len(vectors), size=n_queries, replace=True))
+    queries = np.asarray(vectors[picks], dtype=np.float32)
+    queries += rng.normal(0, 0.05, size=queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def run_worker(catalogue_dir, index_type, n_queries, concurrency, top_k, embed):
+    """Measure one catalogue and index type in this process"""
+    from embedding_search import (
+        load_embeddings,
+        build_result_lookup,
+        get_embedding_matrix,
+        rank_similar_products_batch,
+    )
+
+    paths = catalogue_paths(catalogue_dir, index_type)
+    start = time.perf_counter()
+    embeddings, index, df = load_embeddings(**paths, index_type=index_type)
+    load_seconds = time.perf_counter() - start
+    if embeddings is None or index is None:
+        raise RuntimeError(f"Could not load catalogue {catalogue_dir}")
+
+    start = time.perf_counter()
+    lookup = build_result_lookup(embeddings, df)
+    lookup_seconds = time.perf_counter() - start
+    peak_after_load = _peak_rss_mb()
+
+    queries = _make_queries(
+        (
+            lookup["vectors"]
+            if lookup["vectors"] is not None
+            else get_embedding_matrix(embeddings)
+        ),
+        n_queries,
+    )
+
+    def query(vector, timings=None):
+        return rank_similar_products_batch(
+            vector[None], embeddings, index, df, top_k, lookup, timings
+        )
+
+    # Warm up caches and lazily initialized FAISS state
+    for vector in queries[: min(10, len(queries))]:
+        query(vector)
+
+    # Single-threaded per-stage latency
+    stages = {"search": [], "collect": [], "total": []}
+    for vector in queries:
+        timings = {}
+        start = time.perf_counter()
+        query(vector, timings)
+        stages["total"].append(time.perf_counter() - start)
+        stages["search"].append(timings["search"])
+        stages["collect"].append(timings["collect"])
+
+    if embed:
+        import torch
+        from embedding_search import load_model, embed_tensors
+
+        model, _, device = load_model()
+        stages["embed"] = []
+        for _ in range(min(50, n_queries)):
+            pixels = [torch.randn(3, 224, 224)]
+            start = time.perf_counter()
+            embed_tensors(pixels, model, device)
+            stages["embed"].append(time.perf_counter() - start)
+
+    # Throughput with concurrent single-query callers, as in the search server
+    qps = {}
+    for threads in concurrency:
+        batch = np.resize(queries, (max(len(queries), threads * 20), queries.shape[1]))
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            start = time.perf_counter()
+            list(pool.map(query, batch))
+            qps[str(threads)] = round(len(batch) / (time.perf_counter() - start), 1)
+
+    return {
+        "items": int(len(embeddings)),
+        "index_type": index_type,
+        "search_level": SEARCH_LEVEL,
+        "load_seconds": round(load_seconds, 3),
+        "lookup_seconds": round(lookup_seconds, 3),
+        "peak_rss_mb_after_load": peak_after_load,
+        "peak_rss_mb": _peak_rss_mb(),
+        "latency_ms": {stage: _percentiles(s) for stage, s in stages.items()},
+        "qps": qps,
+    }
+
+
+def _spawn_worker(catalogue_dir, index_type, args):
+    # A fresh process per configuration keeps peak RSS and load times honest
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "_worker",
+        "--catalogue",
+        catalogue_dir,
+        "--index_type",
+        index_type,
+        "--queries",
+        str(args.queries),
+        "--concurrency",
+        args.concurrency,
+        "--top_k",
+        str(args.top_k),
+    ]
+    if args.embed:
+        command.append("--embed")
+    env = dict(os.environ, DINOV2_SEARCH_LEVEL=args.search_level)
+
+    built_path = catalogue_paths(catalogue_dir, index_type)["index_path"]
+    if args.search_level == "product":
+        built_path = product_index_paths(built_path)[1]
+    if not os.path.exists(built_path):
+        # Build the index in its own process so it does not skew the run
+        print(f"Building {index_type} index for {catalogue_dir}...")
+        start = time.perf_counter()
+        built = subprocess.run(command + ["--build_only"], env=env)
+        if built.returncode != 0:
+            return {"index_type": index_type, "error": "index build failed"}
+        build_seconds = round(time.perf_counter() - start, 2)
+    else:
+        build_seconds = None
+
+    completed = subprocess.run(command, env=env, stdout=subprocess.PIPE, text=True)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        return {"index_type": index_type, "error": f"exit {completed.returncode}"}
+    result = json.loads(lines[-1])
+    result["index_build_seconds"] = build_seconds
+    return result
+
+
+def _metric(result, path):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """List metrics that got worse than the baseline by more than tolerance"""
+
+    def key(result):
+        return (
+            result.get("items"),
+            result.get("index_type"),
+            result.get("search_level"),
+        )
+
+    previous = {key(r): r for r in baseline.get("results", []) if "error" not in r}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or "error" in result:
+            continue
+        metrics = list(BASELINE_METRICS)
+        metrics += [(("qps", threads), True, 1) for threads in result.get("qps", {})]
+        for path, higher_is_better, min_delta in metrics:
+            new_value, old_value = _metric(result, path), _metric(old, path)
+            if not new_value or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            worse = -change if higher_is_better else change
+            if worse > tolerance and abs(new_value - old_value) >= min_delta:
+                regressions.append(
+                    {
+                        "items": result["items"],
+                        "index_type": result["index_type"],
+                        "metric": ".".join(path),
+                        "baseline": old_value,
+                        "current": new_value,
+                        "change": round(change, 3),
+                    }
+                )
+    return regressions
+
+
+def run_suite(args):
+    sizes = [int(n) for n in args.items.split(",")]
+    index_types = args.index_types.split(",")
+    unknown = set(index_types) - set(INDEX_TYPES)
+    if unknown:
+        raise SystemExit(
+            f"Unknown index types {sorted(unknown)}; choose from {INDEX_TYPES}"
+        )
+
+    results = []
+    for n_items in sizes:
+        catalogue_dir = os.path.join(args.workdir, str(n_items))
+        if not catalogue_exists(catalogue_dir):
+            generate_catalogue(catalogue_dir, n_items, fmt=args.format)
+        for index_type in index_types:
+            print(f"Benchmarking {index_type} on {n_items} items...")
+            result = _spawn_worker(catalogue_dir, index_type, args)
+            results.append(result)
+            if "error" in result:
+                print(f"  failed: {result['error']}")
+            else:
+                total = result["latency_ms"]["total"]
+                rss = result["peak_rss_mb"]
+                print(
+                    f"  load={result['load_seconds']:.2f}s "
+                    f"rss={f'{rss:.0f}MB' if rss is not None else 'n/a'} "
+                    f"p50={total['p50']:.2f}ms p95={total['p95']:.2f}ms "
+                    f"qps={result['qps']}"
+                )
+
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "settings": {
+            "queries": args.queries,
+            "concurrency": args.concurrency,
+            "top_k": args.top_k,
+            "search_level": args.search_level,
+            "format": args.format,
+        },
+        "results": results,
+    }
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            report["regressions"] = compare_to_baseline(
+                results, json.load(f), args.tolerance
+            )
+        for regression in report["regressions"]:
+            print(
+                f"REGRESSION {regression['index_type']} @ {regression['items']}: "
+                f"{regression['metric']} {regression['baseline']} -> "
+                f"{regression['current']} ({regression['change']:+.0%})"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DINOv2 image search")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser(
+        "generate", help="Write a synthetic catalogue"
+    )
+    generate_parser.add_argument("--items", type=int, required=True)
+    generate_parser.add_argument("--output", type=str, required=True)
+    generate_parser.add_argument("--dim", type=int, default=DIM)
+    generate_parser.add_argument(
+        "--images_per_product", type=int, default=IMAGES_PER_PRODUCT
+    )
+    generate_parser.add_argument(
+        "--format", choices=["store", "pickle"], default="store"
+    )
+    generate_parser.add_argument("--seed", type=int, default=0)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmark suite")
+    run_parser.add_argument("--items", type=str, default="10000,100000")
+    run_parser.add_argument("--index_types", type=str, default="flat,ivf_flat,hnsw")
+    run_parser.add_argument("--workdir", type=str, default="bench")
+    run_parser.add_argument("--format", choices=["store", "pickle"], default="store")
+    run_parser.add_argument("--queries", type=int, default=500)
+    run_parser.add_argument("--concurrency", type=str, default="1,4,16")
+    run_parser.add_argument("--top_k", type=int, default=12)
+    run_parser.add_argument(
+        "--search_level",
+        choices=["product", "image"],
+        default=SEARCH_LEVEL,
+    )
+    run_parser.add_argument(
+        "--embed", action="store_true", help="Also time the DINOv2 forward pass"
+    )
+    run_parser.add_argument("--output", type=str, default="benchmark_report.json")
+    run_parser.add_argument("--baseline", type=str, help="Earlier report to compare")
+    run_parser.add_argument("--tolerance", type=float, default=0.2)
+
+    # Internal: one configuration, run in a fresh process by "run"
+    worker_parser = subparsers.add_parser("_worker")
+    worker_parser.add_argument("--catalogue", type=str, required=True)
+    worker_parser.add_argument("--index_type", type=str, required=True)
+    worker_parser.add_argument("--queries", type=int, default=500)
+    worker_parser.add_argument("--concurrency", type=str, default="1")
+    worker_parser.add_argument("--top_k", type=int, default=12)
+    worker_parser.add_argument("--embed", action="store_true")
+    worker_parser.add_argument("--build_only", action="store_true")
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate_catalogue(
+            args.output,
+            args.items,
+            dim=args.dim,
+            images_per_product=args.images_per_product,
+            fmt=args.format,
+            seed=args.seed,
+        )
+
+    elif args.command == "run":
+        report = run_suite(args)
+        if report.get("regressions"):
+            sys.exit(1)
+
+    else:
+        # Loading messages go to stderr so stdout carries only the result JSON
+        real_stdout, sys.stdout = sys.stdout, sys.stderr
+        if args.build_only:
+            from embedding_search import load_embeddings
+
+            _, index, _ = load_embeddings(
+                **catalogue_paths(args.catalogue, args.index_type),
+                index_type=args.index_type,
+            )
+            sys.exit(0 if index is not None else 1)
+        result = run_worker(
+            args.catalogue,
+            args.index_type,
+            args.queries,
+            [int(c) for c in args.concurrency.split(",")],
+            args.top_k,
+            args.embed,
+        )
+        sys.stdout = real_stdout
+        print(json.dumps(result))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Match many images against the DINOv2 catalogue in one process.
+
+Takes image files and/or directories (searched recursively), embeds them in
+batches and writes one JSON line per image as soon as its batch is done:
+
+    {"query": "<path>", "success": true, "results": [...]}
+
+Usage:
+    python bulk_match.py supplier_photos/ [more.jpg ...] [--output matches.jsonl]
+        [--top_k 12] [--batch_size 32] [--workers N] [--no_remove_bg]
+"""
+
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+
+# Make sibling modules importable regardless of the working directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from embedding_search import search_similar_products_batch
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
+def collect_images(inputs):
+    """Expand files and directories into a sorted list of image Paths"""
+    image_paths = []
+    for item in map(Path, inputs):
+        if item.is_dir():
+            image_paths.extend(
+                sorted(
+                    p
+                    for p in item.rglob("*")
+                    if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS
+                )
+            )
+        elif item.is_file():
+            image_paths.append(item)
+        else:
+            print(f"Skipping {item}: not a file or directory", file=sys.stderr)
+    return image_paths
+
+
+def bulk_match(
+    image_paths, output, top_k=12, remove_bg=True, batch_size=32, workers=None
+):
+    """Write one JSON line per image to the open output stream"""
+    results = search_similar_products_batch(
+        image_paths,
+        top_k=top_k,
+        remove_bg=remove_bg,
+        batch_size=batch_size,
+        workers=workers,
+    )
+    matched = 0
+    for image_path, result in zip(image_paths, results):
+        output.write(json.dumps({"query": str(image_path), **result}) + "\n")
+        output.flush()
+        matched += 1
+        if matched % batch_size == 0:
+            print(f"Matched {matched}/{len(image_paths)} images", file=sys.stderr)
+    return matched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Match a set of images against the catalogue"
+    )
+    parser.add_argument("inputs", nargs="+", help="Image files or directories")
+    parser.add_argument("--output", type=str, help="JSONL file (default: stdout)")
+    parser.add_argument("--top_k", type=int, default=12)
+    parser.add_argument(
+        "--batch_size", type=int, default=32, help="Images per forward pass"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Preprocessing threads"
+    )
+    parser.add_argument(
+        "--no_remove_bg", action="store_true", help="Skip background removal"
+    )
+    args = parser.parse_args()
+
+    image_paths = collect_images(args.inputs)
+    if not image_paths:
+        print("No images found", file=sys.stderr)
+        sys.exit(1)
+    print(f"Matching {len(image_paths)} images...", file=sys.stderr)
+
+    # Model loading messages go to stderr so stdout stays valid JSONL
+    output = open(args.output, "w") if args.output else sys.stdout
+    real_stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        count = bulk_match(
+            image_paths,
+            output,
+            top_k=args.top_k,
+            remove_bg=not args.no_remove_bg,
+            batch_size=args.batch_size,
+            workers=args.workers,
+        )
+    finally:
+        sys.stdout = real_stdout
+        if args.output:
+            output.close()
+    print(f"Wrote {count} results", file=sys.stderr)
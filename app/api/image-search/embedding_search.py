@@ -3,6 +3,7 @@ import os
 from os import path
 import sys
 import pickle
+import time
 import faiss
 import numpy as np
 from pathlib import Path
@@ -10,6 +11,10 @@ import pandas as pd
 from PIL import Image
 import io
 import base64
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import torch
 import rembg
 from torchvision.transforms import Compose, Resize, CenterCrop, ToTensor, Normalize
@@ -19,16 +24,37 @@ project_root = Path(__file__).parent.parent.parent.parent
 
 # Add the fyp directory to the path so we can import modules
 sys.path.append(str(project_root))
+from model.vector_store import VectorStore, store_exists, store_paths
+from model.inference_backend import load_extractor
+from model.quantized_index import search_rescored
+
+# Make sibling modules importable regardless of the working directory
+sys.path.append(path.dirname(path.abspath(__file__)))
+from index_factory import (
+    INDEX_TYPE,
+    build_index,
+    apply_env_search_params,
+    rows_by_faiss_id,
+)
+from product_index import SEARCH_LEVEL, ProductIndex, source_signature
 
 # File paths - update to use the model directory in the project root
 EMBEDDINGS_PATH = path.join(project_root, "model", "dinov2_embeddings.pkl")
 METADATA_PATH = path.join(project_root, "model", "dinov2_metadata.csv")
 COMBINED_DATA_PATH = path.join(project_root, "model", "dinov2_combined_data.pkl")
 FAISS_INDEX_PATH = path.join(project_root, "model", "dinov2_index.faiss")
+# Base path of the memory-mapped vector store (see model/vector_store.py)
+EMBEDDINGS_STORE_PATH = path.join(project_root, "model", "dinov2_embeddings")
 IMAGES_DIR = path.join(
     project_root, "public", "imgrt"
 )  # Assuming images are in public/imgrt
 
+# Background removal: rembg model, number of pooled ONNX sessions, and the
+# longest side of the downscaled copy that is segmented (0 = full resolution)
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+REMBG_POOL_SIZE = int(os.getenv("REMBG_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+REMBG_MASK_MAX_SIDE = int(os.getenv("REMBG_MASK_MAX_SIDE", "640"))
+
 # Define image preprocessing
 preprocess = Compose(
     [
@@ -40,115 +66,129 @@ preprocess = Compose(
 )
 
 
+# Weights build_dinov2_model loads; part of the exported artifact signature
+DINOV2_SOURCE = "torch.hub facebookresearch/dinov2 dinov2_vitb14 pretrain"
+
+
 # Set up the model for feature extraction
-def load_model():
-    """Load the DINOv2 model for feature extraction"""
+def build_dinov2_model():
+    """Build the fp32 PyTorch DINOv2 ViT-B/14 in eval mode"""
+    print("Loading DINOv2 model...")
     try:
-        print("Loading DINOv2 model...")
-        try:
-            # Try loading from torch hub first (the simpler approach)
-            model = torch.hub.load("facebookresearch/dinov2", "dinov2_vitb14")
-            model.eval()
-        except Exception as e:
-            print(f"Error loading from hub: {e}")
-            print("Loading DINOv2 with custom implementation...")
-
-            # Import necessary libraries for DINOv2
-            from torch import nn
-            from torch.hub import load_state_dict_from_url
-
-            # DINOv2 model configuration
-            MODEL_URL = "https://dl.fbaipublicfiles.com/dinov2/dinov2_vitb14/dinov2_vitb14_pretrain.pth"
-
-            # Simple implementation of ViT for DINOv2
-            class VisionTransformer(nn.Module):
-                def __init__(
-                    self,
-                    img_size=224,
-                    patch_size=14,
-                    in_chans=3,
-                    embed_dim=768,
-                    depth=12,
-                    num_heads=12,
-                    mlp_ratio=4,
-                    norm_layer=nn.LayerNorm,
-                ):
-                    super().__init__()
-                    self.img_size = img_size
-                    self.patch_size = patch_size
-                    self.in_chans = in_chans
-                    self.embed_dim = embed_dim
-
-                    # Create patches
-                    self.patch_embed = nn.Conv2d(
-                        in_chans, embed_dim, kernel_size=patch_size, stride=patch_size
-                    )
+        # Try loading from torch hub first (the simpler approach)
+        model = torch.hub.load("facebookresearch/dinov2", "dinov2_vitb14")
+        model.eval()
+    except Exception as e:
+        print(f"Error loading from hub: {e}")
+        print("Loading DINOv2 with custom implementation...")
 
-                    # Create class token and positional embedding
-                    self.cls_token = nn.Parameter(torch.zeros(1, 1, embed_dim))
-                    self.pos_embed = nn.Parameter(
-                        torch.zeros(1, (img_size // patch_size) ** 2 + 1, embed_dim)
-                    )
+        # Import necessary libraries for DINOv2
+        from torch import nn
+        from torch.hub import load_state_dict_from_url
 
-                    # Main transformer blocks
-                    self.blocks = nn.ModuleList(
-                        [
-                            nn.TransformerEncoderLayer(
-                                d_model=embed_dim,
-                                nhead=num_heads,
-                                dim_feedforward=int(embed_dim * mlp_ratio),
-                                dropout=0.0,
-                                batch_first=True,
-                            )
-                            for _ in range(depth)
-                        ]
-                    )
+        # DINOv2 model configuration
+        MODEL_URL = "https://dl.fbaipublicfiles.com/dinov2/dinov2_vitb14/dinov2_vitb14_pretrain.pth"
 
-                    self.norm = norm_layer(embed_dim)
+        # Simple implementation of ViT for DINOv2
+        class VisionTransformer(nn.Module):
+            def __init__(
+                self,
+                img_size=224,
+                patch_size=14,
+                in_chans=3,
+                embed_dim=768,
+                depth=12,
+                num_heads=12,
+                mlp_ratio=4,
+                norm_layer=nn.LayerNorm,
+            ):
+                super().__init__()
+                self.img_size = img_size
+                self.patch_size = patch_size
+                self.in_chans = in_chans
+                self.embed_dim = embed_dim
+
+                # Create patches
+                self.patch_embed = nn.Conv2d(
+                    in_chans, embed_dim, kernel_size=patch_size, stride=patch_size
+                )
 
-                def forward(self, x):
-                    # Get patches
-                    x = self.patch_embed(x)
-                    x = x.flatten(2).transpose(1, 2)  # B,C,H,W -> B,N,C
+                # Create class token and positional embedding
+                self.cls_token = nn.Parameter(torch.zeros(1, 1, embed_dim))
+                self.pos_embed = nn.Parameter(
+                    torch.zeros(1, (img_size // patch_size) ** 2 + 1, embed_dim)
+                )
 
-                    # Append class token
-                    cls_token = self.cls_token.expand(x.shape[0], -1, -1)
-                    x = torch.cat((cls_token, x), dim=1)
+                # Main transformer blocks
+                self.blocks = nn.ModuleList(
+                    [
+                        nn.TransformerEncoderLayer(
+                            d_model=embed_dim,
+                            nhead=num_heads,
+                            dim_feedforward=int(embed_dim * mlp_ratio),
+                            dropout=0.0,
+                            batch_first=True,
+                        )
+                        for _ in range(depth)
+                    ]
+                )
 
-                    # Add positional embedding
-                    x = x + self.pos_embed
+                self.norm = norm_layer(embed_dim)
 
-                    # Apply transformer blocks
-                    for block in self.blocks:
-                        x = block(x)
+            def forward(self, x):
+                # Get patches
+                x = self.patch_embed(x)
+                x = x.flatten(2).transpose(1, 2)  # B,C,H,W -> B,N,C
 
-                    x = self.norm(x)
+                # Append class token
+                cls_token = self.cls_token.expand(x.shape[0], -1, -1)
+                x = torch.cat((cls_token, x), dim=1)
 
-                    # Return [CLS] token as embedding
-                    return x[:, 0]
+                # Add positional embedding
+                x = x + self.pos_embed
 
-            # Define model architecture based on DINOv2 ViT-B/14
-            model = VisionTransformer(
-                img_size=224,
-                patch_size=14,
-                embed_dim=768,  # Base model embedding dimension
-                depth=12,  # Number of transformer blocks
-                num_heads=12,  # Number of attention heads
-            )
+                # Apply transformer blocks
+                for block in self.blocks:
+                    x = block(x)
+
+                x = self.norm(x)
+
+                # Return [CLS] token as embedding
+                return x[:, 0]
+
+        # Define model architecture based on DINOv2 ViT-B/14
+        model = VisionTransformer(
+            img_size=224,
+            patch_size=14,
+            embed_dim=768,  # Base model embedding dimension
+            depth=12,  # Number of transformer blocks
+            num_heads=12,  # Number of attention heads
+        )
+
+        # Load pre-trained weights
+        state_dict = load_state_dict_from_url(MODEL_URL, map_location="cpu")
+
+        # Remove some keys that might not match our simplified implementation
+        for key in list(state_dict.keys()):
+            if "head" in key:  # Remove classification head weights
+                del state_dict[key]
 
-            # Load pre-trained weights
-            state_dict = load_state_dict_from_url(MODEL_URL, map_location="cpu")
+        # Load weights (with strict=False to ignore missing keys)
+        model.load_state_dict(state_dict, strict=False)
 
-            # Remove some keys that might not match our simplified implementation
-            for key in list(state_dict.keys()):
-                if "head" in key:  # Remove classification head weights
-                    del state_dict[key]
+        # Set to evaluation mode
+        model.eval()
 
-            # Load weights (with strict=False to ignore missing keys)
-            model.load_state_dict(state_dict, strict=False)
+    return model
 
-            # Set to evaluation mode
-            model.eval()
+
+def load_model():
+    """Load the DINOv2 model for feature extraction"""
+    try:
+        # INFERENCE_BACKEND picks eager torch, ONNX Runtime or TorchScript
+        model = load_extractor(
+            "dinov2_vitb14", build_dinov2_model, DINOV2_SOURCE, preprocess
+        )
 
         # Use CPU as we're running in a serverless environment
         device = torch.device("cpu")
@@ -171,71 +211,104 @@ def load_model():
 
 
 # Load embeddings and FAISS index
-def load_embeddings():
-    """Load embeddings, FAISS index and product database"""
+def load_embeddings(
+    store_path=EMBEDDINGS_STORE_PATH,
+    metadata_path=METADATA_PATH,
+    combined_path=COMBINED_DATA_PATH,
+    embeddings_path=EMBEDDINGS_PATH,
+    index_path=FAISS_INDEX_PATH,
+    index_type=INDEX_TYPE,
+    search_level=SEARCH_LEVEL,
+):
+    """
+    Load embeddings, FAISS index and product database.
+
+    The paths default to the catalogue in model/; the benchmark points them at
+    synthetic catalogues. A missing index is built with index_type and saved.
+
+    At product search level (opt-in, see product_index) the returned index is
+    the ProductIndex saved next to index_path, built and saved if missing or
+    stale, and the image index is not read.
+    """
     try:
         embeddings = None
         metadata_df = None
         faiss_index = None
 
-        # Verify files exist
-        if not os.path.exists(COMBINED_DATA_PATH) and not os.path.exists(
-            EMBEDDINGS_PATH
-        ):
-            print("Neither combined data nor embeddings file found")
-            return None, None, None
-
-        if not os.path.exists(METADATA_PATH) and not os.path.exists(COMBINED_DATA_PATH):
-            print("No metadata file found")
-            return None, None, None
+        # Prefer the memory-mapped vector store, falling back to the pickles
+        if store_exists(store_path) and os.path.exists(metadata_path):
+            embeddings = VectorStore(store_path)
+            metadata_df = pd.read_csv(metadata_path)
+            print(f"Loaded {len(embeddings)} embeddings from vector store")
+        else:
+            # Verify files exist
+            if not os.path.exists(combined_path) and not os.path.exists(
+                embeddings_path
+            ):
+                print("Neither combined data nor embeddings file found")
+                return None, None, None
 
-        # Try to load the combined data first
-        try:
-            with open(COMBINED_DATA_PATH, "rb") as f:
-                combined_data = pickle.load(f)
-                embeddings = combined_data["embeddings"]
-                metadata_df = pd.DataFrame(combined_data["metadata"])
-                print(
-                    f"Loaded {len(embeddings)} embeddings and metadata from combined file"
-                )
-        except (FileNotFoundError, KeyError) as e:
-            print(f"Combined data not found or invalid: {e}")
+            if not os.path.exists(metadata_path) and not os.path.exists(combined_path):
+                print("No metadata file found")
+                return None, None, None
 
-            # Try loading separate files
+            # Try to load the combined data first
             try:
-                with open(EMBEDDINGS_PATH, "rb") as f:
-                    embeddings = pickle.load(f)
+                with open(combined_path, "rb") as f:
+                    combined_data = pickle.load(f)
+                    embeddings = combined_data["embeddings"]
+                    metadata_df = pd.DataFrame(combined_data["metadata"])
+                    print(
+                        f"Loaded {len(embeddings)} embeddings and metadata from combined file"
+                    )
+            except (FileNotFoundError, KeyError) as e:
+                print(f"Combined data not found or invalid: {e}")
+
+                # Try loading separate files
+                try:
+                    with open(embeddings_path, "rb") as f:
+                        embeddings = pickle.load(f)
 
-                metadata_df = pd.read_csv(METADATA_PATH)
-                print(
-                    f"Loaded {len(embeddings)} embeddings and metadata from separate files"
+                    metadata_df = pd.read_csv(metadata_path)
+                    print(
+                        f"Loaded {len(embeddings)} embeddings and metadata from separate files"
+                    )
+                except Exception as e:
+                    print(f"Error loading data: {e}")
+                    return None, None, None
+
+        if search_level == "product":
+            sources = [
+                store_paths(store_path)[2],
+                metadata_path,
+                combined_path,
+                embeddings_path,
+            ]
+            try:
+                faiss_index = load_product_index(
+                    embeddings, metadata_df, index_path, index_type, sources
                 )
             except Exception as e:
-                print(f"Error loading data: {e}")
-                return None, None, None
+                print(f"Error with product index: {e}")
+                faiss_index = None
+            return embeddings, faiss_index, metadata_df
 
         # Load or create FAISS index
         try:
-            if os.path.exists(FAISS_INDEX_PATH):
-                faiss_index = faiss.read_index(FAISS_INDEX_PATH)
-                print(f"Loaded FAISS index from {FAISS_INDEX_PATH}")
+            if os.path.exists(index_path):
+                faiss_index = faiss.read_index(index_path)
+                apply_env_search_params(faiss_index)
+                print(f"Loaded FAISS index from {index_path}")
             else:
                 print("FAISS index file not found, creating new index...")
-                # Convert embeddings to a numpy array for FAISS
-                embedding_list = list(embeddings.values())
-                embedding_matrix = np.vstack(embedding_list).astype("float32")
-
-                # Build a FAISS index
-                dim = embedding_matrix.shape[1]  # Embedding dimension
-                faiss_index = faiss.IndexFlatIP(
-                    dim
-                )  # Inner product (cosine similarity for normalized vectors)
-                faiss_index.add(embedding_matrix)
+                faiss_index = build_faiss_index(
+                    embeddings, metadata_df, index_type=index_type
+                )
                 print(f"Created FAISS index with {faiss_index.ntotal} vectors")
 
                 # Save the index for future use
-                faiss.write_index(faiss_index, FAISS_INDEX_PATH)
-                print(f"Saved FAISS index to {FAISS_INDEX_PATH}")
+                faiss.write_index(faiss_index, index_path)
+                print(f"Saved FAISS index to {index_path}")
         except Exception as e:
             print(f"Error with FAISS index: {e}")
             faiss_index = None
@@ -246,46 +319,288 @@ def load_embeddings():
         return None, None, None
 
 
+# FAISS ids aligned with the embedding dict order
+def get_faiss_ids(embeddings, metadata_df):
+    """Return the FAISS id of each embedding, in embedding dict order"""
+    if metadata_df is not None and "faiss_id" in metadata_df.columns:
+        id_by_path = dict(zip(metadata_df["relative_path"], metadata_df["faiss_id"]))
+        return np.array([id_by_path[p] for p in embeddings], dtype="int64")
+    # Legacy data without ids: the FAISS id is the row position
+    return np.arange(len(embeddings), dtype="int64")
+
+
+# Product of each embedding
+def get_product_ids(embeddings, metadata_df):
+    """Return each image's product_id (None if unknown), in embedding dict order"""
+    # Take the first metadata row per path
+    product_by_path = metadata_df.drop_duplicates("relative_path").set_index(
+        "relative_path"
+    )["product_id"]
+    product_ids = product_by_path.reindex(list(embeddings)).astype(object)
+    return product_ids.where(product_ids.notna(), None).to_numpy()
+
+
+# Load the saved product-level index, building it when the catalogue changed
+def load_product_index(embeddings, metadata_df, index_path, index_type, sources):
+    """
+    Return the ProductIndex saved next to index_path if it was built from the
+    current sources and index_type, else build it and save it there.
+    """
+    if not len(embeddings):
+        return None
+    signature = source_signature(sources, index_type)
+    vectors = (
+        embeddings.vectors
+        if isinstance(embeddings, VectorStore)
+        else get_embedding_matrix(embeddings)
+    )
+    product_index = ProductIndex.load(index_path, vectors, signature)
+    if product_index is None:
+        print("Product index missing or stale, building...")
+        product_index = ProductIndex(
+            vectors,
+            get_product_ids(embeddings, metadata_df).tolist(),
+            get_faiss_ids(embeddings, metadata_df),
+            index_type=index_type,
+        )
+        try:
+            product_index.save(index_path, signature)
+        except OSError as e:
+            # Still usable for this process; it is rebuilt on the next load
+            print(f"Could not save product index: {e}")
+    return product_index
+
+
+# Map FAISS result ids back to image paths and products
+def build_result_lookup(embeddings, metadata_df):
+    """
+    Precompute arrays indexed by FAISS id holding each image's relative path
+    and product_id, so result assembly is a vectorized gather instead of a
+    metadata scan per hit. Build once when the index is loaded.
+
+    With a vector store, the lookup also carries the memory-mapped vectors and
+    each id's row in them, used to rescore scalar-quantized indexes exactly.
+    """
+    faiss_ids = get_faiss_ids(embeddings, metadata_df)
+    size = int(faiss_ids.max()) + 1 if len(faiss_ids) else 0
+
+    paths_by_id = np.full(size, None, dtype=object)
+    products_by_id = np.full(size, None, dtype=object)
+    paths_by_id[faiss_ids] = list(embeddings)
+    products_by_id[faiss_ids] = get_product_ids(embeddings, metadata_df)
+
+    return {
+        "paths": paths_by_id,
+        "product_ids": products_by_id,
+        "rows": rows_by_faiss_id(faiss_ids),
+        "vectors": (
+            embeddings.vectors if isinstance(embeddings, VectorStore) else None
+        ),
+    }
+
+
+# Stack the embedding dict (or vector store) into one float32 matrix
+def get_embedding_matrix(embeddings):
+    """Return all embeddings as a float32 matrix, in embedding dict order"""
+    if isinstance(embeddings, VectorStore):
+        return embeddings.as_float32()
+    embedding_list = list(embeddings.values())
+    return np.vstack(embedding_list).astype("float32")
+
+
+# Build a FAISS index from the embedding dict
+def build_faiss_index(embeddings, metadata_df, index_type=INDEX_TYPE):
+    """Build an id-addressable index of the configured type (see index_factory)"""
+    # Inner product (cosine similarity for normalized vectors)
+    return build_index(
+        get_embedding_matrix(embeddings),
+        get_faiss_ids(embeddings, metadata_df),
+        index_type=index_type,
+    )
+
+
+class RembgSessionPool:
+    """
+    Bounded pool of rembg ONNX sessions shared by request threads.
+
+    Sessions are created lazily, up to `size`, and reused across requests, so
+    the segmentation model is loaded once per session instead of per call.
+    """
+
+    def __init__(self, model_name=REMBG_MODEL, size=REMBG_POOL_SIZE):
+        self.model_name = model_name
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    return rembg.new_session(self.model_name)
+                except Exception:
+                    # Give the slot back so a later call can retry
+                    with self._lock:
+                        self._created -= 1
+                    raise
+
+            # At capacity: wait for another thread to return its session,
+            # rechecking now and then in case a failed creation freed a slot
+            try:
+                return self._idle.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+    @contextmanager
+    def session(self):
+        """Borrow a session for the duration of a with-block"""
+        session = self._acquire()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+
+rembg_sessions = RembgSessionPool()
+
+
+def remove_background(image, mask_max_side=REMBG_MASK_MAX_SIDE):
+    """
+    Return the image with its background replaced by white.
+
+    The U2Net mask is predicted on a copy downscaled to mask_max_side (the
+    network itself runs at 320x320, so full-resolution input only adds
+    resize and post-processing cost) and the mask is upsampled back.
+    """
+    image = image.convert("RGB")
+    small = image
+    if mask_max_side and max(image.size) > mask_max_side:
+        small = image.copy()
+        small.thumbnail((mask_max_side, mask_max_side), Image.BILINEAR)
+
+    with rembg_sessions.session() as session:
+        mask = rembg.remove(small, session=session, only_mask=True)
+    if mask.size != image.size:
+        mask = mask.resize(image.size, Image.BILINEAR)
+
+    # Paste onto a white background using the mask as alpha
+    result = Image.new("RGB", image.size, (255, 255, 255))
+    result.paste(image, mask=mask)
+    return result
+
+
+# Open an uploaded image
+def load_image(image_data):
+    """Open raw image bytes, an image file Path, or a legacy base64 string"""
+    if isinstance(image_data, Path):
+        return Image.open(image_data)
+    if isinstance(image_data, str):
+        image_data = base64.b64decode(image_data)
+    return Image.open(io.BytesIO(image_data))
+
+
+# Decode an image into a model input
+def preprocess_query_image(image_data, transform, remove_bg=True, timings=None):
+    """
+    Decode an image, optionally remove its background, and transform it.
+
+    timings, if given, receives the seconds spent in the decode, rembg and
+    preprocess stages.
+    """
+    if timings is None:
+        timings = {}
+    stage_start = time.perf_counter()
+    image = load_image(image_data)
+    # PIL decodes lazily; force it so the decode is timed here
+    image.load()
+    timings["decode"] = time.perf_counter() - stage_start
+    if remove_bg:
+        stage_start = time.perf_counter()
+        image = remove_background(image)
+        timings["rembg"] = time.perf_counter() - stage_start
+    stage_start = time.perf_counter()
+    tensor = transform(image.convert("RGB"))
+    timings["preprocess"] = time.perf_counter() - stage_start
+    return tensor
+
+
+# Run the model on a batch of preprocessed images
+def embed_tensors(tensors, model, device):
+    """Stack image tensors into one forward pass and return normalized rows"""
+    batch = torch.stack(tensors).to(device)
+    with torch.no_grad():
+        features = model(batch)
+    embeddings = features.reshape(len(tensors), -1).cpu().numpy().astype("float32")
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
 # Extract embedding from image
 def extract_embedding(image_data, model, transform, device, remove_bg=True):
-    """Extract embedding from a base64 encoded image"""
+    """Extract embedding from raw image bytes"""
     try:
-        # Convert base64 image to PIL Image
-        image = Image.open(io.BytesIO(base64.b64decode(image_data)))
-
-        # Remove background if requested
         if remove_bg:
             print("Removing background from image...")
-            # Apply rembg and convert back to RGB to ensure 3 channels
-            img_no_bg = rembg.remove(image)
-            # The result from rembg is RGBA, convert back to RGB to ensure compatibility
-            image = Image.new(
-                "RGB", image.size, (255, 255, 255)
-            )  # Create a white background
-            image.paste(
-                img_no_bg, mask=img_no_bg.getchannel("A")
-            )  # Paste using alpha as mask
-
-        # Apply transformations
-        img_tensor = transform(image).unsqueeze(0).to(device)
-
-        # Extract features
-        with torch.no_grad():
-            features = model(img_tensor)
-
-        # Convert to numpy and normalize
-        embedding = features.squeeze().cpu().numpy()
-        embedding = embedding / np.linalg.norm(embedding)
-
-        return embedding
+        img_tensor = preprocess_query_image(image_data, transform, remove_bg=remove_bg)
+        return embed_tensors([img_tensor], model, device)[0]
     except Exception as e:
         print(f"Error extracting embedding: {str(e)}")
         return None
 
 
+# Extract embeddings for many images at once
+def extract_embeddings(
+    images, model, transform, device, remove_bg=True, batch_size=32, workers=None
+):
+    """
+    Embed many images with batched forward passes.
+
+    Decoding, background removal and preprocessing run in a thread pool
+    (PIL and ONNX Runtime release the GIL), then the tensors are stacked
+    into batches of batch_size for the model.
+
+    Args:
+        images: Raw image bytes or image file Paths
+        remove_bg: Whether to remove backgrounds before embedding
+        batch_size: Images per forward pass
+        workers: Preprocessing threads (default: CPU count)
+
+    Returns:
+        List with a normalized embedding per image, or None where it failed
+    """
+
+    def prepare(image_data):
+        try:
+            return preprocess_query_image(image_data, transform, remove_bg=remove_bg)
+        except Exception as e:
+            print(f"Error preprocessing image: {str(e)}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        tensors = list(pool.map(prepare, images))
+
+    results = [None] * len(tensors)
+    ready = [i for i, tensor in enumerate(tensors) if tensor is not None]
+    for start in range(0, len(ready), batch_size):
+        batch = ready[start : start + batch_size]
+        embeddings = embed_tensors([tensors[i] for i in batch], model, device)
+        for i, embedding in zip(batch, embeddings):
+            results[i] = embedding
+    return results
+
+
 # Function to search for similar products
-def search_similar_products(image_base64, top_k=12, remove_bg=True):
-    """Search for similar products using the image"""
+def search_similar_products(image_data, top_k=12, remove_bg=True):
+    """Search for similar products using the raw image bytes"""
     # Load model
     model, transform, device = load_model()
     if model is None:
@@ -298,37 +613,136 @@ def search_similar_products(image_base64, top_k=12, remove_bg=True):
 
     # Extract embedding from uploaded image
     query_embedding = extract_embedding(
-        image_base64, model, transform, device, remove_bg=remove_bg
+        image_data, model, transform, device, remove_bg=remove_bg
     )
     if query_embedding is None:
         return {"error": "Failed to extract embedding from image"}
 
-    # Search the index
-    query_embedding = query_embedding.reshape(1, -1).astype("float32")
-    distances, indices = index.search(
-        query_embedding, top_k * 3
-    )  # Get extra results for filtering
+    return rank_similar_products(query_embedding, embeddings, index, df, top_k=top_k)
 
-    # Get paths corresponding to indices
-    paths = list(embeddings.keys())
+
+# Search for similar products for many images
+def search_similar_products_batch(
+    images, top_k=12, remove_bg=True, batch_size=32, workers=None
+):
+    """
+    Search for similar products for many images, loading everything once.
+
+    Images are processed in chunks of batch_size: one parallel preprocessing
+    pass, one batched forward pass and one multi-query FAISS search per
+    chunk. Results are yielded in input order as each chunk completes, so
+    callers can stream them out.
+
+    Args:
+        images: Iterable of raw image bytes or image file Paths
+
+    Yields:
+        A result dict per image, as returned by search_similar_products
+    """
+    model, transform, device = load_model()
+    if model is None:
+        raise RuntimeError("Failed to load model")
+
+    embeddings, index, df = load_embeddings()
+    if index is None or df is None:
+        raise RuntimeError("Failed to load embeddings")
+    lookup = build_result_lookup(embeddings, df)
+
+    def search_chunk(chunk):
+        query_embeddings = extract_embeddings(
+            chunk, model, transform, device, remove_bg, batch_size, workers
+        )
+        ok = [i for i, e in enumerate(query_embeddings) if e is not None]
+
+        results = [{"error": "Failed to extract embedding from image"}] * len(chunk)
+        if ok:
+            ranked = rank_similar_products_batch(
+                np.vstack([query_embeddings[i] for i in ok]),
+                embeddings,
+                index,
+                df,
+                top_k=top_k,
+                lookup=lookup,
+            )
+            for i, result in zip(ok, ranked):
+                results[i] = result
+        return results
+
+    chunk = []
+    for image_data in images:
+        chunk.append(image_data)
+        if len(chunk) == batch_size:
+            yield from search_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield from search_chunk(chunk)
+
+
+# Rank catalogue products against a query embedding
+def rank_similar_products(
+    query_embedding, embeddings, index, df, top_k=12, lookup=None, timings=None
+):
+    """Search the FAISS index and collapse image hits into unique products"""
+    return rank_similar_products_batch(
+        query_embedding.reshape(1, -1), embeddings, index, df, top_k, lookup, timings
+    )[0]
+
+
+# Rank catalogue products against many query embeddings
+def rank_similar_products_batch(
+    query_embeddings, embeddings, index, df, top_k=12, lookup=None, timings=None
+):
+    """
+    Run one multi-query FAISS search and collapse each row into products.
+
+    If a timings dict is passed, the seconds spent in the "search" and
+    "collect" stages are stored in it.
+    """
+    # Long-lived callers pass a lookup built once at load time
+    if lookup is None:
+        lookup = build_result_lookup(embeddings, df)
+
+    start = time.perf_counter()
+
+    if isinstance(index, ProductIndex):
+        # Exactly top_k distinct products, each with its best image
+        distances, indices = index.search(query_embeddings, top_k)
+    else:
+        # Search the image index; scalar-quantized indexes are rescored exactly
+        distances, indices = search_rescored(
+            index,
+            query_embeddings,
+            top_k * 3,  # Get extra results for filtering
+            lookup.get("vectors"),
+            lookup.get("rows"),
+        )
+    searched = time.perf_counter()
+
+    results = [
+        _collect_products(row_distances, row_indices, lookup, top_k)
+        for row_distances, row_indices in zip(distances, indices)
+    ]
+    if timings is not None:
+        timings["search"] = searched - start
+        timings["collect"] = time.perf_counter() - searched
+    return results
+
+
+def _collect_products(distances, hit_ids, lookup, top_k):
+    # Gather paths and product ids for every hit at once
+    valid = (hit_ids >= 0) & (hit_ids < len(lookup["paths"]))
+    hit_ids = hit_ids[valid]
+    hit_scores = distances[valid].tolist()  # Python floats for JSON
+    hit_paths = lookup["paths"][hit_ids]
+    hit_products = lookup["product_ids"][hit_ids]
 
     # Get the similar products
     similar_products = []
     seen_product_ids = set()
 
-    for i, idx in enumerate(indices[0]):
-        if idx < 0 or idx >= len(paths):
-            continue  # Skip invalid indices
-
-        path = paths[idx]
-        similarity = float(distances[0][i])  # Convert to float for JSON serialization
-
-        # Get product_id from metadata
-        product_id = None
-        path_in_metadata = df["relative_path"] == path
-        if any(path_in_metadata):
-            product_info = df[path_in_metadata].iloc[0]
-            product_id = product_info["product_id"]
+    for image_path, product_id, similarity in zip(hit_paths, hit_products, hit_scores):
+        if image_path is None:
+            continue  # Skip ids removed from the catalogue
 
         # Filter out same product
         if product_id in seen_product_ids:
@@ -337,12 +751,12 @@ def search_similar_products(image_base64, top_k=12, remove_bg=True):
         if product_id:
             seen_product_ids.add(product_id)
 
-        full_path = os.path.join(IMAGES_DIR, path)
+        full_path = os.path.join(IMAGES_DIR, image_path)
 
         similar_products.append(
             {
                 "product_id": product_id,
-                "image_path": path,
+                "image_path": image_path,
                 "full_path": full_path,
                 "similarity": similarity,
             }
@@ -356,16 +770,16 @@ def search_similar_products(image_base64, top_k=12, remove_bg=True):
 
 # Main function for the script
 if __name__ == "__main__":
-    # If there's a command-line argument, try to process it as base64 image
+    import json
+
+    # If there's a command-line argument, treat it as an image file path
     if len(sys.argv) > 1:
-        image_base64 = sys.argv[1]
+        with open(sys.argv[1], "rb") as f:
+            image_bytes = f.read()
         top_k = int(sys.argv[2]) if len(sys.argv) > 2 else 12
         remove_bg = True if len(sys.argv) <= 3 else (sys.argv[3].lower() != "false")
 
-        results = search_similar_products(
-            image_base64, top_k=top_k, remove_bg=remove_bg
-        )
-        import json
+        results = search_similar_products(image_bytes, top_k=top_k, remove_bg=remove_bg)
 
         print(json.dumps(results))
     else:
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+"""
+Incremental DINOv2 index maintenance.
+
+Keeps a manifest of content hash, mtime and size for every catalogue image.
+On each run only new or changed images are embedded, and vectors for deleted
+images are removed, so adding a handful of SKUs takes seconds instead of a
+full rebuild. Vectors are added and removed by a stable id stored in the
+metadata's ``faiss_id`` column. HNSW indexes cannot remove vectors, so for
+them a removal rebuilds the index from the stored vectors (no re-embedding).
+
+A run that finds nothing to add or remove writes only the manifest. A run
+that does change something still rewrites the vector store, metadata and
+index whole (see save_state).
+
+Paths are compared with "/" separators, so artifacts written on Windows line
+up with the files on any OS, but the stored relative_path values are kept as
+written since they are returned to clients as image_path.
+
+Usage:
+    python incremental_index.py [--images_dir public/imgrt] [--pattern */nobg/*]
+"""
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import argparse
+from pathlib import PureWindowsPath
+import numpy as np
+import pandas as pd
+import faiss
+import torch
+from PIL import Image
+
+# Make sibling modules importable regardless of the working directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from embedding_search import (
+    project_root,
+    EMBEDDINGS_STORE_PATH,
+    METADATA_PATH,
+    FAISS_INDEX_PATH,
+    IMAGES_DIR,
+    load_model,
+    load_embeddings,
+    build_faiss_index,
+    get_faiss_ids,
+)
+from index_factory import build_index, supports_removal
+from model.vector_store import save_vector_store
+
+MANIFEST_PATH = os.path.join(project_root, "model", "dinov2_manifest.json")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def file_sha256(file_path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_path(rel_path):
+    """
+    Comparison key for a catalogue-relative path: "/" separators, whichever
+    OS wrote it.
+
+    The committed metadata was built on Windows (ACA231001\\nobg\\image_0.jpg);
+    without this every existing image would look removed on Linux.
+    """
+    return PureWindowsPath(rel_path).as_posix()
+
+
+def scan_images(images_dir, pattern):
+    """Return {path key: (relative_path, mtime_ns, size)} for catalogue images on disk"""
+    found = {}
+    for file_path in glob.glob(os.path.join(images_dir, pattern)):
+        if not file_path.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        stat = os.stat(file_path)
+        rel_path = os.path.relpath(file_path, images_dir)
+        found[normalize_path(rel_path)] = (rel_path, stat.st_mtime_ns, stat.st_size)
+    return found
+
+
+def load_manifest():
+    """Load the per-image manifest (keyed by path key), or an empty one on first run"""
+    if not os.path.exists(MANIFEST_PATH):
+        return {"next_id": 0, "files": {}}
+    with open(MANIFEST_PATH, "r") as f:
+        manifest = json.load(f)
+    manifest["files"] = {
+        normalize_path(rel_path): entry for rel_path, entry in manifest["files"].items()
+    }
+    return manifest
+
+
+def load_state():
+    """Load the current embeddings, metadata and an ID-mapped FAISS index"""
+    # The image index is maintained here whatever the serving search level
+    embeddings, index, metadata_df = load_embeddings(search_level="image")
+    if embeddings is None or metadata_df is None:
+        return (
+            {},
+            None,
+            pd.DataFrame(
+                columns=["product_id", "relative_path", "filename", "faiss_id"]
+            ),
+        )
+
+    # Copy rows out of the memory map so the store files can be replaced
+    embeddings = {k: np.array(v) for k, v in embeddings.items()}
+
+    # Legacy artifacts used row positions as ids; make them explicit
+    dropped = False
+    if "faiss_id" not in metadata_df.columns:
+        id_by_path = dict(zip(embeddings, get_faiss_ids(embeddings, metadata_df)))
+        metadata_df["faiss_id"] = metadata_df["relative_path"].map(id_by_path)
+        metadata_df = metadata_df.dropna(subset=["faiss_id"])
+        metadata_df["faiss_id"] = metadata_df["faiss_id"].astype("int64")
+
+        # Vectors left without a metadata row have no id; drop them too
+        kept = set(metadata_df["relative_path"])
+        dropped = len(kept) < len(embeddings)
+        embeddings = {k: v for k, v in embeddings.items() if k in kept}
+
+    id_addressable = isinstance(index, faiss.IndexIDMap2) or (
+        index is not None and faiss.try_extract_index_ivf(index) is not None
+    )
+    if index is None or not id_addressable or dropped:
+        print("Converting FAISS index to an ID-mapped index...")
+        index = build_faiss_index(embeddings, metadata_df)
+
+    return embeddings, index, metadata_df
+
+
+def embed_images(images_dir, image_paths, model, transform, device, batch_size=32):
+    """Embed catalogue images in batches; returns (paths_ok, matrix)"""
+    paths_ok = []
+    batches = []
+    for start in range(0, len(image_paths), batch_size):
+        tensors = []
+        for image_path in image_paths[start : start + batch_size]:
+            try:
+                image = Image.open(os.path.join(images_dir, image_path)).convert("RGB")
+                tensors.append(transform(image))
+                paths_ok.append(image_path)
+            except Exception as e:
+                print(f"Error processing {image_path}: {e}")
+        if not tensors:
+            continue
+
+        with torch.no_grad():
+            features = model(torch.stack(tensors).to(device))
+        features = torch.nn.functional.normalize(features, dim=1)
+        batches.append(features.cpu().numpy().astype("float32"))
+
+    if not batches:
+        return [], np.empty((0, 0), dtype="float32")
+    return paths_ok, np.vstack(batches)
+
+
+def atomic_write(write_fn, target_path):
+    """Write through a temp file so readers never see a half-written artifact"""
+    tmp_path = f"{target_path}.tmp"
+    write_fn(tmp_path)
+    os.replace(tmp_path, target_path)
+
+
+def save_manifest(manifest):
+    """Persist the per-image manifest"""
+
+    def write_manifest(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+
+    atomic_write(write_manifest, MANIFEST_PATH)
+
+
+def save_state(embeddings, index, metadata_df, manifest):
+    """
+    Persist the vector store, metadata, index and manifest.
+
+    Called only when images were added, changed or removed. Each artifact is
+    rewritten whole: the .npy store cannot drop rows in place, and every
+    artifact is replaced atomically so the server never reads a mix of old
+    and new files. That is sequential I/O of about count * dim * 4 bytes
+    (roughly 300 MB at 100k 768-d images), a few seconds next to embedding.
+    """
+    if embeddings:
+        matrix = np.vstack(list(embeddings.values())).astype("float32")
+    else:
+        # Every image was deleted; an empty store stops them being served
+        matrix = np.empty((0, index.d), dtype="float32")
+    # save_vector_store writes the store header last and atomically
+    save_vector_store(
+        EMBEDDINGS_STORE_PATH,
+        matrix,
+        ids=list(embeddings.keys()),
+        normalized=True,
+    )
+    atomic_write(lambda p: metadata_df.to_csv(p, index=False), METADATA_PATH)
+    atomic_write(lambda p: faiss.write_index(index, p), FAISS_INDEX_PATH)
+    save_manifest(manifest)
+
+
+def update_index(
+    images_dir=IMAGES_DIR, pattern=os.path.join("*", "nobg", "*"), batch_size=32
+):
+    """Bring the DINOv2 index in line with the images currently on disk"""
+    manifest = load_manifest()
+    embeddings, index, metadata_df = load_state()
+    on_disk = scan_images(images_dir, pattern)
+
+    # Existing ids, so legacy entries not yet in the manifest keep theirs
+    id_by_path = dict(zip(metadata_df["relative_path"], metadata_df["faiss_id"]))
+    next_id = max([manifest["next_id"]] + [int(i) + 1 for i in id_by_path.values()])
+    # Stored relative_path of each indexed image, by path key
+    path_by_key = {normalize_path(p): p for p in embeddings}
+
+    # Classify every image as unchanged, changed or new
+    to_embed = []
+    hashes = {}
+    for key, (rel_path, mtime_ns, size) in on_disk.items():
+        entry = manifest["files"].get(key)
+        if (
+            entry
+            and key in path_by_key
+            and entry["mtime_ns"] == mtime_ns
+            and entry["size"] == size
+        ):
+            continue  # Cheap stat check says unchanged, skip hashing
+
+        content_hash = file_sha256(os.path.join(images_dir, rel_path))
+        hashes[key] = content_hash
+        if entry is None and key in path_by_key:
+            # First run over artifacts built before the manifest existed:
+            # adopt the existing vector instead of re-embedding it
+            manifest["files"][key] = {
+                "sha256": content_hash,
+                "mtime_ns": mtime_ns,
+                "size": size,
+                "faiss_id": int(id_by_path[path_by_key[key]]),
+            }
+            continue
+        if entry and key in path_by_key and entry["sha256"] == content_hash:
+            # Touched but identical content: refresh the stat only
+            entry["mtime_ns"], entry["size"] = mtime_ns, size
+            continue
+        to_embed.append(key)
+
+    removed = [p for key, p in path_by_key.items() if key not in on_disk]
+    print(
+        f"{len(on_disk)} images on disk: {len(to_embed)} new/changed, {len(removed)} removed"
+    )
+    if not to_embed and not removed:
+        # Nothing to re-index; persist refreshed stats so the next run skips hashing
+        manifest["next_id"] = next_id
+        save_manifest(manifest)
+        print("Index is up to date")
+        return
+
+    # Embed new and changed images first, so a changed image that fails to
+    # embed keeps its previous vector instead of dropping out of search
+    keys_ok, matrix = [], None
+    if to_embed:
+        model, transform, device = load_model()
+        if model is None:
+            print("Failed to load DINOv2 model")
+            return
+        keys_ok, matrix = embed_images(
+            images_dir, to_embed, model, transform, device, batch_size=batch_size
+        )
+
+    # Drop vectors for removed images and for changed ones now re-embedded
+    stale = removed + [path_by_key[key] for key in keys_ok if key in path_by_key]
+    rebuild = index is None or (stale and not supports_removal(index))
+    if stale and not rebuild:
+        index.remove_ids(np.array([id_by_path[p] for p in stale], dtype="int64"))
+    for rel_path in stale:
+        embeddings.pop(rel_path, None)
+        manifest["files"].pop(normalize_path(rel_path), None)
+    metadata_df = metadata_df[~metadata_df["relative_path"].isin(stale)]
+
+    # Add the new vectors, reusing the stored path and id of changed images
+    new_rows = []
+    if keys_ok:
+        paths_ok = [path_by_key.get(key, on_disk[key][0]) for key in keys_ok]
+        ids = []
+        for rel_path in paths_ok:
+            if rel_path not in id_by_path:
+                id_by_path[rel_path] = next_id
+                next_id += 1
+            ids.append(int(id_by_path[rel_path]))
+
+        if not rebuild:
+            index.add_with_ids(matrix, np.array(ids, dtype="int64"))
+
+        for key, rel_path, faiss_id, vector in zip(keys_ok, paths_ok, ids, matrix):
+            embeddings[rel_path] = vector
+            _, mtime_ns, size = on_disk[key]
+            manifest["files"][key] = {
+                "sha256": hashes[key],
+                "mtime_ns": mtime_ns,
+                "size": size,
+                "faiss_id": faiss_id,
+            }
+            new_rows.append(
+                {
+                    # Products are stored as <product_id>/nobg/<image>
+                    "product_id": key.split("/")[0],
+                    "relative_path": rel_path,
+                    "filename": os.path.basename(rel_path),
+                    "faiss_id": faiss_id,
+                }
+            )
+
+    if new_rows:
+        metadata_df = pd.concat(
+            [metadata_df, pd.DataFrame(new_rows)], ignore_index=True
+        )
+
+    # Keep metadata rows in embedding dict order
+    order = {p: i for i, p in enumerate(embeddings)}
+    metadata_df = metadata_df.sort_values(
+        "relative_path", key=lambda s: s.map(order)
+    ).reset_index(drop=True)
+
+    if not embeddings and index is None:
+        print("No catalogue images to index")
+        return
+
+    if rebuild:
+        print("Rebuilding FAISS index from stored vectors...")
+        if embeddings:
+            index = build_faiss_index(embeddings, metadata_df)
+        else:
+            # Nothing to train an index on; an empty flat index still
+            # replaces the one listing the deleted images
+            index = build_index(
+                np.empty((0, index.d), dtype="float32"),
+                np.empty(0, dtype="int64"),
+                index_type="flat",
+            )
+
+    manifest["next_id"] = next_id
+    save_state(embeddings, index, metadata_df, manifest)
+    print(f"Index updated: {index.ntotal} vectors")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Incrementally update the DINOv2 embedding index"
+    )
+    parser.add_argument("--images_dir", type=str, default=IMAGES_DIR)
+    parser.add_argument(
+        "--pattern",
+        type=str,
+        default=os.path.join("*", "nobg", "*"),
+        help="Glob (relative to images_dir) selecting catalogue images",
+    )
+    parser.add_argument("--batch_size", type=int, default=32)
+    args = parser.parse_args()
+
+    update_index(args.images_dir, args.pattern, batch_size=args.batch_size)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+"""
+FAISS index factory for DINOv2 image search.
+
+Builds one of several index types over L2-normalized embeddings, all using
+inner product (cosine) similarity and all searchable by stable FAISS ids:
+
+    flat      exact brute force (IndexFlatIP), the recall reference
+    ivf_flat  inverted lists over full vectors; nprobe trades recall for speed
+    ivf_pq    inverted lists over product-quantized codes; far smaller in RAM
+    hnsw      graph index; efSearch trades recall for speed
+    sq_fp16   brute force over float16 codes (2x smaller), exact rescoring
+    sq_int8   brute force over int8 codes (4x smaller), exact rescoring
+
+The scalar-quantized types fetch RESCORE_FACTOR times the candidates and
+re-rank them against the full-precision vectors memory-mapped from the vector
+store (model/quantized_index.py); without a vector store they are searched
+without rescoring.
+
+The type and search-time knobs come from the environment (DINOV2_INDEX_TYPE,
+DINOV2_NPROBE, DINOV2_EF_SEARCH) or the command line. Run with --report to
+measure recall and latency of every type against the flat index on the
+current catalogue, or with --build to write FAISS_INDEX_PATH with one type.
+
+Usage:
+    python index_factory.py --report [--k 36] [--queries 200] [--output report.json]
+    python index_factory.py --build ivf_flat [--nprobe 16]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import numpy as np
+import faiss
+
+# Make the shared model/ utilities importable
+sys.path.append(
+    os.path.dirname(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    )
+)
+from model.quantized_index import scalar_quantizer, search_rescored, storage_of
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq_fp16", "sq_int8")
+
+# Storage of each scalar-quantized index type
+SQ_STORAGE = {"sq_fp16": "float16", "sq_int8": "int8"}
+
+INDEX_TYPE = os.getenv("DINOV2_INDEX_TYPE", "flat")
+NPROBE = int(os.getenv("DINOV2_NPROBE", "16"))
+EF_SEARCH = int(os.getenv("DINOV2_EF_SEARCH", "64"))
+
+# Build-time defaults
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+PQ_SUBQUANTIZERS = 64  # 768-d DINOv2 vectors -> 64-byte codes
+
+
+def default_nlist(n_vectors):
+    """Number of IVF lists: ~4*sqrt(N), capped so each list gets 39+ training points"""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def _pq_subquantizers(dim, requested=PQ_SUBQUANTIZERS):
+    # PQ needs the dimension to split evenly into sub-vectors
+    for m in range(min(requested, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def build_index(
+    matrix,
+    ids,
+    index_type=INDEX_TYPE,
+    nlist=None,
+    nprobe=NPROBE,
+    ef_search=EF_SEARCH,
+    pq_m=PQ_SUBQUANTIZERS,
+):
+    """
+    Build and fill an index of the requested type.
+
+    Args:
+        matrix: float32 array of L2-normalized vectors, one per row
+        ids: int64 FAISS id of each row
+        index_type: One of INDEX_TYPES
+        nlist: IVF list count (defaults to default_nlist)
+        nprobe: IVF lists probed per query
+        ef_search: HNSW candidate list size per query
+        pq_m: Number of PQ sub-quantizers for ivf_pq
+
+    Returns:
+        A FAISS index searchable by the given ids
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type}; choose from {INDEX_TYPES}")
+
+    matrix = np.ascontiguousarray(matrix, dtype="float32")
+    ids = np.ascontiguousarray(ids, dtype="int64")
+    n_vectors, dim = matrix.shape
+
+    if index_type == "flat":
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or default_nlist(n_vectors)
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(
+                quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT
+            )
+        else:
+            # 8-bit codes need 256 centroids per sub-quantizer; use fewer bits
+            # on small catalogues so training still has enough points
+            nbits = max(4, min(8, int(math.log2(max(n_vectors // 39, 16)))))
+            index = faiss.IndexIVFPQ(
+                quantizer,
+                dim,
+                nlist,
+                _pq_subquantizers(dim, pq_m),
+                nbits,
+                faiss.METRIC_INNER_PRODUCT,
+            )
+        print(f"Training {index_type} index with {nlist} lists...")
+        index.train(matrix)
+        # IVF indexes store ids natively and support remove_ids directly
+
+    elif index_type in SQ_STORAGE:
+        index = faiss.IndexIDMap2(scalar_quantizer(matrix, SQ_STORAGE[index_type]))
+
+    else:  # hnsw
+        hnsw = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        # HNSW has no native ids; vectors can be added but not removed
+        index = faiss.IndexIDMap2(hnsw)
+
+    index.add_with_ids(matrix, ids)
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    return index
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Apply search-time knobs to whichever index type this is"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+
+    inner = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    if isinstance(inner, faiss.IndexHNSW) and ef_search is not None:
+        inner.hnsw.efSearch = ef_search
+
+
+def apply_env_search_params(index):
+    """Override saved search knobs with DINOV2_NPROBE / DINOV2_EF_SEARCH if set"""
+    nprobe = os.getenv("DINOV2_NPROBE")
+    ef_search = os.getenv("DINOV2_EF_SEARCH")
+    set_search_params(
+        index,
+        nprobe=int(nprobe) if nprobe else None,
+        ef_search=int(ef_search) if ef_search else None,
+    )
+
+
+def index_type_of(index):
+    """Return the INDEX_TYPES name of a built or loaded index"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # try_extract_index_ivf returns the IndexIVF base proxy
+        ivf = faiss.downcast_index(ivf)
+        return "ivf_pq" if isinstance(ivf, faiss.IndexIVFPQ) else "ivf_flat"
+    inner = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    storage = storage_of(index)
+    for index_type, sq_storage in SQ_STORAGE.items():
+        if sq_storage == storage:
+            return index_type
+    return "flat"
+
+
+def rows_by_faiss_id(ids):
+    """Array mapping each FAISS id to its matrix row, -1 for unused ids"""
+    ids = np.asarray(ids, dtype="int64")
+    rows = np.full(int(ids.max()) + 1 if len(ids) else 0, -1, dtype="int64")
+    rows[ids] = np.arange(len(ids))
+    return rows
+
+
+def supports_removal(index):
+    """HNSW graphs cannot drop vectors; every other type here can"""
+    return index_type_of(index) != "hnsw"
+
+
+def index_size_bytes(index):
+    """Serialized size of an index, a close proxy for its RAM footprint"""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def _latency_ms(index, queries, k, vectors=None, rows_by_id=None):
+    # One query at a time, like the online search path (including rescoring)
+    timings = []
+    labels = []
+    for query in queries:
+        start = time.perf_counter()
+        _, found = search_rescored(index, query.reshape(1, -1), k, vectors, rows_by_id)
+        timings.append((time.perf_counter() - start) * 1000)
+        labels.append(found[0])
+    return np.array(timings), np.vstack(labels)
+
+
+def _recall(found, truth):
+    k = truth.shape[1]
+    hits = [len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth)]
+    return float(np.mean(hits)) / k
+
+
+def recall_latency_report(matrix, ids, k=36, n_queries=200, seed=0):
+    """
+    Measure recall@k and per-query latency of every index configuration
+    against the exact flat index.
+
+    Queries are catalogue vectors with a little noise added, so each query has
+    realistic near neighbours without trivially matching itself.
+    """
+    rng = np.random.default_rng(seed)
+    matrix = np.ascontiguousarray(matrix, dtype="float32")
+    picks = rng.choice(len(matrix), size=min(n_queries, len(matrix)), replace=False)
+    queries = matrix[picks] + rng.normal(0, 0.02, size=(len(picks), matrix.shape[1]))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(
+        "float32"
+    )
+
+    configs = [("flat", {})]
+    configs += [("ivf_flat", {"nprobe": p}) for p in (1, 4, 16, 64)]
+    configs += [("ivf_pq", {"nprobe": p}) for p in (4, 16, 64)]
+    configs += [("hnsw", {"ef_search": e}) for e in (16, 64, 256)]
+    configs += [("sq_fp16", {}), ("sq_int8", {})]
+
+    # The matrix doubles as the full-precision store for rescoring
+    rows_by_id = rows_by_faiss_id(ids)
+
+    truth = None
+    built = {}
+    results = []
+    for index_type, params in configs:
+        # Build each type once and sweep its search knob
+        if index_type not in built:
+            start = time.perf_counter()
+            built[index_type] = (
+                build_index(matrix, ids, index_type=index_type),
+                time.perf_counter() - start,
+            )
+        index, build_seconds = built[index_type]
+        set_search_params(index, **params)
+
+        timings, found = _latency_ms(index, queries, k, matrix, rows_by_id)
+        if truth is None:
+            truth = found  # flat is first and exact
+        results.append(
+            {
+                "index_type": index_type,
+                "params": params,
+                "recall_at_k": round(_recall(found, truth), 4),
+                "latency_ms_p50": round(float(np.percentile(timings, 50)), 3),
+                "latency_ms_p95": round(float(np.percentile(timings, 95)), 3),
+                "build_seconds": round(build_seconds, 2),
+                "index_bytes": index_size_bytes(index),
+            }
+        )
+        print(
+            f"{index_type:9s} {json.dumps(params):20s} "
+            f"recall@{k}={results[-1]['recall_at_k']:.3f} "
+            f"p50={results[-1]['latency_ms_p50']:.2f}ms "
+            f"size={results[-1]['index_bytes'] / 1e6:.1f}MB"
+        )
+
+    return {
+        "vectors": int(len(matrix)),
+        "dim": int(matrix.shape[1]),
+        "k": k,
+        "queries": int(len(queries)),
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or evaluate DINOv2 indexes")
+    parser.add_argument(
+        "--report", action="store_true", help="Run recall/latency report"
+    )
+    parser.add_argument("--build", type=str, choices=INDEX_TYPES, help="Write index")
+    parser.add_argument("--k", type=int, default=36, help="Neighbours per query")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, default=NPROBE)
+    parser.add_argument("--ef_search", type=int, default=EF_SEARCH)
+    parser.add_argument("--output", type=str, help="Write the report JSON here")
+    args = parser.parse_args()
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from embedding_search import (
+        FAISS_INDEX_PATH,
+        load_embeddings,
+        get_embedding_matrix,
+        get_faiss_ids,
+    )
+
+    embeddings, _, metadata_df = load_embeddings(search_level="image")
+    if embeddings is None:
+        print("No embeddings found")
+        sys.exit(1)
+    matrix = get_embedding_matrix(embeddings)
+    ids = get_faiss_ids(embeddings, metadata_df)
+
+    if args.build:
+        index = build_index(
+            matrix,
+            ids,
+            index_type=args.build,
+            nprobe=args.nprobe,
+            ef_search=args.ef_search,
+        )
+        faiss.write_index(index, f"{FAISS_INDEX_PATH}.tmp")
+        os.replace(f"{FAISS_INDEX_PATH}.tmp", FAISS_INDEX_PATH)
+        print(f"Wrote {args.build} index with {index.ntotal} vectors")
+
+    if args.report:
+        report = recall_latency_report(matrix, ids, k=args.k, n_queries=args.queries)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Report written to {args.output}")
+        else:
+            print(json.dumps(report, indent=2))
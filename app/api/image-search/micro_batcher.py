@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Dynamic micro-batching for concurrent requests.
+
+Requests submitted from many threads are queued; a single worker thread takes
+the first waiting request, keeps collecting for up to max_wait_ms or until
+max_batch requests are in hand, and processes them with one call. Each caller
+blocks on its own Future, so batching is invisible to the request handlers.
+Under light load a request waits at most max_wait_ms; under heavy load
+batches fill up immediately and the model runs with full batches.
+"""
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+MAX_BATCH = int(os.getenv("IMAGE_SEARCH_MAX_BATCH", "16"))
+MAX_WAIT_MS = float(os.getenv("IMAGE_SEARCH_MAX_WAIT_MS", "5"))
+
+
+class MicroBatcher:
+    """Collects submitted items into batches for a batch-processing function."""
+
+    def __init__(self, process_batch, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        """
+        Start the batching worker thread.
+
+        Args:
+            process_batch: Callable taking a list of items and returning a
+                list of results in the same order
+            max_batch: Largest number of items processed together
+            max_wait_ms: Longest time the first item of a batch waits for more
+        """
+        self.process_batch = process_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run, name="micro-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, item):
+        """Queue an item; the returned Future resolves to its result"""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect(self):
+        # Block for the first item, then gather more until the batch is full
+        # or the first item has waited max_wait
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = list(self.process_batch([item for item, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            if len(results) != len(batch):
+                # A short result list would leave callers waiting forever
+                error = RuntimeError(
+                    f"process_batch returned {len(results)} results for {len(batch)} items"
+                )
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Two-level, product-level search over the DINOv2 image embeddings.
+
+Each product has several images, so searching images directly needs an
+over-fetch and a dedup pass, and can still return fewer than top_k products
+when one product fills the neighbourhood. Instead:
+
+    level 1  one mean-pooled, normalized vector per product in a FAISS index
+             of the configured type (see index_factory), which finds
+             PRODUCT_CANDIDATE_FACTOR * top_k candidate products
+    level 2  every image of each candidate is scored exactly against the
+             full-precision image vectors; a product scores as its best image
+
+The result is exactly top_k distinct products (fewer only if the catalogue is
+smaller), ranked by their best image's cosine similarity. Images without a
+product_id count as products of their own.
+
+The product index is saved next to the image index (see
+product_index_paths) together with a signature of the catalogue files it was
+built from, so it is built once per catalogue change rather than on every
+load. At product level the image index itself is not loaded.
+
+Product level is opt-in with DINOV2_SEARCH_LEVEL=product. The default image
+level searches the image index directly, which incremental_index.py updates
+in place; a catalogue change rebuilds the whole product index instead.
+"""
+
+import os
+import json
+import faiss
+import numpy as np
+
+from index_factory import INDEX_TYPE, build_index, apply_env_search_params
+
+SEARCH_LEVEL = os.getenv("DINOV2_SEARCH_LEVEL", "image")
+# Candidate products reranked per requested product
+PRODUCT_CANDIDATE_FACTOR = int(os.getenv("DINOV2_PRODUCT_CANDIDATES", "8"))
+
+# Rows pooled per step while building product vectors
+_POOL_CHUNK = 65536
+
+
+def product_index_paths(index_path):
+    """(FAISS index, grouping arrays) paths of the product index for index_path"""
+    base = os.path.splitext(index_path)[0]
+    return f"{base}.products.faiss", f"{base}.products.npz"
+
+
+def source_signature(source_paths, index_type):
+    """Identify the catalogue files (and index type) a product index came from"""
+    stamp = []
+    for source_path in source_paths:
+        try:
+            stat = os.stat(source_path)
+            stamp.append([source_path, stat.st_mtime_ns, stat.st_size])
+        except FileNotFoundError:
+            stamp.append([source_path, None, None])
+    return json.dumps({"index_type": index_type, "sources": stamp})
+
+
+class ProductIndex:
+    """Product-level first stage with exact per-image reranking."""
+
+    def __init__(
+        self,
+        vectors,
+        product_ids,
+        faiss_ids,
+        index_type=INDEX_TYPE,
+        candidate_factor=PRODUCT_CANDIDATE_FACTOR,
+    ):
+        """
+        Group image rows by product and index the pooled product vectors.
+
+        Args:
+            vectors: Normalized image vectors, one row per image (a memmap is
+                read once here, then only at candidate rows)
+            product_ids: Product of each row (None = the image stands alone)
+            faiss_ids: FAISS id of each row, returned by search()
+            index_type: First-stage index type (see index_factory)
+            candidate_factor: Candidate products reranked per requested product
+        """
+        self.vectors = vectors
+        self.faiss_ids = np.asarray(faiss_ids, dtype="int64")
+        self.candidate_factor = max(1, candidate_factor)
+
+        # Product number of every row
+        group_of = {}
+        groups = np.empty(len(product_ids), dtype="int64")
+        for row, product_id in enumerate(product_ids):
+            key = product_id if product_id is not None else ("image", row)
+            groups[row] = group_of.setdefault(key, len(group_of))
+        self.n_products = len(group_of)
+
+        # Image rows grouped by product: rows[offsets[p]:offsets[p + 1]]
+        self.rows = np.argsort(groups, kind="stable")
+        counts = np.bincount(groups, minlength=self.n_products)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        # Mean-pool each product's images, then normalize for cosine search
+        pooled = np.zeros((self.n_products, vectors.shape[1]), dtype=np.float32)
+        for start in range(0, len(groups), _POOL_CHUNK):
+            chunk = np.asarray(vectors[start : start + _POOL_CHUNK], dtype=np.float32)
+            np.add.at(pooled, groups[start : start + _POOL_CHUNK], chunk)
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+        self.index = build_index(
+            pooled, np.arange(self.n_products), index_type=index_type
+        )
+        print(
+            f"Built {index_type} product index: {self.n_products} products "
+            f"over {len(groups)} images"
+        )
+
+    @property
+    def ntotal(self):
+        """Number of images covered, like the image index's ntotal"""
+        return len(self.faiss_ids)
+
+    def save(self, index_path, signature):
+        """Save next to the image index at index_path, tagged with signature"""
+        faiss_path, arrays_path = product_index_paths(index_path)
+        faiss.write_index(self.index, f"{faiss_path}.tmp")
+        os.replace(f"{faiss_path}.tmp", faiss_path)
+        # Written last: a matching signature marks a complete product index
+        with open(f"{arrays_path}.tmp", "wb") as f:
+            np.savez(
+                f,
+                faiss_ids=self.faiss_ids,
+                rows=self.rows,
+                offsets=self.offsets,
+                signature=np.array(signature),
+            )
+        os.replace(f"{arrays_path}.tmp", arrays_path)
+        print(f"Saved product index to {faiss_path}")
+
+    @classmethod
+    def load(
+        cls,
+        index_path,
+        vectors,
+        signature,
+        candidate_factor=PRODUCT_CANDIDATE_FACTOR,
+    ):
+        """
+        Load the product index saved for index_path.
+
+        Returns:
+            The ProductIndex, or None if none is saved or it was built from
+            different catalogue files (its signature does not match)
+        """
+        faiss_path, arrays_path = product_index_paths(index_path)
+        if not (os.path.exists(faiss_path) and os.path.exists(arrays_path)):
+            return None
+        with np.load(arrays_path) as arrays:
+            if str(arrays["signature"]) != signature:
+                return None
+            product_index = cls.__new__(cls)
+            product_index.faiss_ids = arrays["faiss_ids"]
+            product_index.rows = arrays["rows"]
+            product_index.offsets = arrays["offsets"]
+        product_index.vectors = vectors
+        product_index.candidate_factor = max(1, candidate_factor)
+        product_index.n_products = len(product_index.offsets) - 1
+        product_index.index = faiss.read_index(faiss_path)
+        apply_env_search_params(product_index.index)
+        print(f"Loaded product index from {faiss_path}")
+        return product_index
+
+    def search(self, queries, top_k):
+        """
+        Find the top_k distinct products for each query.
+
+        Returns:
+            (similarities, faiss ids) arrays shaped (n_queries, top_k), holding
+            each product's best image, best first and padded with -inf / -1
+        """
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        similarities = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        hit_ids = np.full((len(queries), top_k), -1, dtype="int64")
+
+        n_candidates = min(self.n_products, top_k * self.candidate_factor)
+        _, candidates = self.index.search(queries, n_candidates)
+
+        for i, (query, products) in enumerate(zip(queries, candidates)):
+            products = products[products >= 0]
+            if not len(products):
+                continue
+            starts, ends = self.offsets[products], self.offsets[products + 1]
+            rows = np.concatenate([self.rows[s:e] for s, e in zip(starts, ends)])
+
+            # Exact image scores, reading the vectors in row order
+            order = np.argsort(rows)
+            scores = np.empty(len(rows), dtype=np.float32)
+            scores[order] = np.asarray(self.vectors[rows[order]], np.float32) @ query
+
+            # Each candidate product's best image
+            segments = np.concatenate([[0], np.cumsum(ends - starts)])
+            best = [
+                start + int(np.argmax(scores[start:end]))
+                for start, end in zip(segments[:-1], segments[1:])
+            ]
+            ranking = np.argsort(-scores[best], kind="stable")[:top_k]
+            best = np.asarray(best)[ranking]
+
+            similarities[i, : len(best)] = scores[best]
+            hit_ids[i, : len(best)] = self.faiss_ids[rows[best]]
+
+        return similarities, hit_ids
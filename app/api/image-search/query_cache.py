@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Content-addressed caches for image-search queries.
+
+The search server keeps two of these: query embeddings keyed by the hash of
+the uploaded image bytes plus the model configuration, and final result lists
+keyed additionally by top_k and the index version. A repeated upload then
+skips decoding, background removal and the forward pass, and an exact repeat
+skips the FAISS search as well.
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Entries kept per cache before the least recently used are evicted
+QUERY_CACHE_ENTRIES = int(os.getenv("IMAGE_QUERY_CACHE_ENTRIES", "1024"))
+
+
+def image_digest(image_bytes):
+    """Content hash of an uploaded image"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping with hit/miss counters."""
+
+    def __init__(self, max_entries=QUERY_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value (refreshing its recency) or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,14 +1,108 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { exec } from 'child_process';
+import { spawn } from 'child_process';
 import path from 'path';
 import fs from 'fs';
-import { promisify } from 'util';
-import { v4 as uuidv4 } from 'uuid';
 
-const execAsync = promisify(exec);
-const writeFileAsync = promisify(fs.writeFile);
-const mkdirAsync = promisify(fs.mkdir);
-const unlinkAsync = promisify(fs.unlink);
+// Persistent search worker started with `python search_server.py`
+const SEARCH_SERVER_URL = process.env.IMAGE_SEARCH_URL || 'http://127.0.0.1:8765';
+// A worker that has not answered by then gets a 504, not a fallback
+const SEARCH_SERVER_TIMEOUT_MS = parseInt(process.env.IMAGE_SEARCH_TIMEOUT_MS || '30000');
+// Same bound as the worker's IMAGE_SEARCH_MAX_TOP_K, so the script fallback agrees with it
+const MAX_TOP_K = parseInt(process.env.IMAGE_SEARCH_MAX_TOP_K || '100');
+// Errors meaning no worker is listening, so the one-shot script is worth starting
+const CONNECTION_ERROR_CODES = new Set(['ECONNREFUSED', 'ENOTFOUND', 'EHOSTUNREACH']);
+
+function isTimeout(err: unknown) {
+  return err instanceof Error && (err.name === 'TimeoutError' || err.name === 'AbortError');
+}
+
+function isConnectionError(err: unknown) {
+  // fetch wraps the socket error in `cause`
+  const cause = err instanceof Error ? (err.cause as { code?: string } | undefined) : undefined;
+  return CONNECTION_ERROR_CODES.has(cause?.code ?? '');
+}
+
+const TIMEOUT_RESULT = { body: { error: 'Image search server timed out' }, status: 504 };
+
+// Query the long-lived search worker with the raw image bytes; returns its JSON body and
+// HTTP status, or null if no worker is running. A slow worker is not replaced by a cold
+// Python process, which would only add load to an already busy box.
+async function searchWithServer(image: Buffer, topK: number, removeBackground: boolean) {
+  const signal = AbortSignal.timeout(SEARCH_SERVER_TIMEOUT_MS);
+  let response: Response;
+  try {
+    response = await fetch(
+      `${SEARCH_SERVER_URL}/search?top_k=${topK}&remove_bg=${removeBackground}`,
+      {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/octet-stream' },
+        body: image,
+        signal,
+      }
+    );
+  } catch (err) {
+    if (isTimeout(err)) {
+      console.error('Search server timed out:', err);
+      return TIMEOUT_RESULT;
+    }
+    if (isConnectionError(err)) {
+      console.log('Search server unavailable, falling back to Python script:', err);
+      return null;
+    }
+    console.error('Search server request failed:', err);
+    return { body: { error: 'Image search server request failed' }, status: 502 };
+  }
+
+  try {
+    return { body: await response.json(), status: response.status };
+  } catch (err) {
+    if (isTimeout(err)) {
+      console.error('Search server timed out:', err);
+      return TIMEOUT_RESULT;
+    }
+    // The worker answered but not with JSON: report the fault instead of hiding it
+    console.error('Search server returned an invalid response:', err);
+    return { body: { error: 'Image search server returned an invalid response' }, status: 502 };
+  }
+}
+
+// Parse the topK form field: defaults to 12, capped at MAX_TOP_K; null if not a positive integer
+function parseTopK(value: FormDataEntryValue | null) {
+  if (value === null || value === '') {
+    return 12;
+  }
+  const topK = Number(value);
+  if (!Number.isInteger(topK) || topK < 1) {
+    return null;
+  }
+  return Math.min(topK, MAX_TOP_K);
+}
+
+// Run the one-shot Python search, piping the raw image bytes over stdin; rejects if the
+// script exits with a non-zero code
+function searchWithScript(scriptPath: string, image: Buffer, topK: number, removeBackground: boolean) {
+  return new Promise<string>((resolve, reject) => {
+    const child = spawn('python', [scriptPath, '-', String(topK), String(removeBackground)]);
+    let stdout = '';
+    let stderr = '';
+
+    child.stdout.on('data', (chunk) => (stdout += chunk));
+    child.stderr.on('data', (chunk) => (stderr += chunk));
+    child.on('error', reject);
+    child.on('close', (code, signal) => {
+      if (stderr) {
+        console.log('Python script info:', stderr);
+      }
+      if (code !== 0) {
+        reject(new Error(`Image search script exited with ${code !== null ? `code ${code}` : signal}`));
+        return;
+      }
+      resolve(stdout);
+    });
+
+    child.stdin.end(image);
+  });
+}
 
 export async function POST(request: NextRequest) {
   try {
@@ -16,8 +110,8 @@ export async function POST(request: NextRequest) {
     const formData = await request.formData();
     const file = formData.get('image') as File;
     const removeBackground = formData.get('removeBg') !== 'false'; // Default to true
-    const topK = parseInt(formData.get('topK')?.toString() || '12');
-    
+    const topK = parseTopK(formData.get('topK'));
+
     if (!file) {
       return NextResponse.json(
         { error: 'No image file provided' },
@@ -25,33 +119,25 @@ export async function POST(request: NextRequest) {
       );
     }
 
-    // Create a temporary directory if it doesn't exist
-    const tempDir = path.join(process.cwd(), 'temp');
-    try {
-      await mkdirAsync(tempDir, { recursive: true });
-    } catch (err) {
-      // Directory might already exist, which is fine
+    if (topK === null) {
+      return NextResponse.json(
+        { error: 'topK must be a positive integer' },
+        { status: 400 }
+      );
     }
 
-    // Generate a unique filename
-    const uniqueId = uuidv4();
-    const filename = `${uniqueId}-${file.name}`;
-    const filepath = path.join(tempDir, filename);
-
-    // Convert the file to a buffer and save it
+    // The upload is passed on as raw bytes; nothing is written to disk
     const buffer = Buffer.from(await file.arrayBuffer());
-    await writeFileAsync(filepath, buffer);
 
-    // Convert the image file to base64
-    const fileBase64 = buffer.toString('base64');
-    
-    // Save base64 data to a temporary file instead of passing it directly
-    const base64TempFile = path.join(tempDir, `${uniqueId}-base64.txt`);
-    await writeFileAsync(base64TempFile, fileBase64);
+    // Prefer the persistent worker, which keeps the model and index in memory
+    const serverResult = await searchWithServer(buffer, topK, removeBackground);
+    if (serverResult) {
+      // Errors reported by the worker keep their status code
+      return NextResponse.json(serverResult.body, { status: serverResult.status });
+    }
 
-    // Call the Python script with the path to the base64 file
     const scriptPath = path.join(process.cwd(), 'app', 'api', 'image-search', 'similarity_runner.py');
-    
+
     // For debugging purposes, check if the script exists
     if (!fs.existsSync(scriptPath)) {
       console.error('Script not found at path:', scriptPath);
@@ -60,27 +146,21 @@ export async function POST(request: NextRequest) {
         { status: 500 }
       );
     }
-    
-    // Pass the filepath to the base64 data, not the data itself
-    const { stdout, stderr } = await execAsync(
-      `python "${scriptPath}" "${base64TempFile}" ${topK} ${removeBackground} --file`
-    );
 
-    if (stderr) {
-      console.log('Python script info:', stderr);
+    let stdout: string;
+    try {
+      stdout = await searchWithScript(scriptPath, buffer, topK, removeBackground);
+    } catch (err) {
+      console.error('Image search script failed:', err);
+      return NextResponse.json(
+        { error: err instanceof Error ? err.message : 'Image search script failed' },
+        { status: 500 }
+      );
     }
 
     // Parse the results - expecting JSON output from the Python script
     const similarItems = JSON.parse(stdout.trim());
 
-    // Clean up the temporary files
-    try {
-      await unlinkAsync(filepath);
-      await unlinkAsync(base64TempFile);
-    } catch (err) {
-      console.error('Failed to delete temporary files:', err);
-    }
-
     return NextResponse.json(similarItems);
   } catch (error) {
     console.error('Error processing DINOv2 image search:', error);
@@ -89,4 +169,4 @@ export async function POST(request: NextRequest) {
       { status: 500 }
     );
   }
-}
\ No newline at end of file
+}
@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+"""
+Persistent DINOv2 image-search worker.
+
+Loads the DINOv2 model, the embeddings and the FAISS index once and serves
+queries from memory over a local HTTP endpoint, so an upload only pays for
+the forward pass and the index search. The on-disk artifacts are checked on
+every request and reloaded when any of them changes.
+
+Repeated uploads are served from content-addressed caches (see
+query_cache.py): the query embedding is reused for any top_k, and the full
+result list for exact repeats until the index changes.
+
+Cache misses from concurrent requests are micro-batched (see
+micro_batcher.py): each request decodes and removes the background of its
+image in its own handler thread, then queries arriving within max_wait_ms of
+each other, up to max_batch, share one forward pass and one FAISS search.
+
+Per-stage latencies (decode, rembg, preprocess, forward, faiss, collect,
+serialization), in-flight requests and cache hit rates are exported for
+Prometheus on /metrics (see model/metrics.py). Searches slower than
+SLOW_QUERY_MS are logged with their stage breakdown to SLOW_QUERY_LOG.
+
+/admin/profile starts an on-demand profiler capture (see model/profiler.py).
+In cprofile mode each micro-batch counts as one profiled request, since the
+forward pass and FAISS search run on the batching thread; sampling mode also
+covers decoding and background removal in the handler threads.
+
+Usage:
+    python search_server.py [--host 127.0.0.1] [--port 8765]
+        [--max_batch 16] [--max_wait_ms 5]
+
+Endpoints:
+    POST /search?top_k=12&remove_bg=true   body: raw image bytes
+        (top_k must be at least 1 and is capped at IMAGE_SEARCH_MAX_TOP_K)
+    GET  /health
+    GET  /metrics
+    POST /admin/profile   body: {"mode": "sampling", "seconds": 30}
+    GET  /admin/profile   (both need the X-Admin-Token header)
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Make sibling modules importable regardless of the working directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from embedding_search import (
+    EMBEDDINGS_PATH,
+    EMBEDDINGS_STORE_PATH,
+    METADATA_PATH,
+    COMBINED_DATA_PATH,
+    FAISS_INDEX_PATH,
+    REMBG_MODEL,
+    REMBG_MASK_MAX_SIDE,
+    load_model,
+    load_embeddings,
+    build_result_lookup,
+    preprocess_query_image,
+    embed_tensors,
+    rank_similar_products,
+    rank_similar_products_batch,
+)
+from model.vector_store import store_paths
+from model.inference_backend import INFERENCE_BACKEND
+from model.metrics import CONTENT_TYPE, Registry, RequestTrace, slow_query_logger
+from model.profiler import Profiler, is_authorized
+from query_cache import LRUCache, image_digest
+from micro_batcher import MicroBatcher, MAX_BATCH, MAX_WAIT_MS
+
+DEFAULT_HOST = os.getenv("IMAGE_SEARCH_HOST", "127.0.0.1")
+DEFAULT_PORT = int(os.getenv("IMAGE_SEARCH_PORT", "8765"))
+# Larger top_k values are capped, so each one does not take its own cache slot
+MAX_TOP_K = int(os.getenv("IMAGE_SEARCH_MAX_TOP_K", "100"))
+
+# Files whose modification invalidates the in-memory search data
+# The store header is rewritten last, so its mtime marks a completed update
+WATCHED_PATHS = [
+    store_paths(EMBEDDINGS_STORE_PATH)[2],
+    COMBINED_DATA_PATH,
+    EMBEDDINGS_PATH,
+    METADATA_PATH,
+    FAISS_INDEX_PATH,
+]
+
+# Prometheus metrics served on /metrics
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "image_search_stage_seconds",
+    "Time spent in each stage of a /search request",
+    ["stage"],
+)
+IN_FLIGHT = REGISTRY.gauge("image_search_requests_in_flight", "Searches being served")
+REQUESTS = REGISTRY.counter(
+    "image_search_requests_total", "/search requests by HTTP status", ["status"]
+)
+BATCH_SIZE = REGISTRY.histogram(
+    "image_search_batch_size",
+    "Queries per micro-batched forward pass",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+SLOW_LOG = slow_query_logger(
+    os.getenv("SLOW_QUERY_LOG", "image_search_slow_queries.log")
+)
+
+# On-demand captures started through /admin/profile
+PROFILER = Profiler()
+
+
+class SearchEngine:
+    """Holds the model and search data in memory and reloads stale artifacts."""
+
+    def __init__(self, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self._lock = threading.Lock()
+        self.model, self.transform, self.device = load_model()
+        if self.model is None:
+            raise RuntimeError("Failed to load DINOv2 model")
+
+        # Everything that changes the embedding of a given upload
+        self.model_version = (
+            f"{type(self.model).__name__}:{INFERENCE_BACKEND}:"
+            f"{REMBG_MODEL}:{REMBG_MASK_MAX_SIDE}"
+        )
+        # (image hash, remove_bg, model version) -> normalized query embedding
+        self.embedding_cache = LRUCache()
+        # (image hash, remove_bg, top_k, index version) -> result payload
+        self.result_cache = LRUCache()
+
+        # (embeddings, index, df, lookup, index version), swapped as one
+        # reference on reload
+        self.data = None
+        self._artifact_stamp = None
+        self.reload_if_changed()
+
+        # The forward pass and FAISS search run once per batch
+        self._batcher = MicroBatcher(self._search_batch, max_batch, max_wait_ms)
+
+    def _current_stamp(self):
+        """Return the (path, mtime, size) signature of the watched artifacts"""
+        stamp = []
+        for artifact_path in WATCHED_PATHS:
+            try:
+                stat = os.stat(artifact_path)
+                stamp.append((artifact_path, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamp.append((artifact_path, None, None))
+        return tuple(stamp)
+
+    def reload_if_changed(self):
+        """Reload embeddings and index if any artifact changed on disk"""
+        stamp = self._current_stamp()
+        if stamp == self._artifact_stamp:
+            return False
+
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock
+            if stamp == self._artifact_stamp:
+                return False
+
+            print("Search artifacts changed on disk, reloading...")
+            embeddings, index, df = load_embeddings()
+            if index is None or df is None:
+                print("Reload failed, keeping previously loaded data")
+                return False
+
+            # FAISS id -> path/product arrays, built once per load
+            lookup = build_result_lookup(embeddings, df)
+            # Re-stat after loading: load_embeddings() may have written the index
+            self._artifact_stamp = self._current_stamp()
+            self.data = (embeddings, index, df, lookup, hash(self._artifact_stamp))
+            # Results from the previous index are unreachable now; query
+            # embeddings do not depend on the index and are kept
+            self.result_cache.clear()
+            return True
+
+    def search(self, image_bytes, top_k=12, remove_bg=True, trace=None):
+        """
+        Search for similar products using the in-memory model and index.
+
+        trace, if given, is a RequestTrace that receives the stage timings
+        (and whether a cache answered) of this search.
+        """
+        self.reload_if_changed()
+        # Snapshot once so a concurrent reload cannot mix old and new data
+        data = self.data
+        if data is None:
+            return {"error": "Failed to load embeddings"}
+        embeddings, index, df, lookup, index_version = data
+
+        image_hash = image_digest(image_bytes)
+
+        # Exact repeat against the same index
+        result_key = (image_hash, remove_bg, top_k, index_version)
+        result = self.result_cache.get(result_key)
+        if result is not None:
+            if trace is not None:
+                trace.context["cache"] = "result"
+            return result
+
+        # Same image, different top_k or index: only the search is re-run
+        embedding_key = (image_hash, remove_bg, self.model_version)
+        query_embedding = self.embedding_cache.get(embedding_key)
+        if query_embedding is not None:
+            timings = {}
+            result = rank_similar_products(
+                query_embedding,
+                embeddings,
+                index,
+                df,
+                top_k=top_k,
+                lookup=lookup,
+                timings=timings,
+            )
+            self.result_cache.put(result_key, result)
+            if trace is not None:
+                trace.context["cache"] = "embedding"
+                trace.record_all(_search_stages(timings))
+            return result
+
+        # New image: decode and remove the background here, so slow rembg
+        # calls overlap across requests, then embed and search it together
+        # with concurrent requests
+        timings = {}
+        try:
+            tensor = preprocess_query_image(
+                image_bytes, self.transform, remove_bg, timings=timings
+            )
+        except Exception as e:
+            print(f"Error extracting embedding: {str(e)}")
+            if trace is not None:
+                trace.record_all(timings)
+            return {"error": "Failed to extract embedding from image"}
+
+        query_embedding, result, batch_index_version, batch_timings = (
+            self._batcher.submit((tensor, top_k)).result()
+        )
+        if trace is not None:
+            trace.record_all({**timings, **batch_timings})
+        self.embedding_cache.put(embedding_key, query_embedding)
+        self.result_cache.put(
+            (image_hash, remove_bg, top_k, batch_index_version), result
+        )
+        return result
+
+    def _search_batch(self, requests):
+        """
+        Embed and rank a micro-batch of (preprocessed tensor, top_k) requests.
+
+        Returns:
+            A (query embedding, result, index version, stage timings) tuple
+            per request. The forward pass and search are shared, so every
+            request in the batch reports the whole batch's time for them.
+        """
+        with PROFILER.request():
+            return self._run_batch(requests)
+
+    def _run_batch(self, requests):
+        embeddings, index, df, lookup, index_version = self.data
+        BATCH_SIZE.observe(len(requests))
+
+        forward_start = time.perf_counter()
+        vectors = embed_tensors(
+            [tensor for tensor, _ in requests], self.model, self.device
+        )
+        batch_timings = {"forward": time.perf_counter() - forward_start}
+
+        # One search at the largest top_k in the batch, trimmed per request
+        search_timings = {}
+        ranked = rank_similar_products_batch(
+            vectors,
+            embeddings,
+            index,
+            df,
+            top_k=max(top_k for _, top_k in requests),
+            lookup=lookup,
+            timings=search_timings,
+        )
+        batch_timings.update(_search_stages(search_timings))
+
+        return [
+            (
+                vector.copy(),
+                {**result, "results": result["results"][:top_k]},
+                index_version,
+                batch_timings,
+            )
+            for (_, top_k), vector, result in zip(requests, vectors, ranked)
+        ]
+
+
+def _search_stages(timings):
+    # rank_similar_products* report "search" and "collect"; the index search
+    # is exported as the "faiss" stage
+    return {
+        "faiss" if stage == "search" else stage: seconds
+        for stage, seconds in timings.items()
+    }
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end for a shared SearchEngine"""
+
+    engine = None
+
+    def _send_json(self, payload, status=200, trace=None):
+        serialize_start = time.perf_counter()
+        body = json.dumps(payload).encode("utf-8")
+        if trace is not None:
+            trace.record("serialization", time.perf_counter() - serialize_start)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_metrics(self):
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _admin_profile(self):
+        # Start a capture (POST) or report the running and last capture (GET)
+        if not is_authorized(self.headers.get("X-Admin-Token")):
+            self._send_json({"error": "Forbidden"}, status=403)
+            return
+        if self.command == "GET":
+            self._send_json(PROFILER.status())
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            options = json.loads(self.rfile.read(length) or b"{}")
+            status = PROFILER.start(
+                mode=options.get("mode", "sampling"),
+                seconds=float(options.get("seconds", 30)),
+                requests=int(options.get("requests", 20)),
+            )
+        except (TypeError, ValueError, AttributeError) as e:
+            self._send_json({"error": str(e)}, status=400)
+            return
+        except RuntimeError as e:
+            self._send_json({"error": str(e)}, status=409)
+            return
+        self._send_json(status)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/metrics":
+            self._send_metrics()
+        elif path == "/admin/profile":
+            self._admin_profile()
+        elif path == "/health":
+            data = self.engine.data
+            vectors = int(data[1].ntotal) if data else 0
+            self._send_json(
+                {
+                    "status": "ok",
+                    "vectors": vectors,
+                    "cached_embeddings": len(self.engine.embedding_cache),
+                    "cached_results": len(self.engine.result_cache),
+                }
+            )
+        else:
+            self._send_json({"error": "Not found"}, status=404)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path == "/admin/profile":
+            self._admin_profile()
+            return
+        if url.path != "/search":
+            self._send_json({"error": "Not found"}, status=404)
+            return
+
+        # The body is the uploaded image itself; options come in the query
+        length = int(self.headers.get("Content-Length", 0))
+        image_bytes = self.rfile.read(length)
+        if not image_bytes:
+            self._send_json({"error": "No image data provided"}, status=400)
+            return
+
+        params = parse_qs(url.query)
+        try:
+            top_k = int(params.get("top_k", ["12"])[0])
+        except ValueError:
+            self._send_json({"error": "top_k must be an integer"}, status=400)
+            return
+        if top_k < 1:
+            self._send_json({"error": "top_k must be at least 1"}, status=400)
+            return
+        top_k = min(top_k, MAX_TOP_K)
+        remove_bg = params.get("remove_bg", ["true"])[0].lower() != "false"
+
+        trace = RequestTrace(
+            STAGE_SECONDS, SLOW_LOG, top_k=top_k, remove_bg=remove_bg, cache="none"
+        )
+        status = 200
+        with IN_FLIGHT.track_inprogress():
+            try:
+                result = self.engine.search(
+                    image_bytes, top_k=top_k, remove_bg=remove_bg, trace=trace
+                )
+                self._send_json(result, status=status, trace=trace)
+            except Exception as e:
+                status = 500
+                self._send_json(
+                    {"error": f"Error in image search: {str(e)}"}, status=status
+                )
+        REQUESTS.inc(status=status)
+        total = trace.finish(status=status)
+        print(f"Search completed in {total:.3f} seconds")
+
+    def log_message(self, format, *args):
+        # Keep request logs on stderr, in the same format as our other prints
+        sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+
+def run_server(
+    host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS
+):
+    """Load the search engine once and serve requests until interrupted"""
+    engine = SearchEngine(max_batch=max_batch, max_wait_ms=max_wait_ms)
+    SearchRequestHandler.engine = engine
+    REGISTRY.callback(
+        "image_search_cache_lookups_total",
+        "Query cache lookups by cache and result",
+        "counter",
+        lambda: {
+            (name, result): count
+            for name, cache in (
+                ("embedding", engine.embedding_cache),
+                ("result", engine.result_cache),
+            )
+            for result, count in (("hit", cache.hits), ("miss", cache.misses))
+        },
+        ["cache", "result"],
+    )
+    server = ThreadingHTTPServer((host, port), SearchRequestHandler)
+    print(f"DINOv2 search server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent DINOv2 image search")
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--max_batch", type=int, default=MAX_BATCH, help="Queries per forward pass"
+    )
+    parser.add_argument(
+        "--max_wait_ms",
+        type=float,
+        default=MAX_WAIT_MS,
+        help="Longest a query waits for others to batch with",
+    )
+    args = parser.parse_args()
+
+    run_server(
+        host=args.host,
+        port=args.port,
+        max_batch=args.max_batch,
+        max_wait_ms=args.max_wait_ms,
+    )
@@ -22,44 +22,42 @@ except ImportError:
 
 
 def main():
-    """Process image data and find similar products using DINOv2"""
+    """Process image data and find similar products using DINOv2
+
+    Usage: similarity_runner.py <image_path | -> [top_k] [remove_bg]
+    With "-" the raw image bytes are read from stdin.
+    """
     try:
-        # Get the base64 image from command line argument
         if len(sys.argv) < 2:
             # Restore stdout for the error message
             sys.stdout = original_stdout
             print(json.dumps({"error": "No image data provided"}))
             return
 
-        # Check if the last argument is --file flag
-        is_file_path = "--file" in sys.argv
+        # Get the raw image bytes, from stdin or straight from the file
+        try:
+            if sys.argv[1] == "-":
+                image_bytes = sys.stdin.buffer.read()
+            else:
+                with open(sys.argv[1], "rb") as f:
+                    image_bytes = f.read()
+        except Exception as e:
+            # Restore stdout for the error message
+            sys.stdout = original_stdout
+            print(json.dumps({"error": f"Could not read image: {str(e)}"}))
+            return
 
-        # Get image data
-        if is_file_path:
-            try:
-                # Read base64 from file instead of directly from command line
-                with open(sys.argv[1], "r") as f:
-                    image_base64 = f.read()
-            except Exception as e:
-                # Restore stdout for the error message
-                sys.stdout = original_stdout
-                print(json.dumps({"error": f"Could not read base64 file: {str(e)}"}))
-                return
-        else:
-            # Get base64 directly from command line (original behavior)
-            image_base64 = sys.argv[1]
+        if not image_bytes:
+            sys.stdout = original_stdout
+            print(json.dumps({"error": "No image data provided"}))
+            return
 
         # Get optional parameters
         top_k = int(sys.argv[2]) if len(sys.argv) > 2 else 12
-
-        # Handle the case where --file might be the 4th argument
-        if len(sys.argv) > 3 and sys.argv[3] != "--file":
-            remove_bg = sys.argv[3].lower() != "false"
-        else:
-            remove_bg = True
+        remove_bg = sys.argv[3].lower() != "false" if len(sys.argv) > 3 else True
 
         # Call the DINOv2 search function to find similar products
-        result = find_similar_products(image_base64, top_k=top_k, remove_bg=remove_bg)
+        result = find_similar_products(image_bytes, top_k=top_k, remove_bg=remove_bg)
 
         # Restore stdout just before printing the final JSON result
         sys.stdout = original_stdout
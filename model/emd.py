@@ -1,97 +1,170 @@
+"""
+Find the catalogue items most similar to a query image (ResNet50 embeddings).
+
+Importing this module is cheap: the image database, the embedding matrix and
+the feature extractor are loaded by get_engine() on first use, together with
+the heavy imports (torch, torchvision, pandas, matplotlib), and then cached
+for the life of the process. Scripts that only validate their arguments, or
+import process_specific_image, no longer pay for a model load up front;
+check the cold-start cost with import_budget.py.
+"""
+
 import os
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from PIL import Image
-from sklearn.metrics.pairwise import cosine_similarity
-import pickle
-import torch
-import torchvision  # Added the missing import
-from torchvision import transforms, models
+import threading
 import argparse  # Added for command line arguments
-
-# Load image information
-df_info = pd.read_csv("image_database.csv")
-print(f"Loaded information for {len(df_info)} images")
-
-# Load embeddings
-with open("image_embeddings.pkl", "rb") as f:
-    embeddings = pickle.load(f)
-print(f"Loaded {len(embeddings)} embeddings")
-
-# Set up the model for query image processing
-model = models.resnet50(weights=torchvision.models.ResNet50_Weights.IMAGENET1K_V2)
-feature_extractor = torch.nn.Sequential(*list(model.children())[:-1])
-feature_extractor.eval()
-
-# Use GPU if available
-device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-feature_extractor = feature_extractor.to(device)
-
-# Define image preprocessing
-preprocess = transforms.Compose(
-    [
-        transforms.Resize(256),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ]
+import numpy as np
+from vector_store import load_embedding_matrix
+
+DATABASE_CSV = "image_database.csv"
+EMBEDDINGS_BASE = "image_embeddings"
+EMBEDDINGS_PICKLE = "image_embeddings.pkl"
+
+
+class SimilarityEngine:
+    """The image database, embedding matrix and query feature extractor."""
+
+    def __init__(
+        self,
+        database_csv=DATABASE_CSV,
+        embeddings_base=EMBEDDINGS_BASE,
+        embeddings_pickle=EMBEDDINGS_PICKLE,
+    ):
+        import pandas as pd
+
+        # Image preprocessing and model setup are shared with the indexer
+        from emd_terminal import load_feature_extractor, preprocess
+
+        # Load image information
+        self.df_info = pd.read_csv(database_csv)
+        print(f"Loaded information for {len(self.df_info)} images")
+
+        # Load embeddings as one contiguous, row-normalized matrix (memory-mapped
+        # from the vector store) so a query is scored with a single matrix-vector
+        # product instead of one call per image
+        self.embedding_matrix = load_embedding_matrix(
+            embeddings_base, embeddings_pickle
+        )
+        print(f"Loaded {len(self.embedding_matrix)} embeddings")
+        self.item_ids = self.df_info["item_id"].to_numpy()
+
+        # Set up the model for query image processing
+        # (INFERENCE_BACKEND picks the backend; exported backends run on the CPU)
+        self.feature_extractor, self.device = load_feature_extractor()
+        self.preprocess = preprocess
+
+    def extract_query_embedding(self, image_path):
+        """Extract embedding for a query image"""
+        import torch
+        from PIL import Image
+
+        try:
+            img = Image.open(image_path).convert("RGB")
+            img_tensor = self.preprocess(img)
+            img_tensor = img_tensor.unsqueeze(0).to(self.device)
+
+            with torch.no_grad():
+                features = self.feature_extractor(img_tensor)
+
+            # Flatten and normalize
+            query_embedding = features.squeeze().cpu().numpy()
+            query_embedding = query_embedding / np.linalg.norm(query_embedding)
+            return query_embedding
+        except Exception as e:
+            print(f"Error processing query image {image_path}: {e}")
+            return None
+
+    def find_similar_items(self, query_image_path, top_k=5):
+        """Find the most similar clothing items to the query image"""
+        # Extract embedding for the query image
+        query_embedding = self.extract_query_embedding(query_image_path)
+
+        if query_embedding is None:
+            print("Failed to process query image")
+            return None
+
+        # Cosine similarity against every database image in one product
+        query_embedding = query_embedding.astype(np.float32)
+        similarities = self.embedding_matrix @ (
+            query_embedding / np.linalg.norm(query_embedding)
+        )
+
+        # Keep the best-scoring image of each of the top k unique items
+        top_positions = select_top_unique(similarities, self.item_ids, top_k)
+
+        results_df = self.df_info.iloc[top_positions].copy()
+        results_df["similarity"] = similarities[top_positions]
+        return results_df
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the process-wide SimilarityEngine, loading it on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = SimilarityEngine()
+        return _engine
+
+
+# Attributes that used to be loaded at import time, now read from the engine
+_ENGINE_ATTRIBUTES = (
+    "df_info",
+    "embedding_matrix",
+    "item_ids",
+    "feature_extractor",
+    "device",
+    "preprocess",
 )
 
 
-def extract_query_embedding(image_path):
-    """Extract embedding for a query image"""
-    try:
-        img = Image.open(image_path).convert("RGB")
-        img_tensor = preprocess(img)
-        img_tensor = img_tensor.unsqueeze(0).to(device)
+def __getattr__(name):
+    if name in _ENGINE_ATTRIBUTES:
+        return getattr(get_engine(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-        with torch.no_grad():
-            features = feature_extractor(img_tensor)
 
-        # Flatten and normalize
-        query_embedding = features.squeeze().cpu().numpy()
-        query_embedding = query_embedding / np.linalg.norm(query_embedding)
-        return query_embedding
-    except Exception as e:
-        print(f"Error processing query image {image_path}: {e}")
-        return None
+def extract_query_embedding(image_path):
+    """Extract embedding for a query image"""
+    return get_engine().extract_query_embedding(image_path)
 
 
 def find_similar_items(query_image_path, top_k=5):
     """Find the most similar clothing items to the query image"""
-    # Extract embedding for the query image
-    query_embedding = extract_query_embedding(query_image_path)
-
-    if query_embedding is None:
-        print("Failed to process query image")
-        return None
-
-    # Calculate similarity with all database images
-    similarities = []
-    for embedding in embeddings:
-        similarity = cosine_similarity(
-            query_embedding.reshape(1, -1), embedding.reshape(1, -1)
-        )[0][0]
-        similarities.append(similarity)
-
-    # Add similarities to the dataframe
-    results_df = df_info.copy()
-    results_df["similarity"] = similarities
-
-    # Sort by similarity (highest first)
-    results_df = results_df.sort_values("similarity", ascending=False)
-
-    # Get the top k unique items
-    top_items = []
-    unique_items = set()
-
-    for _, row in results_df.iterrows():
-        if row["item_id"] not in unique_items and len(unique_items) < top_k:
-            top_items.append(row)
-            unique_items.add(row["item_id"])
-
-    return pd.DataFrame(top_items)
+    return get_engine().find_similar_items(query_image_path, top_k=top_k)
+
+
+def select_top_unique(similarities, item_ids, top_k):
+    """Return positions of the best image for each of the top_k unique items"""
+    n_total = len(similarities)
+    if n_total == 0 or top_k <= 0:
+        return np.array([], dtype=np.int64)
+
+    # Partially sort a small candidate pool, widening it only if a few items
+    # own so many images that the pool holds fewer than top_k unique items
+    n_candidates = min(n_total, top_k * 4)
+    while True:
+        if n_candidates < n_total:
+            candidates = np.argpartition(-similarities, n_candidates - 1)[:n_candidates]
+        else:
+            candidates = np.arange(n_total)
+        candidates = candidates[np.argsort(-similarities[candidates], kind="stable")]
+
+        selected = []
+        unique_items = set()
+        for position in candidates:
+            item_id = item_ids[position]
+            if item_id not in unique_items:
+                unique_items.add(item_id)
+                selected.append(position)
+                if len(selected) == top_k:
+                    return np.array(selected, dtype=np.int64)
+
+        if n_candidates >= n_total:
+            return np.array(selected, dtype=np.int64)
+        n_candidates = min(n_total, n_candidates * 2)
 
 
 def display_results(query_image_path, similar_items_df):
@@ -100,6 +173,9 @@ def display_results(query_image_path, similar_items_df):
         print("No matching items to display")
         return
 
+    import matplotlib.pyplot as plt
+    from PIL import Image
+
     n_items = len(similar_items_df)
     plt.figure(figsize=(15, 4))
 
@@ -146,6 +222,8 @@ def process_specific_image(image_path, top_k=5):
 
 def get_random_test_image():
     """Get a random test image from the dataset"""
+    import random
+
     images_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
 
     all_folders = [
@@ -196,8 +274,6 @@ if __name__ == "__main__":
         top_matches = process_specific_image(args.image, top_k=args.top_k)
     else:
         # Use a random test image
-        import random
-
         test_image, test_folder = get_random_test_image()
 
         if test_image:
@@ -1,25 +1,30 @@
 # Import necessary libraries for embedding creation
 import os
+import csv
+import json
+import hashlib
+import argparse
 import numpy as np
 import pandas as pd
 from PIL import Image
 import torch
-import torchvision
-from torchvision import transforms, models
-import pickle
+from torch.utils.data import Dataset, DataLoader
+from torchvision import transforms
 from tqdm import tqdm  # Using regular tqdm instead of tqdm.notebook
 import glob
+from vector_store import save_vector_store, load_vector_store
+from inference_backend import (
+    INFERENCE_BACKEND,
+    RESNET50_SOURCE,
+    load_extractor,
+    resnet50_feature_extractor,
+)
 
-# Set up the pre-trained model for feature extraction
-print("Loading ResNet50 model...")
-model = models.resnet50(weights=torchvision.models.ResNet50_Weights.IMAGENET1K_V2)
-feature_extractor = torch.nn.Sequential(*list(model.children())[:-1])
-feature_extractor.eval()
+# Main folder containing all clothing item subfolders
+DEFAULT_MAIN_DIR = r"E:\web\ladies-clothing-store (2)\model\images"
 
-# Use GPU if available
-device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-feature_extractor = feature_extractor.to(device)
-print(f"Using device: {device}")
+# Rows of the previous store copied per read when reusing its vectors
+COPY_CHUNK_ROWS = 4096
 
 # Define image preprocessing
 preprocess = transforms.Compose(
@@ -32,88 +37,327 @@ preprocess = transforms.Compose(
 )
 
 
-# Function to extract embedding from an image
-def extract_embedding(image_path):
-    """Extract feature embedding from an image using the pre-trained model"""
-    try:
-        img = Image.open(image_path).convert("RGB")
-        img_tensor = preprocess(img)
-        img_tensor = img_tensor.unsqueeze(0).to(device)
+class ClothingImageDataset(Dataset):
+    """Decodes and preprocesses catalogue images inside DataLoader workers"""
+
+    def __init__(self, image_paths):
+        self.image_paths = image_paths
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, idx):
+        # Failed images are returned with ok=False so one bad file does not
+        # abort the whole batch
+        try:
+            img = Image.open(self.image_paths[idx]).convert("RGB")
+            return preprocess(img), idx, True
+        except Exception as e:
+            print(f"Error processing {self.image_paths[idx]}: {e}")
+            return torch.zeros(3, 224, 224), idx, False
+
+
+def load_feature_extractor():
+    """Set up the pre-trained ResNet50 model for feature extraction"""
+    print("Loading ResNet50 model...")
+    # INFERENCE_BACKEND picks eager torch, ONNX Runtime or TorchScript
+    feature_extractor = load_extractor(
+        "resnet50", resnet50_feature_extractor, RESNET50_SOURCE, preprocess
+    )
+
+    # Use GPU if available
+    # Exported backends run on the CPU
+    device = torch.device(
+        "cuda:0"
+        if torch.cuda.is_available() and INFERENCE_BACKEND == "torch"
+        else "cpu"
+    )
+    feature_extractor = feature_extractor.to(device)
+    print(f"Using device: {device}")
+    return feature_extractor, device
+
+
+def collect_images(main_dir):
+    """Return (item_id, image_path) pairs for every image under main_dir"""
+    folder_list = [
+        f for f in os.listdir(main_dir) if os.path.isdir(os.path.join(main_dir, f))
+    ]
+    print(f"Found {len(folder_list)} clothing item folders")
+
+    items = []
+    for item_folder in sorted(folder_list):
+        folder_path = os.path.join(main_dir, item_folder)
+
+        # Get all images in the folder
+        image_files = (
+            glob.glob(os.path.join(folder_path, "*.jpg"))
+            + glob.glob(os.path.join(folder_path, "*.jpeg"))
+            + glob.glob(os.path.join(folder_path, "*.png"))
+        )
+        items.extend((item_folder, img_path) for img_path in image_files)
+
+    return items
+
+
+def file_sha256(file_path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_path_for(output_csv):
+    """Manifest of content hash, mtime and size per image, next to the CSV"""
+    return os.path.splitext(output_csv)[0] + ".manifest.json"
+
 
-        with torch.no_grad():
-            features = feature_extractor(img_tensor)
+def load_previous_database(output_csv, output_store):
+    """
+    Open the database of the last run for reuse.
 
-        # Flatten and normalize the features
-        features = features.squeeze().cpu().numpy()
-        features = features / np.linalg.norm(features)  # Normalize
-        return features
-    except Exception as e:
-        print(f"Error processing {image_path}: {e}")
+    Returns:
+        (rows DataFrame, VectorStore, manifest dict), or None when there is no
+        complete previous database
+    """
+    store = load_vector_store(output_store)
+    if store is None or not os.path.exists(output_csv):
+        return None
+    rows = pd.read_csv(output_csv)
+    if len(rows) != len(store):
+        print(f"{output_csv} does not match {output_store}; rebuilding everything")
         return None
 
+    manifest = {}
+    manifest_path = manifest_path_for(output_csv)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    return rows, store, manifest
 
-# Main folder containing all clothing item subfolders
-main_dir = r"E:\web\ladies-clothing-store (2)\model\images"
-print(f"Looking for images in: {main_dir}")
-
-# Create dictionaries to store image information and embeddings
-database = {
-    "item_id": [],  # Folder name (clothing item ID)
-    "image_path": [],  # Path to the image
-    "embedding": [],  # Feature embedding
-}
-
-# Process all subfolders
-folder_list = [
-    f for f in os.listdir(main_dir) if os.path.isdir(os.path.join(main_dir, f))
-]
-print(f"Found {len(folder_list)} clothing item folders")
-
-# Process each subfolder
-for item_folder in tqdm(folder_list, desc="Processing folders"):
-    folder_path = os.path.join(main_dir, item_folder)
-
-    # Get all images in the folder
-    image_files = (
-        glob.glob(os.path.join(folder_path, "*.jpg"))
-        + glob.glob(os.path.join(folder_path, "*.jpeg"))
-        + glob.glob(os.path.join(folder_path, "*.png"))
+
+def _manifest_entry(img_path, previous_entry=None):
+    # Hash only when the cheap stat check cannot vouch for the file
+    stat = os.stat(img_path)
+    if previous_entry and (previous_entry["mtime_ns"], previous_entry["size"]) == (
+        stat.st_mtime_ns,
+        stat.st_size,
+    ):
+        return previous_entry
+    return {
+        "sha256": file_sha256(img_path),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+    }
+
+
+def build_database(
+    main_dir,
+    output_csv="image_database.csv",
+    output_store="image_embeddings",
+    batch_size=32,
+    num_workers=None,
+    full=False,
+):
+    """
+    Embed catalogue images in batches and write the database files.
+
+    Unless full is set, vectors of images whose content is unchanged since the
+    last run are copied from the previous store, so only new and changed
+    images go through the model and removed images drop out. The store and
+    CSV are still rewritten whole, which is sequential I/O of count * dim * 4
+    bytes (about 0.8 GB per 100k images) and small next to embedding them.
+    """
+    print(f"Looking for images in: {main_dir}")
+    items = collect_images(main_dir)
+    if not items:
+        print("No images found")
+        return
+
+    previous = None if full else load_previous_database(output_csv, output_store)
+    manifest = {}
+    # (row in the previous store, item_id, image_path) of reused vectors
+    kept = []
+    to_embed = items
+    if previous is not None:
+        rows, store, previous_manifest = previous
+        row_by_path = {p: i for i, p in enumerate(rows["image_path"])}
+        to_embed = []
+        for item_id, img_path in items:
+            row = row_by_path.get(img_path)
+            if row is None:
+                to_embed.append((item_id, img_path))
+                continue
+            previous_entry = previous_manifest.get(img_path)
+            entry = _manifest_entry(img_path, previous_entry)
+            # Rows built before the manifest existed are adopted as they are
+            if previous_entry is None or entry["sha256"] == previous_entry["sha256"]:
+                kept.append((row, item_id, img_path))
+                manifest[img_path] = entry
+            else:
+                to_embed.append((item_id, img_path))
+
+        removed = len(rows) - len(kept)
+        print(
+            f"{len(items)} images: {len(kept)} unchanged, "
+            f"{len(to_embed)} new/changed, {removed} stale vectors dropped"
+        )
+        if not to_embed and not removed:
+            # Still persist refreshed stats so the next run skips hashing
+            _write_manifest(output_csv, manifest)
+            print("Database is up to date")
+            return
+
+    # Stream results to disk: metadata rows go to a partial CSV and vectors
+    # to a raw float32 side file, so memory stays bounded by one batch. The
+    # CSV replaces the live one only after the store is saved, so an
+    # interrupted run never leaves a new CSV next to the old store (rows
+    # would point at the wrong vectors)
+    vectors_path = output_store + ".partial"
+    partial_csv = output_csv + ".partial"
+    total_images = 0
+    processed_items = set()
+
+    with open(partial_csv, "w", newline="") as csv_file, open(
+        vectors_path, "wb"
+    ) as vectors_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["item_id", "image_path"])
+
+        # Reused vectors first, in their previous order
+        for start in range(0, len(kept), COPY_CHUNK_ROWS):
+            chunk = kept[start : start + COPY_CHUNK_ROWS]
+            vectors = store.vectors[[row for row, _, _ in chunk]]
+            vectors_file.write(vectors.astype(np.float32).tobytes())
+            for _, item_id, img_path in chunk:
+                writer.writerow([item_id, img_path])
+                processed_items.add(item_id)
+            total_images += len(chunk)
+        # Release the memory map so the store files can be replaced
+        previous = store = None
+
+        if to_embed:
+            total_images += _embed_images(
+                to_embed,
+                writer,
+                vectors_file,
+                manifest,
+                processed_items,
+                batch_size,
+                num_workers,
+            )
+
+    # Print summary
+    print(
+        f"Database holds {total_images} images from {len(processed_items)} unique clothing items"
+    )
+
+    if total_images == 0:
+        os.remove(vectors_path)
+        os.remove(partial_csv)
+        print("No embeddings to save")
+        return
+
+    # Save embeddings as a memory-mapped vector store, streaming from the
+    # side file rather than loading every vector into memory
+    embedding_matrix = np.memmap(vectors_path, dtype=np.float32, mode="r").reshape(
+        total_images, -1
     )
+    save_vector_store(output_store, embedding_matrix, normalized=True)
+    del embedding_matrix
+    os.remove(vectors_path)
+    print(f"Saved embeddings to {output_store}")
 
-    if len(image_files) > 0:
-        print(f"Processing {len(image_files)} images in folder {item_folder}")
+    os.replace(partial_csv, output_csv)
+    print(f"Saved image information to {output_csv}")
+    _write_manifest(output_csv, manifest)
 
-        for img_path in tqdm(
-            image_files, desc=f"  Images in {item_folder}", leave=False
-        ):
-            embedding = extract_embedding(img_path)
+    # Show sample of the saved data
+    print("\nSample of the saved data:")
+    print(pd.read_csv(output_csv, nrows=5))
 
-            if embedding is not None:
-                database["item_id"].append(item_folder)
-                database["image_path"].append(img_path)
-                database["embedding"].append(embedding)
 
-# Print summary
-total_images = len(database["embedding"])
-total_items = len(set(database["item_id"]))
-print(
-    f"Successfully processed {total_images} images from {total_items} unique clothing items"
-)
+def _embed_images(
+    items, writer, vectors_file, manifest, processed_items, batch_size, num_workers
+):
+    # Embed (item_id, image_path) pairs, appending rows, vectors and manifest
+    # entries as batches complete; returns the number of images embedded
+    if num_workers is None:
+        num_workers = max(1, (os.cpu_count() or 2) - 1)
 
-# Save image information to CSV
-output_csv = "image_database.csv"
-df_info = pd.DataFrame(
-    {"item_id": database["item_id"], "image_path": database["image_path"]}
-)
-df_info.to_csv(output_csv, index=False)
-print(f"Saved image information to {output_csv}")
-
-# Save embeddings to pickle file
-output_pkl = "image_embeddings.pkl"
-with open(output_pkl, "wb") as f:
-    pickle.dump(database["embedding"], f)
-print(f"Saved embeddings to {output_pkl}")
-
-# Show sample of the saved data
-print("\nSample of the saved data:")
-print(df_info.head())
+    feature_extractor, device = load_feature_extractor()
+
+    dataset = ClothingImageDataset([img_path for _, img_path in items])
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        pin_memory=device.type == "cuda",
+        persistent_workers=num_workers > 0,
+    )
+
+    embedded = 0
+    with torch.inference_mode():
+        for images, indices, ok in tqdm(loader, desc="Embedding batches"):
+            if not ok.any():
+                continue
+            images = images[ok].to(device, non_blocking=True)
+
+            # Flatten and normalize the features
+            features = feature_extractor(images).flatten(1)
+            features = torch.nn.functional.normalize(features, dim=1)
+            vectors_file.write(features.cpu().numpy().astype(np.float32).tobytes())
+
+            for idx in indices[ok].tolist():
+                item_id, img_path = items[idx]
+                writer.writerow([item_id, img_path])
+                manifest[img_path] = _manifest_entry(img_path)
+                processed_items.add(item_id)
+                embedded += 1
+    return embedded
+
+
+def _write_manifest(output_csv, manifest):
+    manifest_path = manifest_path_for(output_csv)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the ResNet50 image embedding database"
+    )
+    parser.add_argument("--images_dir", type=str, default=DEFAULT_MAIN_DIR)
+    parser.add_argument("--output_csv", type=str, default="image_database.csv")
+    parser.add_argument(
+        "--output_store",
+        type=str,
+        default="image_embeddings",
+        help="Base path of the output vector store",
+    )
+    parser.add_argument(
+        "--batch_size", type=int, default=32, help="Images per forward pass"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Decode/preprocess worker processes (default: CPU count - 1)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-embed every image instead of only new and changed ones",
+    )
+    args = parser.parse_args()
+
+    build_database(
+        args.images_dir,
+        output_csv=args.output_csv,
+        output_store=args.output_store,
+        batch_size=args.batch_size,
+        num_workers=args.workers,
+        full=args.full,
+    )
@@ -4,14 +4,21 @@ import os
 import sys
 import numpy as np
 import pandas as pd
-import pickle
 import torch
-import torchvision
-from torchvision import transforms, models
+from torchvision import transforms
 from PIL import Image
-from sklearn.metrics.pairwise import cosine_similarity
 import json
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from emd import select_top_unique
+from vector_store import load_embedding_matrix
+from inference_backend import (
+    INFERENCE_BACKEND,
+    RESNET50_SOURCE,
+    load_extractor,
+    resnet50_feature_extractor,
+)
+
 # Get the image path from the command line argument
 if len(sys.argv) < 2:
     print(json.dumps({"error": "No image file provided"}))
@@ -24,18 +31,12 @@ try:
     # Load image information
     df_info = pd.read_csv(os.path.join(current_dir, "image_database.csv"))
 
-    # Load embeddings
-    with open(os.path.join(current_dir, "image_embeddings.pkl"), "rb") as f:
-        embeddings = pickle.load(f)
-
-    # Set up the model for query image processing - Using the exact same approach as emd.py
-    model = models.resnet50(weights=torchvision.models.ResNet50_Weights.IMAGENET1K_V2)
-    feature_extractor = torch.nn.Sequential(*list(model.children())[:-1])
-    feature_extractor.eval()
-
-    # Use GPU if available
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    feature_extractor = feature_extractor.to(device)
+    # Load embeddings as one row-normalized matrix, memory-mapped if possible
+    embedding_matrix = load_embedding_matrix(
+        os.path.join(current_dir, "image_embeddings"),
+        os.path.join(current_dir, "image_embeddings.pkl"),
+    )
+    item_ids = df_info["item_id"].to_numpy()
 
     # Define image preprocessing
     preprocess = transforms.Compose(
@@ -47,6 +48,20 @@ try:
         ]
     )
 
+    # Set up the model for query image processing - Using the exact same approach as emd.py
+    feature_extractor = load_extractor(
+        "resnet50", resnet50_feature_extractor, RESNET50_SOURCE, preprocess
+    )
+
+    # Use GPU if available
+    # Exported backends run on the CPU
+    device = torch.device(
+        "cuda:0"
+        if torch.cuda.is_available() and INFERENCE_BACKEND == "torch"
+        else "cpu"
+    )
+    feature_extractor = feature_extractor.to(device)
+
     # Extract embedding for a query image - using the exact same function as in emd.py
     def extract_query_embedding(image_path):
         try:
@@ -65,41 +80,26 @@ try:
             print(json.dumps({"error": f"Error processing query image: {str(e)}"}))
             sys.exit(1)
 
-    # Find similar items - using the exact same approach as in emd.py but with threshold
+    # Find similar items - same ranking as emd.py but with threshold
     def find_similar_items(query_embedding, top_k=5, threshold=0.6):
-        # Calculate similarity with all database images
-        similarities = []
-        for embedding in embeddings:
-            similarity = cosine_similarity(
-                query_embedding.reshape(1, -1), embedding.reshape(1, -1)
-            )[0][0]
-            similarities.append(similarity)
-
-        # Add similarities to the dataframe
-        results_df = df_info.copy()
-        results_df["similarity"] = similarities
-
-        # Sort by similarity (highest first)
-        results_df = results_df.sort_values("similarity", ascending=False)
-
-        # Apply similarity threshold
-        results_df = results_df[results_df["similarity"] >= threshold]
+        # Cosine similarity against every database image in one product
+        query_embedding = query_embedding.astype(np.float32)
+        similarities = embedding_matrix @ (
+            query_embedding / np.linalg.norm(query_embedding)
+        )
 
-        # Get the top k unique items using the same approach as in emd.py
         top_items = []
-        unique_items = set()
-
-        for _, row in results_df.iterrows():
-            item_id = row["item_id"]
-            if item_id not in unique_items and len(unique_items) < top_k:
-                top_items.append(
-                    {
-                        "id": item_id,
-                        "similarity": float(row["similarity"]),
-                        "image_path": row["image_path"],
-                    }
-                )
-                unique_items.add(item_id)
+        for position in select_top_unique(similarities, item_ids, top_k):
+            # Results are sorted, so everything after this is below threshold
+            if similarities[position] < threshold:
+                break
+            top_items.append(
+                {
+                    "id": item_ids[position],
+                    "similarity": float(similarities[position]),
+                    "image_path": df_info["image_path"].iat[position],
+                }
+            )
 
         return top_items
 
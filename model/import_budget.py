@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Cold-start import budget for the command-line modules.
+
+Each module is imported in a fresh interpreter under python -X importtime.
+The check fails if the import takes longer than the budget, or if it pulls
+in a heavy dependency (torch, pandas, matplotlib, ...) that should only be
+loaded when an engine is first used. The heavy-module check does not depend
+on machine speed, so it is the reliable part on a loaded CI box; the time
+budget catches everything else.
+
+Usage:
+    python import_budget.py [--budget_ms 300] [--runs 3] [--output report.json]
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(MODEL_DIR)
+
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "300"))
+
+# (module, directory it is imported from), as the scripts run them
+TARGETS = [
+    ("emd", MODEL_DIR),
+    ("test_specific_image", MODEL_DIR),
+    ("advanced_recommendation", os.path.join(PROJECT_ROOT, "Recomend")),
+]
+
+# Must not be imported until an engine is created
+HEAVY_MODULES = (
+    "torch",
+    "torchvision",
+    "pandas",
+    "matplotlib",
+    "sklearn",
+    "sentence_transformers",
+    "faiss",
+    "onnxruntime",
+    "requests",
+)
+
+_PROBE = (
+    "import sys, json, time\n"
+    "start = time.perf_counter()\n"
+    "import {module}\n"
+    "elapsed = time.perf_counter() - start\n"
+    "print(json.dumps({{'seconds': elapsed, 'modules': sorted(sys.modules)}}))\n"
+)
+
+
+def _slowest_imports(importtime_output, module, top=5):
+    # "import time: self [us] | cumulative | imported package" per line, each
+    # import listed after its own imports and indented two spaces per level;
+    # the module's direct imports are the level-1 lines just before it
+    children = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        level = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if level == 1:
+            children.append((int(cumulative), name.strip()))
+        elif level == 0:
+            if name.strip() == module:
+                break
+            children = []
+    children.sort(reverse=True)
+    return [{"module": name, "ms": round(us / 1000, 1)} for us, name in children[:top]]
+
+
+def measure_import(module, cwd):
+    """
+    Import a module once in a fresh interpreter.
+
+    Returns:
+        dict with the import time, the heavy modules it loaded and the
+        slowest direct imports, or an "error" entry if the import failed
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module)],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1]}
+
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    loaded = set(probe["modules"])
+    return {
+        "ms": round(probe["seconds"] * 1000, 1),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in loaded],
+        "slowest": _slowest_imports(result.stderr, module),
+    }
+
+
+def check_budget(budget_ms=IMPORT_BUDGET_MS, runs=3, targets=TARGETS):
+    """
+    Measure every target and compare it with the budget.
+
+    The fastest of runs imports is used, since the first run also pays for
+    cold disk caches.
+
+    Returns:
+        (report dict per module, list of failure messages)
+    """
+    report = {}
+    failures = []
+    for module, cwd in targets:
+        measurements = [measure_import(module, cwd) for _ in range(max(1, runs))]
+        errors = [m["error"] for m in measurements if "error" in m]
+        if errors:
+            report[module] = {"error": errors[0]}
+            failures.append(f"{module}: import failed: {errors[0]}")
+            continue
+
+        best = min(measurements, key=lambda m: m["ms"])
+        report[module] = best
+        if best["ms"] > budget_ms:
+            failures.append(
+                f"{module}: import took {best['ms']}ms (budget {budget_ms}ms)"
+            )
+        if best["heavy_modules"]:
+            failures.append(
+                f"{module}: imports {', '.join(best['heavy_modules'])} at module level"
+            )
+    return report, failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the cold-start import budget")
+    parser.add_argument("--budget_ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3, help="Imports per module")
+    parser.add_argument("--output", type=str, help="Write the report JSON here")
+    args = parser.parse_args()
+
+    report, failures = check_budget(args.budget_ms, args.runs)
+
+    for module, entry in report.items():
+        if "error" in entry:
+            print(f"{module:<24} error: {entry['error']}")
+            continue
+        slowest = ", ".join(f"{s['module']} {s['ms']}ms" for s in entry["slowest"])
+        print(f"{module:<24} {entry['ms']:>8.1f}ms   slowest: {slowest}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"budget_ms": args.budget_ms, "modules": report, "failures": failures},
+                f,
+                indent=2,
+            )
+        print(f"Report written to {args.output}")
+
+    if failures:
+        print("\nImport budget exceeded:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"\nAll imports within {args.budget_ms}ms")
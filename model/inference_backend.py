@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+"""
+Selectable inference backends for the image feature extractors.
+
+Both extractors (DINOv2 ViT-B/14 for the site search, ResNet50 for the scripts
+in model/) can run as:
+
+    torch             eager fp32 PyTorch (the reference)
+    onnx              ONNX Runtime, fp32
+    onnx_int8         ONNX Runtime, int8 (dynamic, or static with calibration)
+    torchscript       frozen TorchScript, fp32
+    torchscript_int8  TorchScript with dynamically quantized Linear layers
+
+The backend is picked with INFERENCE_BACKEND. Non-torch backends load an
+exported artifact from model/ and export it from the torch model on first use.
+Each artifact has a <artifact>.signature.json beside it recording the source
+weights, preprocessing and export settings it was built from; when those no
+longer match the caller's, the artifact is exported again.
+Every extractor takes and returns torch tensors, so callers do not change.
+Status messages go to stderr because several callers print JSON on stdout.
+
+Dynamic int8 quantizes the Linear/MatMul weights, which is where a ViT spends
+its time; for the convolutional ResNet50 use onnx_int8 with --calibration_dir
+(static quantization). Check any quantized backend with the parity command
+before serving it: catalogue embeddings built with fp32 stay usable only if
+cosine agreement and top-k overlap are high.
+
+Usage:
+    python inference_backend.py export --model dinov2 --backend onnx_int8
+    python inference_backend.py export --model resnet50 --backend onnx_int8 \\
+        --calibration_dir images/
+    python inference_backend.py parity --model dinov2 --backend onnx_int8 \\
+        --images images/ [--limit 200] [--k 12] [--output parity.json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import torch
+
+BACKENDS = ("torch", "onnx", "onnx_int8", "torchscript", "torchscript_int8")
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+INPUT_SIZE = 224
+ONNX_OPSET = 17
+
+# torchvision weights of the ResNet50 extractor; part of its artifact signature
+RESNET50_WEIGHTS = "IMAGENET1K_V2"
+RESNET50_SOURCE = f"torchvision resnet50 {RESNET50_WEIGHTS}"
+
+ARTIFACT_SUFFIXES = {
+    "onnx": ".onnx",
+    "onnx_int8": ".int8.onnx",
+    "torchscript": ".ts",
+    "torchscript_int8": ".int8.ts",
+}
+
+
+def artifact_path(name, backend):
+    """Where the exported model for a backend lives"""
+    return os.path.join(MODEL_DIR, name + ARTIFACT_SUFFIXES[backend])
+
+
+def signature_path(path):
+    """Where the signature of an exported artifact lives"""
+    return f"{path}.signature.json"
+
+
+def artifact_signature(source, preprocess=None):
+    """
+    What an exported artifact depends on.
+
+    Args:
+        source: Caller's description of the torch weights, e.g. RESNET50_SOURCE
+        preprocess: The transform applied to images before the extractor
+    """
+    return {
+        "source": source,
+        "preprocess": repr(preprocess) if preprocess is not None else None,
+        "input_size": INPUT_SIZE,
+        "onnx_opset": ONNX_OPSET,
+    }
+
+
+def is_current(path, signature):
+    """Whether an artifact exists and was exported for this signature"""
+    try:
+        with open(signature_path(path), "r") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return os.path.exists(path) and saved.get("depends_on") == signature
+
+
+def _write_signature(path, signature, **options):
+    # Written after the artifact, so a crash in between only causes a re-export
+    record = {"depends_on": signature, "options": options}
+    _write_atomically(
+        signature_path(path),
+        lambda tmp_path: Path(tmp_path).write_text(json.dumps(record, indent=2)),
+    )
+
+
+def resnet50_feature_extractor():
+    """ImageNet ResNet50 without its classification head, in eval mode"""
+    from torchvision import models
+
+    model = models.resnet50(weights=getattr(models.ResNet50_Weights, RESNET50_WEIGHTS))
+    feature_extractor = torch.nn.Sequential(*list(model.children())[:-1])
+    feature_extractor.eval()
+    return feature_extractor
+
+
+class OnnxExtractor:
+    """Runs an exported model with ONNX Runtime behind the torch call interface."""
+
+    def __init__(self, onnx_path):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            onnx_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        pixels = batch.detach().cpu().numpy().astype(np.float32, copy=False)
+        return torch.from_numpy(self.session.run(None, {self.input_name: pixels})[0])
+
+    # ONNX Runtime sessions are CPU-only and always in inference mode
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+
+def _dummy_input(batch_size=1):
+    return torch.randn(batch_size, 3, INPUT_SIZE, INPUT_SIZE)
+
+
+def _write_atomically(target, write_fn):
+    # Other workers load artifacts on first use too; they must never open a
+    # half-written file, so write beside it and rename into place
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    try:
+        write_fn(tmp_path)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _export_onnx(torch_model, onnx_path):
+    _write_atomically(onnx_path, lambda tmp_path: _trace_onnx(torch_model, tmp_path))
+
+
+def _trace_onnx(torch_model, onnx_path):
+    torch.onnx.export(
+        torch_model.eval(),
+        _dummy_input(),
+        onnx_path,
+        input_names=["pixels"],
+        output_names=["features"],
+        dynamic_axes={"pixels": {0: "batch"}, "features": {0: "batch"}},
+        opset_version=ONNX_OPSET,
+    )
+
+
+class _CalibrationReader:
+    """Feeds preprocessed calibration images to ONNX static quantization"""
+
+    def __init__(self, input_name, tensors):
+        self._batches = iter(
+            [{input_name: t.unsqueeze(0).numpy().astype(np.float32)} for t in tensors]
+        )
+
+    def get_next(self):
+        return next(self._batches, None)
+
+
+def export(name, torch_model, backend, signature, calibration_tensors=None):
+    """
+    Export a torch extractor to a backend's artifact and its signature.
+
+    Args:
+        name: Artifact base name, e.g. "dinov2_vitb14"
+        torch_model: fp32 torch extractor in eval mode
+        backend: One of BACKENDS other than "torch"
+        signature: artifact_signature() of the model and its preprocessing
+        calibration_tensors: Preprocessed images for static int8 (onnx_int8
+            only); dynamic quantization is used without them
+
+    Returns:
+        Path of the written artifact
+    """
+    if backend not in ARTIFACT_SUFFIXES:
+        raise ValueError(f"Nothing to export for backend {backend}")
+    target = artifact_path(name, backend)
+    torch_model = torch_model.cpu().eval()
+
+    if backend == "onnx":
+        _export_onnx(torch_model, target)
+        _write_signature(target, signature)
+
+    elif backend == "onnx_int8":
+        from onnxruntime.quantization import (
+            QuantType,
+            quantize_dynamic,
+            quantize_static,
+            QuantFormat,
+        )
+
+        fp32_path = artifact_path(name, "onnx")
+        if not is_current(fp32_path, signature):
+            _export_onnx(torch_model, fp32_path)
+            _write_signature(fp32_path, signature)
+
+        if calibration_tensors:
+            _write_atomically(
+                target,
+                lambda tmp_path: quantize_static(
+                    fp32_path,
+                    tmp_path,
+                    _CalibrationReader("pixels", calibration_tensors),
+                    quant_format=QuantFormat.QDQ,
+                    per_channel=True,
+                    weight_type=QuantType.QInt8,
+                ),
+            )
+        else:
+            _write_atomically(
+                target,
+                lambda tmp_path: quantize_dynamic(
+                    fp32_path, tmp_path, weight_type=QuantType.QInt8
+                ),
+            )
+        _write_signature(
+            target,
+            signature,
+            quantization="static" if calibration_tensors else "dynamic",
+            calibration_images=len(calibration_tensors or []),
+        )
+
+    else:
+        if backend == "torchscript_int8":
+            torch_model = torch.ao.quantization.quantize_dynamic(
+                torch_model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        with torch.no_grad():
+            traced = torch.jit.freeze(torch.jit.trace(torch_model, _dummy_input()))
+        _write_atomically(target, traced.save)
+        _write_signature(target, signature)
+
+    print(f"Exported {name} ({backend}) to {target}", file=sys.stderr)
+    return target
+
+
+def load_extractor(name, build_torch_model, source, preprocess=None, backend=None):
+    """
+    Return the feature extractor for the selected backend.
+
+    Args:
+        name: Artifact base name
+        build_torch_model: Callable returning the fp32 torch extractor; only
+            called for the torch backend or to export a missing or stale
+            artifact
+        source: Description of the torch weights (see artifact_signature)
+        preprocess: Transform applied to images before the extractor
+        backend: One of BACKENDS (defaults to INFERENCE_BACKEND)
+    """
+    backend = backend or INFERENCE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend}; choose from {BACKENDS}")
+
+    if backend == "torch":
+        return build_torch_model()
+
+    path = artifact_path(name, backend)
+    signature = artifact_signature(source, preprocess)
+    if not is_current(path, signature):
+        if os.path.exists(path):
+            print(
+                f"{backend} artifact for {name} was exported from other weights "
+                "or settings, exporting again...",
+                file=sys.stderr,
+            )
+        else:
+            print(f"No {backend} artifact for {name}, exporting...", file=sys.stderr)
+        export(name, build_torch_model(), backend, signature)
+
+    print(f"Using {backend} backend for {name}", file=sys.stderr)
+    if backend.startswith("onnx"):
+        return OnnxExtractor(path)
+    return torch.jit.load(path, map_location="cpu")
+
+
+def _embed(extractor, tensors, batch_size=16):
+    # Returns row-normalized embeddings and the mean seconds per image
+    rows = []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for i in range(0, len(tensors), batch_size):
+            batch = torch.stack(tensors[i : i + batch_size])
+            rows.append(extractor(batch).reshape(len(batch), -1).cpu().numpy())
+    seconds = (time.perf_counter() - start) / len(tensors)
+    embeddings = np.vstack(rows).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True), seconds
+
+
+def parity_report(reference, candidate, tensors, k=12):
+    """
+    Compare a candidate backend's embeddings with the fp32 reference.
+
+    Reports per-image cosine agreement between the two embeddings, and the
+    overlap of each image's k nearest neighbours among the sample when
+    searched with the candidate versus the reference embedding.
+    """
+    ref, ref_seconds = _embed(reference, tensors)
+    cand, cand_seconds = _embed(candidate, tensors)
+
+    cosine = np.sum(ref * cand, axis=1)
+
+    # Neighbours among the reference embeddings, excluding the image itself
+    k = min(k, len(tensors) - 1)
+    ref_scores = ref @ ref.T
+    cand_scores = cand @ ref.T
+    np.fill_diagonal(ref_scores, -np.inf)
+    np.fill_diagonal(cand_scores, -np.inf)
+    ref_top = np.argsort(-ref_scores, axis=1)[:, :k]
+    cand_top = np.argsort(-cand_scores, axis=1)[:, :k]
+    overlap = [len(set(r) & set(c)) / k for r, c in zip(ref_top, cand_top)]
+
+    return {
+        "images": len(tensors),
+        "k": int(k),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "cosine_min": round(float(cosine.min()), 5),
+        "topk_overlap_mean": round(float(np.mean(overlap)), 4),
+        "topk_overlap_min": round(float(np.min(overlap)), 4),
+        "reference_ms_per_image": round(ref_seconds * 1000, 2),
+        "candidate_ms_per_image": round(cand_seconds * 1000, 2),
+        "speedup": round(ref_seconds / cand_seconds, 2),
+    }
+
+
+def _model_factory(model_name):
+    """(artifact name, fp32 torch extractor factory, weights source, preprocessing)"""
+    if model_name == "dinov2":
+        sys.path.append(
+            os.path.join(os.path.dirname(MODEL_DIR), "app", "api", "image-search")
+        )
+        from embedding_search import DINOV2_SOURCE, build_dinov2_model, preprocess
+
+        return "dinov2_vitb14", build_dinov2_model, DINOV2_SOURCE, preprocess
+
+    sys.path.append(MODEL_DIR)
+    from emd_terminal import preprocess
+
+    return "resnet50", resnet50_feature_extractor, RESNET50_SOURCE, preprocess
+
+
+def _load_tensors(images_dir, transform, limit):
+    from PIL import Image
+
+    paths = sorted(
+        p
+        for p in Path(images_dir).rglob("*")
+        if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp")
+    )[:limit]
+    return [transform(Image.open(p).convert("RGB")) for p in paths]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and check inference backends")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write a backend artifact")
+    export_parser.add_argument("--model", choices=["dinov2", "resnet50"], required=True)
+    export_parser.add_argument(
+        "--backend", choices=list(ARTIFACT_SUFFIXES), required=True
+    )
+    export_parser.add_argument(
+        "--calibration_dir", type=str, help="Images for static int8 quantization"
+    )
+    export_parser.add_argument("--calibration_images", type=int, default=64)
+
+    parity_parser = subparsers.add_parser("parity", help="Compare against fp32 torch")
+    parity_parser.add_argument("--model", choices=["dinov2", "resnet50"], required=True)
+    parity_parser.add_argument(
+        "--backend", choices=list(ARTIFACT_SUFFIXES), required=True
+    )
+    parity_parser.add_argument("--images", type=str, required=True)
+    parity_parser.add_argument("--limit", type=int, default=200)
+    parity_parser.add_argument("--k", type=int, default=12)
+    parity_parser.add_argument("--output", type=str, help="Write the report JSON here")
+    args = parser.parse_args()
+
+    name, build_torch_model, source, transform = _model_factory(args.model)
+
+    if args.command == "export":
+        calibration = None
+        if args.calibration_dir:
+            calibration = _load_tensors(
+                args.calibration_dir, transform, args.calibration_images
+            )
+        export(
+            name,
+            build_torch_model(),
+            args.backend,
+            artifact_signature(source, transform),
+            calibration,
+        )
+
+    else:
+        tensors = _load_tensors(args.images, transform, args.limit)
+        if len(tensors) < 2:
+            print("Need at least two images for a parity check")
+            sys.exit(1)
+        report = parity_report(
+            build_torch_model(),
+            load_extractor(name, build_torch_model, source, transform, args.backend),
+            tensors,
+            k=args.k,
+        )
+        report.update({"model": args.model, "backend": args.backend})
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Report written to {args.output}")
+        else:
+            print(json.dumps(report, indent=2))
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+"""
+Minimal Prometheus instrumentation shared by the recommendation API and the
+image-search server.
+
+Counters, gauges and histograms are kept in a Registry and rendered in the
+Prometheus text exposition format, so a /metrics route needs no client
+library. Callback metrics read values that already live elsewhere (such as
+cache hit counters) at scrape time.
+
+RequestTrace times the stages of one request into a stage histogram and,
+when the request is slower than SLOW_QUERY_MS, writes its stage breakdown as
+one JSON line to a slow-query log.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# Requests slower than this (in milliseconds) go to the slow-query log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "1000"))
+
+# Upper bounds in seconds, from 1ms to 10s
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [
+                (self.name, key, None, value) for key, value in self._values.items()
+            ]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self._samples():
+            labels = _format_labels(self.labelnames, key, extra)
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        """Count the enclosed block as in flight while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        samples = []
+        for key, counts, total in values:
+            for bound, count in zip(self.buckets, counts):
+                samples.append(
+                    (f"{self.name}_bucket", key, ("le", _format_value(bound)), count)
+                )
+            samples.append((f"{self.name}_sum", key, None, total))
+            samples.append((f"{self.name}_count", key, None, counts[-1]))
+        return samples
+
+
+class CallbackMetric(_Metric):
+    """A counter or gauge whose value is read from a function at scrape time"""
+
+    def __init__(self, name, help_text, kind, fn, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def _samples(self):
+        # fn returns a number, or a dict of label-value tuple -> number
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, key, None, value) for key, value in values.items()]
+
+
+class Registry:
+    """A set of metrics rendered together for one /metrics endpoint"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name, help_text, kind, fn, labelnames=()):
+        return self._register(CallbackMetric(name, help_text, kind, fn, labelnames))
+
+    def render(self):
+        """Return every metric in the Prometheus text format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def slow_query_logger(path):
+    """Logger writing one JSON line per slow request to path"""
+    logger = logging.getLogger(f"slow_queries.{os.path.abspath(path)}")
+    if not logger.handlers:
+        # delay: the file is only created once a slow request is logged
+        handler = logging.FileHandler(path, delay=True)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+class RequestTrace:
+    """Stage timings of one request, recorded into a histogram."""
+
+    def __init__(
+        self, stage_histogram, slow_log=None, slow_ms=SLOW_QUERY_MS, **context
+    ):
+        """
+        Args:
+            stage_histogram: Histogram with a "stage" label
+            slow_log: Logger for requests slower than slow_ms (None disables)
+            slow_ms: Slow-query threshold in milliseconds
+            context: Request details included in the slow-query log line
+        """
+        self.histogram = stage_histogram
+        self.slow_log = slow_log
+        self.slow_ms = slow_ms
+        self.context = context
+        self.stages = {}
+        self._start = time.perf_counter()
+
+    def record(self, stage, seconds):
+        """Add time spent in a stage (stages can be recorded more than once)"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.histogram.observe(seconds, stage=stage)
+
+    def record_all(self, timings):
+        for stage, seconds in timings.items():
+            self.record(stage, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def finish(self, **context):
+        """Record the total and log the breakdown if the request was slow"""
+        total = time.perf_counter() - self._start
+        self.histogram.observe(total, stage="total")
+        if self.slow_log is not None and total * 1000 >= self.slow_ms:
+            self.slow_log.info(
+                json.dumps(
+                    {
+                        "total_ms": round(total * 1000, 2),
+                        "stages_ms": {
+                            stage: round(seconds * 1000, 2)
+                            for stage, seconds in self.stages.items()
+                        },
+                        **self.context,
+                        **context,
+                    },
+                    default=str,
+                )
+            )
+        return total
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+"""
+On-demand profiling of a running API worker.
+
+An admin starts a capture over HTTP (see the /admin/profile routes of
+recommendation_api.py and search_server.py) and the worker keeps serving
+traffic while it is profiled, so no restart is needed. Two modes:
+
+    sampling  a background thread records the Python stack of every busy
+              thread every PROFILER_INTERVAL_MS for a number of seconds.
+              Overhead is one stack walk per interval, independent of how
+              much code runs, so it is safe under production load.
+    cprofile  the next N profiled requests, within a number of seconds, run
+              under cProfile, which counts every call exactly but slows
+              those requests down.
+
+Either capture ends at its deadline and is written by a background thread,
+never on a request thread; a capture that fails to write is reported in the
+status as an error, and the profiler is free for the next capture.
+
+A finished capture writes to PROFILE_DIR:
+
+    <name>.folded  collapsed stacks ("a;b;c 42" per line), the input format
+                   of flamegraph.pl, speedscope and inferno (sampling only)
+    <name>.prof    pstats dump for snakeviz or pstats (cprofile only)
+    <name>.txt     top functions by self and by total time
+
+Threads parked in a lock, queue or socket wait (idle pool workers, the HTTP
+accept loop) are left out of samples, so the flamegraph shows where requests
+spend time rather than where workers wait for them.
+
+Captures are refused unless PROFILER_ADMIN_TOKEN is set, and the routes check
+it against the X-Admin-Token header.
+
+Usage (offline summary of a saved capture):
+    python profiler.py summary profiles/sampling-20250101-120000-4242.folded [--top 30]
+"""
+
+import os
+import sys
+import hmac
+import time
+import pstats
+import cProfile
+import argparse
+import threading
+from io import StringIO
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILER_ADMIN_TOKEN = os.getenv("PROFILER_ADMIN_TOKEN", "")
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "10"))
+
+MODES = ("sampling", "cprofile")
+
+# Longest capture an admin can request
+MAX_CAPTURE_SECONDS = 300
+MAX_CAPTURE_REQUESTS = 1000
+
+# A thread whose innermost frame is in one of these modules is waiting, not
+# working, and is not sampled
+IDLE_MODULES = ("threading.py", "queue.py", "selectors.py", "socket.py")
+
+
+def is_authorized(token):
+    """Whether an X-Admin-Token header value may control the profiler"""
+    if not PROFILER_ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), PROFILER_ADMIN_TOKEN.encode())
+
+
+def _frame_label(code):
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def _stack(frame):
+    # Outermost frame first, as flamegraph tools expect
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return tuple(reversed(labels))
+
+
+def _is_idle(frame):
+    return os.path.basename(frame.f_code.co_filename) in IDLE_MODULES
+
+
+def summarize_stacks(stacks, top=25):
+    """
+    Top functions of a set of sampled stacks.
+
+    Args:
+        stacks: Mapping of stack tuple (outermost first) -> sample count
+        top: Rows per table
+
+    Returns:
+        A text report ranking functions by self samples (time spent in the
+        function itself) and by total samples (time with it on the stack)
+    """
+    total = sum(stacks.values())
+    self_counts = Counter()
+    total_counts = Counter()
+    for stack, count in stacks.items():
+        self_counts[stack[-1]] += count
+        # Count recursive functions once per sample
+        for label in set(stack):
+            total_counts[label] += count
+
+    lines = [f"{total} samples"]
+    for title, counts in (("self", self_counts), ("total", total_counts)):
+        lines.append("")
+        lines.append(f"Top {top} functions by {title} samples:")
+        for label, count in counts.most_common(top):
+            lines.append(f"{count:>8} {100.0 * count / max(total, 1):6.2f}%  {label}")
+    return "\n".join(lines) + "\n"
+
+
+def summarize_pstats(stats, top=25):
+    """Top functions of a cProfile capture by self and by cumulative time"""
+    lines = []
+    for sort_key in ("tottime", "cumulative"):
+        out = StringIO()
+        stats.stream = out
+        stats.sort_stats(sort_key).print_stats(top)
+        lines.append(f"Top {top} functions by {sort_key}:")
+        lines.append(out.getvalue())
+    return "\n".join(lines)
+
+
+class Profiler:
+    """One worker's profiler; at most one capture runs at a time."""
+
+    def __init__(self, output_dir=PROFILE_DIR, interval_ms=PROFILER_INTERVAL_MS):
+        self.output_dir = output_dir
+        self.interval = interval_ms / 1000.0
+        self._lock = threading.Lock()
+        # cProfile can only profile one request at a time
+        self._cprofile_lock = threading.Lock()
+        self.capture = None
+        self.last_result = None
+
+    def start(self, mode="sampling", seconds=30, requests=20):
+        """
+        Start a capture.
+
+        Args:
+            mode: "sampling" or "cprofile"
+            seconds: Capture duration; a cprofile capture ends after seconds
+                even if fewer than requests requests were profiled
+            requests: Number of requests profiled with cProfile
+
+        Returns:
+            The capture status dict
+
+        Raises:
+            ValueError: Unknown mode or out-of-range duration
+            RuntimeError: A capture is already running
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiler mode {mode}; choose from {MODES}")
+        if not 0 < seconds <= MAX_CAPTURE_SECONDS:
+            raise ValueError(f"seconds must be in (0, {MAX_CAPTURE_SECONDS}]")
+        if not 0 < requests <= MAX_CAPTURE_REQUESTS:
+            raise ValueError(f"requests must be in (0, {MAX_CAPTURE_REQUESTS}]")
+
+        with self._lock:
+            if self.capture is not None:
+                raise RuntimeError("A profiler capture is already running")
+            self.capture = {
+                "mode": mode,
+                "name": f"{mode}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}",
+                "started": time.time(),
+                "seconds": seconds,
+            }
+            if mode == "sampling":
+                self.capture.update({"stacks": Counter(), "samples": 0})
+                target = self._sample
+            else:
+                self.capture.update(
+                    {
+                        "requests": requests,
+                        "profiled": 0,
+                        "stats": None,
+                        # Set once enough requests were profiled
+                        "done": threading.Event(),
+                    }
+                )
+                target = self._watch_cprofile
+            threading.Thread(
+                target=target,
+                args=(self.capture,),
+                name=f"profiler-{mode}",
+                daemon=True,
+            ).start()
+            print(f"Profiler capture {self.capture['name']} started")
+            return self.status()
+
+    def status(self):
+        """Running capture (if any) and the files of the last finished one"""
+        capture = self.capture
+        running = None
+        if capture is not None:
+            running = {
+                key: capture[key]
+                for key in ("mode", "name", "started", "seconds", "requests")
+                if key in capture
+            }
+            if capture["mode"] == "cprofile":
+                running["profiled"] = capture["profiled"]
+            else:
+                running["samples"] = capture["samples"]
+        return {"running": running, "last": self.last_result}
+
+    def _sample(self, capture):
+        try:
+            sampler = threading.get_ident()
+            deadline = time.monotonic() + capture["seconds"]
+            stacks = capture["stacks"]
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id != sampler and not _is_idle(frame):
+                        stacks[_stack(frame)] += 1
+                        capture["samples"] += 1
+                time.sleep(self.interval)
+        except Exception as e:
+            print(f"Profiler sampling stopped early: {e}")
+        self._end_capture(capture, self._write_sampling)
+
+    def _watch_cprofile(self, capture):
+        # Ends the capture at its deadline, or once enough requests are in
+        capture["done"].wait(capture["seconds"])
+        self._end_capture(capture, self._write_cprofile)
+
+    def _end_capture(self, capture, write):
+        # Free the profiler first, so no request adds to the capture while it
+        # is written and a failed write cannot block later captures
+        with self._lock:
+            if self.capture is capture:
+                self.capture = None
+        try:
+            write(capture)
+        except Exception as e:
+            print(f"Profiler capture {capture['name']} failed: {e}")
+            self.last_result = {
+                "mode": capture["mode"],
+                "name": capture["name"],
+                "error": str(e),
+            }
+
+    @contextmanager
+    def request(self):
+        """
+        Wrap one unit of request work; it is run under cProfile while a
+        cprofile capture still needs requests, and untouched otherwise.
+        Profiler errors are logged, never raised into the request.
+        """
+        capture = self.capture
+        if (
+            capture is None
+            or capture["mode"] != "cprofile"
+            or not self._cprofile_lock.acquire(blocking=False)
+        ):
+            yield
+            return
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is active in this process
+            self._cprofile_lock.release()
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            profile.disable()
+            try:
+                with self._lock:
+                    # The capture may have ended while this request ran
+                    if self.capture is capture:
+                        self._add_profile(capture, profile)
+            except Exception as e:
+                print(f"Profiler could not record a request: {e}")
+            finally:
+                self._cprofile_lock.release()
+
+    def _add_profile(self, capture, profile):
+        if capture["stats"] is None:
+            capture["stats"] = pstats.Stats(profile)
+        else:
+            capture["stats"].add(profile)
+        capture["profiled"] += 1
+        if capture["profiled"] >= capture["requests"]:
+            capture["done"].set()
+
+    def _finish(self, capture, files, summary):
+        os.makedirs(self.output_dir, exist_ok=True)
+        summary_path = os.path.join(self.output_dir, f"{capture['name']}.txt")
+        with open(summary_path, "w") as f:
+            f.write(summary)
+        files["summary"] = summary_path
+        self.last_result = {
+            "mode": capture["mode"],
+            "name": capture["name"],
+            "seconds": round(time.time() - capture["started"], 2),
+            "files": files,
+            "summary": summary,
+        }
+        print(f"Profiler capture {capture['name']} written to {self.output_dir}")
+
+    def _write_sampling(self, capture):
+        os.makedirs(self.output_dir, exist_ok=True)
+        folded_path = os.path.join(self.output_dir, f"{capture['name']}.folded")
+        with open(folded_path, "w") as f:
+            for stack, count in capture["stacks"].most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+        self._finish(
+            capture,
+            {"folded": folded_path},
+            summarize_stacks(capture["stacks"]),
+        )
+
+    def _write_cprofile(self, capture):
+        header = f"{capture['profiled']} requests\n\n"
+        if capture["stats"] is None:
+            # No request was profiled before the deadline
+            self._finish(capture, {}, header)
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        prof_path = os.path.join(self.output_dir, f"{capture['name']}.prof")
+        capture["stats"].dump_stats(prof_path)
+        self._finish(
+            capture,
+            {"prof": prof_path},
+            header + summarize_pstats(capture["stats"]),
+        )
+
+
+def load_folded(path):
+    """Read a collapsed-stack file back into a stack -> count mapping"""
+    stacks = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack:
+                stacks[tuple(stack.split(";"))] += int(count)
+    return stacks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a profiler capture")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    summary_parser = subparsers.add_parser(
+        "summary", help="Top functions of a .folded or .prof capture"
+    )
+    summary_parser.add_argument("path", type=str)
+    summary_parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    if args.path.endswith(".prof"):
+        print(summarize_pstats(pstats.Stats(args.path), top=args.top))
+    else:
+        print(summarize_stacks(load_folded(args.path), top=args.top))
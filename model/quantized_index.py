@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Scalar-quantized FAISS storage with full-precision rescoring.
+
+A scalar-quantized index keeps each vector as float16 (2x smaller than
+float32) or int8 (4x smaller) codes, so the copy of the catalogue held in
+every worker's RAM shrinks accordingly. Searching the codes is approximate, so
+a search fetches RESCORE_FACTOR times the requested candidates and re-ranks
+them by exact distance against the full-precision vectors, which are read
+row-by-row from the memory-mapped vector store (see vector_store.py) and
+shared through the OS page cache rather than held per process.
+"""
+
+import os
+import numpy as np
+import faiss
+
+STORAGE_TYPES = ("float32", "float16", "int8")
+
+# Candidates fetched per requested result before exact rescoring
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
+
+_QUANTIZER_TYPES = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def scalar_quantizer(matrix, storage, metric=faiss.METRIC_INNER_PRODUCT):
+    """
+    Create an empty, trained scalar-quantized index.
+
+    Args:
+        matrix: float32 training vectors (the catalogue itself)
+        storage: "float16" or "int8"
+        metric: FAISS metric of the index
+
+    Returns:
+        An IndexScalarQuantizer ready for add() / add_with_ids()
+    """
+    if storage not in _QUANTIZER_TYPES:
+        raise ValueError(f"No scalar quantizer for storage {storage}")
+    matrix = np.ascontiguousarray(matrix, dtype="float32")
+    index = faiss.IndexScalarQuantizer(
+        matrix.shape[1], _QUANTIZER_TYPES[storage], metric
+    )
+    # int8 learns a value range per dimension; float16 needs no training
+    index.train(matrix)
+    return index
+
+
+def storage_of(index):
+    """Return "float16"/"int8" for a scalar-quantized index, else "float32" """
+    inner = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        for storage, qtype in _QUANTIZER_TYPES.items():
+            if inner.sq.qtype == qtype:
+                return storage
+    return "float32"
+
+
+def is_scalar_quantized(index):
+    return storage_of(index) != "float32"
+
+
+def quantized_index_path(index_path, storage):
+    """Path of the scalar-quantized sibling of a saved index"""
+    base, ext = os.path.splitext(index_path)
+    return f"{base}.{storage}{ext}"
+
+
+def load_index(index_path, vectors, storage="float32", metric=faiss.METRIC_L2):
+    """
+    Load a saved positional index, or its scalar-quantized sibling.
+
+    The quantized index is built from vectors on first use and saved next to
+    index_path; it is rebuilt whenever index_path is newer.
+
+    Args:
+        index_path: Saved full-precision index (ids are row positions)
+        vectors: Full-precision vectors the index was built from
+        storage: One of STORAGE_TYPES
+        metric: FAISS metric of the saved index
+    """
+    if storage not in STORAGE_TYPES:
+        raise ValueError(
+            f"Unknown index storage {storage}; choose from {STORAGE_TYPES}"
+        )
+    if storage == "float32":
+        return faiss.read_index(index_path)
+
+    path = quantized_index_path(index_path, storage)
+    if os.path.exists(path) and (
+        not os.path.exists(index_path)
+        or os.path.getmtime(path) >= os.path.getmtime(index_path)
+    ):
+        return faiss.read_index(path)
+
+    print(f"Building {storage} index at {path}...")
+    matrix = np.ascontiguousarray(vectors, dtype="float32")
+    index = scalar_quantizer(matrix, storage, metric)
+    index.add(matrix)
+    faiss.write_index(index, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+    return index
+
+
+def rescore(queries, hit_ids, vectors, rows_by_id=None, metric=None):
+    """
+    Re-rank candidate ids by exact distance to full-precision vectors.
+
+    Args:
+        queries: float32 query matrix, one row per query
+        hit_ids: Candidate ids per query as returned by index.search (-1 = none)
+        vectors: Full-precision matrix (a memmap is only read at the candidates)
+        rows_by_id: Array mapping an id to its row in vectors (-1 = absent);
+            None when ids are row positions
+        metric: faiss.METRIC_INNER_PRODUCT (default) or faiss.METRIC_L2
+
+    Returns:
+        (distances, ids) shaped like hit_ids, best first and padded with -1
+        ids, following FAISS conventions (squared distances for L2)
+    """
+    l2 = metric == faiss.METRIC_L2
+    queries = np.asarray(queries, dtype=np.float32)
+    out_ids = np.full(hit_ids.shape, -1, dtype="int64")
+    out_distances = np.full(
+        hit_ids.shape,
+        np.finfo(np.float32).max if l2 else -np.finfo(np.float32).max,
+        dtype=np.float32,
+    )
+
+    for i, (query, candidates) in enumerate(zip(queries, hit_ids)):
+        candidates = candidates[candidates >= 0]
+        if rows_by_id is not None:
+            candidates = candidates[candidates < len(rows_by_id)]
+            rows = rows_by_id[candidates]
+            candidates, rows = candidates[rows >= 0], rows[rows >= 0]
+        else:
+            rows = candidates
+        if not len(rows):
+            continue
+
+        # Read the memmap in row order so the page cache sees sequential access
+        order = np.argsort(rows)
+        candidates = candidates[order]
+        exact = np.asarray(vectors[rows[order]], dtype=np.float32)
+
+        if l2:
+            scores = np.sum((exact - query) ** 2, axis=1)
+            ranking = np.argsort(scores, kind="stable")
+        else:
+            scores = exact @ query
+            ranking = np.argsort(-scores, kind="stable")
+
+        out_ids[i, : len(ranking)] = candidates[ranking]
+        out_distances[i, : len(ranking)] = scores[ranking]
+
+    return out_distances, out_ids
+
+
+def search_rescored(
+    index, queries, k, vectors, rows_by_id=None, factor=RESCORE_FACTOR, params=None
+):
+    """
+    Search an index, rescoring against exact vectors if it is scalar-quantized.
+
+    Full-precision indexes are searched directly, so callers can use this for
+    every index type.
+    """
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    if not is_scalar_quantized(index) or vectors is None:
+        return index.search(queries, k, params=params)
+
+    _, hit_ids = index.search(queries, k * max(1, factor), params=params)
+    distances, ids = rescore(
+        queries, hit_ids, vectors, rows_by_id=rows_by_id, metric=index.metric_type
+    )
+    return distances[:, :k], ids[:, :k]
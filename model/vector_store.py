@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+"""
+Memory-mapped vector store for embeddings.
+
+A store is three files sharing a base path:
+    <base>.<version>.vectors.npy  float32 or float16 matrix, one row per item
+    <base>.<version>.ids.npy      ID column aligned with the rows (optional)
+    <base>.meta.json              header: format version, count, dim, dtype,
+                                  normalized and the data file names
+
+Each save writes its data files under a new version and then replaces the
+header, so the header swap alone publishes a rewrite: a reader opening the
+store mid-save still gets the previous version's files. Stores written
+before versioning (<base>.vectors.npy, no file names in the header) still load.
+
+Both arrays are plain .npy files opened with np.load(mmap_mode="r"), so
+opening a store costs a header read, rows are accessed zero-copy, and every
+worker process on a box shares the same pages through the OS page cache
+instead of each unpickling a private copy.
+
+Convert an existing pickle once with:
+    python vector_store.py <embeddings.pkl> <output_base> [--dtype float16]
+"""
+
+import os
+import json
+import time
+import pickle
+import argparse
+from collections.abc import Mapping
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+def store_paths(base_path, version=None):
+    """Return the (vectors, ids, meta) file paths for a store version"""
+    prefix = base_path if version is None else f"{base_path}.{version}"
+    return (
+        f"{prefix}.vectors.npy",
+        f"{prefix}.ids.npy",
+        f"{base_path}.meta.json",
+    )
+
+
+def _data_paths(base_path, meta):
+    # The header names its data files; unversioned stores use the plain names
+    vectors_path, ids_path, _ = store_paths(base_path)
+    directory = os.path.dirname(base_path)
+    if "vectors_file" in meta:
+        vectors_path = os.path.join(directory, meta["vectors_file"])
+    if meta.get("ids_file"):
+        ids_path = os.path.join(directory, meta["ids_file"])
+    return vectors_path, ids_path
+
+
+def _read_meta(meta_path):
+    with open(meta_path, "r") as f:
+        return json.load(f)
+
+
+def store_exists(base_path):
+    """A store is complete once its header has been written"""
+    return os.path.exists(store_paths(base_path)[2])
+
+
+def _atomic_write(target_path, write_fn, mode="wb"):
+    # Readers must never see a half-written file
+    tmp_path = f"{target_path}.tmp"
+    with open(tmp_path, mode) as f:
+        write_fn(f)
+    os.replace(tmp_path, target_path)
+
+
+def save_vector_store(base_path, vectors, ids=None, dtype="float32", normalized=False):
+    """
+    Write vectors (and an optional aligned ID column) as a memory-mappable store.
+
+    Args:
+        base_path: Path prefix for the store files
+        vectors: 2-D array-like, one row per item (a memmap is streamed, not copied)
+        ids: Optional sequence of str or int IDs aligned with the rows
+        dtype: On-disk vector dtype, "float32" or "float16"
+        normalized: Whether rows are already L2-normalized
+    """
+    # Validate everything before touching the current store's files
+    vectors = np.asarray(vectors)
+    if vectors.ndim != 2:
+        raise ValueError(f"Expected a 2-D vector matrix, got shape {vectors.shape}")
+    if dtype not in ("float32", "float16"):
+        raise ValueError(f"Unsupported vector dtype: {dtype}")
+    if ids is not None:
+        ids = np.asarray(ids)
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} vectors")
+        # Object arrays cannot be memory-mapped; store fixed-width strings
+        if ids.dtype == object:
+            ids = ids.astype(str)
+
+    meta_path = store_paths(base_path)[2]
+    previous = _read_meta(meta_path) if os.path.exists(meta_path) else None
+
+    version = f"{time.time_ns():x}"
+    vectors_path, ids_path, _ = store_paths(base_path, version)
+    _atomic_write(vectors_path, lambda f: np.save(f, vectors.astype(dtype, copy=False)))
+    if ids is not None:
+        _atomic_write(ids_path, lambda f: np.save(f, ids))
+
+    # The header goes last and is the only step that publishes the new files
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "count": int(vectors.shape[0]),
+        "dim": int(vectors.shape[1]),
+        "dtype": dtype,
+        "normalized": bool(normalized),
+        "has_ids": ids is not None,
+        "vectors_file": os.path.basename(vectors_path),
+        "ids_file": os.path.basename(ids_path) if ids is not None else None,
+    }
+    _atomic_write(meta_path, lambda f: json.dump(meta, f, indent=2), mode="w")
+
+    if previous is not None:
+        _remove_data_files(base_path, previous)
+
+
+def _remove_data_files(base_path, meta):
+    # Readers that already mapped these keep their view on POSIX; on Windows
+    # a mapped file cannot be deleted and is left for the next save
+    for path in _data_paths(base_path, meta):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class VectorStore(Mapping):
+    """
+    Read-only, memory-mapped view of a vector store.
+
+    Behaves like a dict from ID to vector (row position when the store has no
+    ID column), and exposes the whole matrix as ``vectors`` for bulk use.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        try:
+            self._open()
+        except FileNotFoundError:
+            # A save published a new version and removed the files named by
+            # the header read above; the new header names files that exist
+            self._open()
+        if self.vectors.shape != (self.meta["count"], self.meta["dim"]):
+            raise ValueError(
+                f"Vector store {base_path} does not match its header"
+            )
+        self._row_by_id = None
+
+    def _open(self):
+        self.meta = _read_meta(store_paths(self.base_path)[2])
+        if self.meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported vector store version: {self.meta.get('format_version')}"
+            )
+        vectors_path, ids_path = _data_paths(self.base_path, self.meta)
+        self.vectors = np.load(vectors_path, mmap_mode="r")
+        self.ids = np.load(ids_path, mmap_mode="r") if self.meta["has_ids"] else None
+
+    @property
+    def normalized(self):
+        return self.meta["normalized"]
+
+    def as_float32(self):
+        """Return the matrix as float32 (zero-copy unless stored as float16)"""
+        return np.asarray(self.vectors, dtype=np.float32)
+
+    def row_of(self, key):
+        """Return the row position of an ID"""
+        if self.ids is None:
+            return int(key)
+        if self._row_by_id is None:
+            self._row_by_id = {k: i for i, k in enumerate(self.ids.tolist())}
+        return self._row_by_id[key]
+
+    def __getitem__(self, key):
+        return self.vectors[self.row_of(key)]
+
+    def __iter__(self):
+        if self.ids is None:
+            return iter(range(len(self)))
+        return iter(self.ids.tolist())
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+
+def load_vector_store(base_path):
+    """Open a store if it exists, else return None"""
+    if not store_exists(base_path):
+        return None
+    return VectorStore(base_path)
+
+
+def open_or_convert(base_path, pickle_path):
+    """
+    Open the store at base_path, converting the legacy pickle first if needed.
+
+    Returns the store's float32 matrix (memory-mapped unless stored as
+    float16), or None when neither the store nor the pickle exists.
+    """
+    if not store_exists(base_path):
+        if not os.path.exists(pickle_path):
+            return None
+        convert_pickle(pickle_path, base_path)
+    return VectorStore(base_path).as_float32()
+
+
+def load_embedding_matrix(base_path, pickle_path=None):
+    """
+    Return a row-normalized float32 embedding matrix.
+
+    Reads the vector store at base_path zero-copy when it is already float32
+    and normalized; otherwise falls back to the legacy pickle and normalizes
+    an in-memory copy.
+    """
+    store = load_vector_store(base_path)
+    if store is not None:
+        if store.normalized and store.vectors.dtype == np.float32:
+            return store.vectors
+        matrix = store.as_float32().copy()
+    elif pickle_path and os.path.exists(pickle_path):
+        with open(pickle_path, "rb") as f:
+            embeddings = pickle.load(f)
+        matrix = np.ascontiguousarray(np.vstack(embeddings), dtype=np.float32)
+    else:
+        raise FileNotFoundError(f"No vector store at {base_path} or pickle fallback")
+
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    return matrix
+
+
+def convert_pickle(pickle_path, base_path, dtype="float32"):
+    """
+    Convert one of our pickled embedding files into a vector store.
+
+    Handles a list/array of vectors, a dict of ID to vector, and the combined
+    {"embeddings": {...}, "metadata": ...} format.
+    """
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+
+    if isinstance(data, dict) and "embeddings" in data:
+        data = data["embeddings"]
+
+    if isinstance(data, dict):
+        ids = list(data.keys())
+        vectors = np.vstack(list(data.values()))
+    else:
+        ids = None
+        vectors = np.vstack(data) if isinstance(data, list) else np.asarray(data)
+
+    norms = np.linalg.norm(vectors.astype(np.float32), axis=1)
+    normalized = bool(np.allclose(norms, 1.0, atol=1e-3))
+    save_vector_store(base_path, vectors, ids=ids, dtype=dtype, normalized=normalized)
+    print(f"Converted {len(vectors)} vectors from {pickle_path} to {base_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a pickled embedding file to a memory-mapped vector store"
+    )
+    parser.add_argument("pickle_path", type=str)
+    parser.add_argument("base_path", type=str)
+    parser.add_argument(
+        "--dtype", type=str, default="float32", choices=["float32", "float16"]
+    )
+    args = parser.parse_args()
+
+    convert_pickle(args.pickle_path, args.base_path, dtype=args.dtype)
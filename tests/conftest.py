@@ -0,0 +1,15 @@
+import os
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The Python services are run as scripts from their own directories, so make
+# their modules importable the same way
+for directory in (
+    PROJECT_ROOT,
+    os.path.join(PROJECT_ROOT, "model"),
+    os.path.join(PROJECT_ROOT, "Recomend"),
+    os.path.join(PROJECT_ROOT, "app", "api", "image-search"),
+):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
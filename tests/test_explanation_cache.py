@@ -0,0 +1,66 @@
+from explanation_cache import ExplanationCache
+
+USER = {"skin_tone": "Fair", "season": "Summer", "event": "Party", "budget": "Low"}
+
+
+def _cache(path, ttl_seconds=3600, max_entries=100, prompt_version=1):
+    return ExplanationCache(str(path), prompt_version, ttl_seconds, max_entries)
+
+
+def test_hits_and_misses(tmp_path):
+    cache = _cache(tmp_path / "cache.db")
+    cache.put_many(USER, {1: "Looks great", "2": "Fits the event"})
+
+    found = cache.get_many(USER, [1, 2, 3])
+
+    assert found == {"1": "Looks great", "2": "Fits the event"}
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_preferences_are_normalized(tmp_path):
+    cache = _cache(tmp_path / "cache.db")
+    cache.put_many(USER, {1: "Looks great"})
+
+    shouted = {key: f"  {value.upper()} " for key, value in USER.items()}
+    assert cache.get_many(shouted, [1]) == {"1": "Looks great"}
+    assert cache.get_many(dict(USER, event="Wedding"), [1]) == {}
+
+
+def test_expired_entries_are_not_served(tmp_path, monkeypatch):
+    cache = _cache(tmp_path / "cache.db", ttl_seconds=60)
+    monkeypatch.setattr("explanation_cache.time.time", lambda: 1000.0)
+    cache.put_many(USER, {1: "Looks great"})
+
+    monkeypatch.setattr("explanation_cache.time.time", lambda: 1059.0)
+    assert cache.get_many(USER, [1]) == {"1": "Looks great"}
+    monkeypatch.setattr("explanation_cache.time.time", lambda: 1061.0)
+    assert cache.get_many(USER, [1]) == {}
+
+
+def test_prompt_version_invalidates(tmp_path):
+    _cache(tmp_path / "cache.db", prompt_version=1).put_many(USER, {1: "Old"})
+
+    assert _cache(tmp_path / "cache.db", prompt_version=2).get_many(USER, [1]) == {}
+
+
+def test_least_recently_used_evicted(tmp_path, monkeypatch):
+    cache = _cache(tmp_path / "cache.db", max_entries=2)
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr("explanation_cache.time.time", lambda: float(next(clock)))
+
+    cache.put_many(USER, {1: "one"})
+    cache.put_many(USER, {2: "two"})
+    cache.get_many(USER, [1])  # 2 is now the least recently used
+    cache.put_many(USER, {3: "three"})
+
+    assert len(cache) == 2
+    assert set(cache.get_many(USER, [1, 2, 3])) == {"1", "3"}
+
+
+def test_empty_explanations_are_not_cached(tmp_path):
+    cache = _cache(tmp_path / "cache.db")
+    cache.put_many(USER, {1: None, 2: "", 3: "  ", 4: "Real text"})
+
+    assert len(cache) == 1
+    assert cache.get_many(USER, [1, 2, 3, 4]) == {"4": "Real text"}
+
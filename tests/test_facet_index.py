@@ -0,0 +1,130 @@
+import faiss
+import numpy as np
+import pandas as pd
+import pytest
+
+from facet_index import FacetIndex, search_filtered
+from model.quantized_index import scalar_quantizer
+
+PRICE_RANGES = {
+    "budget": (0, 5000),
+    "mid_range": (5001, 10000),
+    "premium": (10001, float("inf")),
+}
+FACETS = ["Skin Tone Category", "Occasion", "Product Type"]
+
+
+def _products(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    prices = rng.integers(500, 20000, size=n).astype(object)
+    prices[3] = "n/a"  # Unparseable prices belong to no bucket
+    return pd.DataFrame(
+        {
+            "Skin Tone Category": rng.choice(["Fair", "Medium", "Dark"], size=n),
+            "Occasion": rng.choice(["Party", "Casual", "Wedding"], size=n),
+            "Product Type": rng.choice(["Kurti", "Saree"], size=n),
+            "Price": prices,
+        }
+    )
+
+
+def _embeddings(n, dim=16, seed=1):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, dim)).astype("float32")
+
+
+def test_bitsets_are_little_endian():
+    df = pd.DataFrame({"Occasion": ["Party"] + ["Casual"] * 8 + ["Party"], "Price": 1})
+    facets = FacetIndex(df, ["Occasion"], PRICE_RANGES)
+
+    # Products 0 and 9 -> bit 0 of byte 0 and bit 1 of byte 1
+    bits = facets.facet("Occasion", "Party")
+    assert bits.tolist() == [0b1, 0b10]
+
+    # The layout faiss.IDSelectorBitmap reads
+    selector = faiss.IDSelectorBitmap(bits)
+    assert [i for i in range(len(df)) if selector.is_member(i)] == [0, 9]
+
+
+def test_filters_match_dataframe_queries():
+    df = _products()
+    facets = FacetIndex(df, FACETS + ["Missing Column"], PRICE_RANGES)
+    prices = pd.to_numeric(df["Price"], errors="coerce")
+
+    assert not facets.has_facet("Missing Column")
+    for column in FACETS:
+        for value in df[column].unique():
+            expected = df.index[df[column] == value].tolist()
+            assert facets.to_indices(facets.facet(column, value)) == expected
+    for name, (low, high) in PRICE_RANGES.items():
+        expected = df.index[(prices >= low) & (prices <= high)].tolist()
+        assert facets.to_indices(facets.price_bucket(name)) == expected
+
+    bits = facets.price_bucket("budget") & facets.facet("Occasion", "Party")
+    expected = df.index[(prices <= 5000) & (df["Occasion"] == "Party")].tolist()
+    assert facets.to_indices(bits) == expected
+    assert facets.count(bits) == len(expected)
+    assert 3 not in facets.to_indices(facets.price_between(0, float("inf")))
+
+
+def test_unseen_value_and_empty_filter():
+    facets = FacetIndex(_products(), FACETS, PRICE_RANGES)
+    bits = facets.facet("Occasion", "Funeral")
+
+    assert facets.to_indices(bits) == []
+    assert facets.count(bits) == 0
+    assert facets.count(facets.all()) == 60
+
+
+def test_rejects_non_positional_index():
+    with pytest.raises(ValueError):
+        FacetIndex(_products().iloc[5:], FACETS, PRICE_RANGES)
+
+
+def _temporary_index_search(vectors, query, indices, top_n):
+    # The previous implementation: a throwaway IndexFlatL2 per request
+    filtered = faiss.IndexFlatL2(vectors.shape[1])
+    filtered.add(vectors[indices])
+    D, I = filtered.search(query, min(top_n, len(indices)))
+    return D[0], [indices[i] for i in I[0]]
+
+
+@pytest.mark.parametrize("storage", ["float32", "float16"])
+def test_bitmap_search_matches_temporary_index(storage):
+    df = _products()
+    vectors = _embeddings(len(df))
+    if storage == "float32":
+        index = faiss.IndexFlatL2(vectors.shape[1])
+    else:
+        index = scalar_quantizer(vectors, storage, faiss.METRIC_L2)
+    index.add(vectors)
+    facets = FacetIndex(df, FACETS, PRICE_RANGES)
+    query = _embeddings(1, seed=2)
+
+    for bits in (
+        facets.price_bucket("mid_range"),
+        facets.price_bucket("budget") & facets.facet("Skin Tone Category", "Fair"),
+        facets.facet("Product Type", "Saree"),
+    ):
+        indices = facets.to_indices(bits)
+        distances, found = search_filtered(index, vectors, query, bits, 5)
+        expected_distances, expected = _temporary_index_search(
+            vectors, query, indices, 5
+        )
+        assert found == expected
+        np.testing.assert_allclose(distances, expected_distances, rtol=1e-5)
+
+
+def test_bitmap_search_with_empty_filter_returns_nothing():
+    df = _products()
+    vectors = _embeddings(len(df))
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    facets = FacetIndex(df, FACETS, PRICE_RANGES)
+
+    distances, found = search_filtered(
+        index, vectors, _embeddings(1, seed=2), facets.facet("Occasion", "Funeral"), 5
+    )
+    assert found == []
+    assert len(distances) == 0
+
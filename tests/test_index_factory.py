@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from index_factory import INDEX_TYPES, build_index, index_type_of, supports_removal
+
+
+def _unit_vectors(n, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.normal(size=(n, dim)).astype("float32")
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_index_type_round_trips(index_type):
+    matrix = _unit_vectors(2000, 64)
+    index = build_index(matrix, np.arange(len(matrix)), index_type=index_type)
+
+    assert index_type_of(index) == index_type
+    assert supports_removal(index) == (index_type != "hnsw")
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from product_index import ProductIndex
+
+
+def _catalogue(n_products=40, max_images=5, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    product_ids = []
+    for product in range(n_products):
+        product_ids += [f"P{product}"] * int(rng.integers(1, max_images + 1))
+    product_ids[3] = None  # An image without a product stands alone
+    vectors = rng.normal(size=(len(product_ids), dim)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    # Sparse, non-positional FAISS ids
+    faiss_ids = np.arange(len(product_ids), dtype="int64") * 3 + 7
+    return vectors, product_ids, faiss_ids
+
+
+def _brute_force(vectors, product_ids, faiss_ids, query, top_k):
+    # Best image of every product, then the top_k products by that score
+    best = {}
+    for row, score in enumerate(vectors @ query):
+        key = product_ids[row] if product_ids[row] is not None else ("image", row)
+        if key not in best or score > best[key][0]:
+            best[key] = (score, faiss_ids[row])
+    ranked = sorted(best.values(), key=lambda hit: -hit[0])[:top_k]
+    return [float(score) for score, _ in ranked], [int(i) for _, i in ranked]
+
+
+def _queries(dim=16, n=10, seed=1):
+    queries = np.random.default_rng(seed).normal(size=(n, dim)).astype("float32")
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("top_k", [1, 5, 12])
+def test_matches_brute_force_when_every_product_is_a_candidate(top_k):
+    vectors, product_ids, faiss_ids = _catalogue()
+    index = ProductIndex(
+        vectors, product_ids, faiss_ids, index_type="flat", candidate_factor=1000
+    )
+    queries = _queries()
+
+    similarities, hit_ids = index.search(queries, top_k)
+
+    for query, scores, ids in zip(queries, similarities, hit_ids):
+        expected_scores, expected_ids = _brute_force(
+            vectors, product_ids, faiss_ids, query, top_k
+        )
+        assert ids.tolist() == expected_ids
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+def test_returns_top_k_distinct_products():
+    vectors, product_ids, faiss_ids = _catalogue()
+    index = ProductIndex(vectors, product_ids, faiss_ids, index_type="flat")
+    product_of = dict(zip(faiss_ids.tolist(), product_ids))
+
+    _, hit_ids = index.search(_queries(), 8)
+
+    for ids in hit_ids:
+        assert (ids >= 0).all()
+        products = [product_of[i] or ("image", i) for i in ids.tolist()]
+        assert len(set(products)) == 8
+
+
+def test_pads_when_catalogue_is_smaller_than_top_k():
+    vectors, product_ids, faiss_ids = _catalogue(n_products=3)
+    index = ProductIndex(vectors, product_ids, faiss_ids, index_type="flat")
+
+    similarities, hit_ids = index.search(_queries(n=1), 10)
+
+    found = int((hit_ids[0] >= 0).sum())
+    assert found == len(set(map(str, product_ids)))
+    assert (hit_ids[0, found:] == -1).all()
+    assert np.isneginf(similarities[0, found:]).all()
+
+
+def test_save_and_load_round_trip(tmp_path):
+    vectors, product_ids, faiss_ids = _catalogue()
+    index_path = str(tmp_path / "dinov2_index.faiss")
+    built = ProductIndex(vectors, product_ids, faiss_ids, index_type="flat")
+    built.save(index_path, "signature-1")
+
+    loaded = ProductIndex.load(index_path, vectors, "signature-1")
+
+    assert loaded is not None
+    assert loaded.ntotal == built.ntotal
+    queries = _queries()
+    for expected, actual in zip(built.search(queries, 5), loaded.search(queries, 5)):
+        np.testing.assert_array_equal(expected, actual)
+
+
+def test_load_rejects_stale_or_missing_index(tmp_path):
+    vectors, product_ids, faiss_ids = _catalogue()
+    index_path = str(tmp_path / "dinov2_index.faiss")
+    assert ProductIndex.load(index_path, vectors, "signature-1") is None
+
+    ProductIndex(vectors, product_ids, faiss_ids, index_type="flat").save(
+        index_path, "signature-1"
+    )
+    assert ProductIndex.load(index_path, vectors, "signature-2") is None
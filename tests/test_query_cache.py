@@ -0,0 +1,77 @@
+import threading
+
+from query_cache import LRUCache, image_digest
+
+
+def test_least_recently_used_is_evicted():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # b is now the least recently used
+
+    cache.put("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_put_refreshes_an_existing_key():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.put("a", 10)
+
+    cache.put("c", 3)
+
+    assert cache.get("a") == 10
+    assert cache.get("b") is None
+
+
+def test_hit_and_miss_counters():
+    cache = LRUCache(max_entries=4)
+    cache.put("a", 1)
+
+    cache.get("a")
+    cache.get("a")
+    cache.get("missing")
+
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_zero_entries_disables_the_cache():
+    cache = LRUCache(max_entries=0)
+    cache.put("a", 1)
+
+    assert len(cache) == 0
+    assert cache.get("a") is None
+
+
+def test_clear():
+    cache = LRUCache(max_entries=4)
+    cache.put("a", 1)
+    cache.clear()
+
+    assert len(cache) == 0
+
+
+def test_concurrent_puts_stay_bounded():
+    cache = LRUCache(max_entries=50)
+
+    def fill(offset):
+        for i in range(500):
+            cache.put((offset, i), i)
+            cache.get((offset, i - 1))
+
+    threads = [threading.Thread(target=fill, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(cache) == 50
+
+
+def test_image_digest_is_content_addressed():
+    assert image_digest(b"same bytes") == image_digest(b"same bytes")
+    assert image_digest(b"same bytes") != image_digest(b"other bytes")